@@ -0,0 +1,233 @@
+# accounts.py — several EDP accounts in one add-on
+"""
+A household can have several EDP contracts, each with its own login and its
+own vouchers. `accounts` in the options names the extra ones ({name,
+ntfy_topic}); a target's optional `account` says whose it is. Targets
+without one belong to the main account, which keeps the top-level
+ntfy_topic and /data exactly as before.
+
+Every extra account runs as its own monitor process (edp_monitor.py with
+EDP_ACCOUNT set). Each process has its own Chromium profile, claim journal,
+restock log and browser state under /data/accounts/<slug>/, and its own
+noVNC and control API ports, offset by the account's index. So a login wait
+or a crash in one account never holds up the others. AccountRunner starts
+them from the main process, restarts one that exits, and stops them with it.
+
+BrowserPool bounds how many accounts drive their browser at the same moment
+(`browser_pool_size`): a supervised browser step holds one of N flock'd
+slot files, and a race takes one per pre-load, poll slice and claim. It
+doesn't bound memory: profiles can't be shared between logins, and
+Chromium's in-memory browser contexts lose theirs on every restart, so
+every account with its browser up runs its own Chromium and chromedriver
+(plus a warm standby one). Idle browsers hibernate, as with a single
+account. Stdlib only.
+"""
+
+import fcntl
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from helpers import die_with_parent, entity_slug, log
+
+ACCOUNTS_DIR = "accounts"  # under the data directory
+RESTART_DELAYS = (5, 30, 120, 600)  # seconds; backoff for a failing account
+STABLE_RUN = 600  # seconds up after which an account's failures are forgotten
+# The main account's X display and noVNC port; extra account n uses base + n
+DISPLAY_BASE = 99
+NOVNC_BASE_PORT = 6080
+MAPPED_NOVNC_ACCOUNTS = 3  # config.yaml maps noVNC ports 6081-6083
+
+
+def account_plan(config: dict, data_dir: str = "/data",
+                 warn: bool = True) -> list:
+    """The extra accounts that have targets, as [{name, slug, index,
+    data_dir, ntfy_topic}]. `index` (1, 2, ...) follows the options order and
+    stays the same when an account is skipped, so ports don't move.
+    Misconfigurations are logged if `warn`."""
+    plan, slugs = [], set()
+    names = set()
+    for index, account in enumerate(config.get("accounts") or [], start=1):
+        name = account["name"]
+        names.add(name)
+        slug = entity_slug(name)
+        while slug in slugs:
+            slug += "_"
+        slugs.add(slug)
+        if not any(t.get("account") == name for t in config["targets"]):
+            if warn:
+                log(f"Account {name!r} has no targets — not started", "WARN")
+            continue
+        if warn and index > MAPPED_NOVNC_ACCOUNTS:
+            log(f"Account {name!r}: its noVNC port "
+                f"{NOVNC_BASE_PORT + index} isn't mapped by the add-on — "
+                "logging in needs it mapped under Network", "WARN")
+        plan.append({
+            "name": name,
+            "slug": slug,
+            "index": index,
+            "data_dir": os.path.join(data_dir, ACCOUNTS_DIR, slug),
+            "ntfy_topic": account.get("ntfy_topic") or config["ntfy_topic"],
+        })
+    for target in config["targets"] if warn else ():
+        if target.get("account") and target["account"] not in names:
+            log(f"Target {target['name']!r} names unknown account "
+                f"{target['account']!r} — ignored", "WARN")
+    return plan
+
+
+def account_config(config: dict, account: dict | None = None) -> dict:
+    """The options one monitor process runs with: the targets of `account`
+    (a plan entry; None for the main account) and its ntfy topic."""
+    name = account["name"] if account else ""
+    narrowed = {**config, "targets": [t for t in config["targets"]
+                                      if (t.get("account") or "") == name]}
+    if account is not None:
+        narrowed["ntfy_topic"] = account["ntfy_topic"]
+    return narrowed
+
+
+def account_env(account: dict) -> dict:
+    """Environment that makes edp_monitor.py run as `account`. DISPLAY is
+    the account's own from the start, so every process it spawns (a warm
+    standby chromedriver included) opens headed windows on it."""
+    return {"EDP_ACCOUNT": account["name"],
+            "EDP_ACCOUNT_SLUG": account["slug"],
+            "EDP_DATA_DIR": account["data_dir"],
+            "EDP_ACCOUNT_INDEX": str(account["index"]),
+            "DISPLAY": f":{DISPLAY_BASE + account['index']}"}
+
+
+class AccountRunner:
+    """Keeps one `command` process per account running, each with the
+    account's environment on top of this process's."""
+
+    def __init__(self, accounts: list, command: list,
+                 stop_timeout: float = 20):
+        self.accounts = accounts
+        self.command = command
+        self.stop_timeout = stop_timeout
+        self.procs = {}  # name -> (Popen, started monotonic)
+        self._failures = {}
+        self._restart_at = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        for account in self.accounts:
+            self._spawn(account)
+        self._thread = threading.Thread(target=self._watch, name="accounts",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """SIGTERM every account process; SIGKILL what's left after
+        `stop_timeout` seconds."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        procs = [proc for proc, _ in self.procs.values()]
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.stop_timeout
+        for proc in procs:
+            try:
+                proc.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    def _spawn(self, account: dict) -> None:
+        os.makedirs(account["data_dir"], exist_ok=True)
+        try:
+            proc = subprocess.Popen(self.command,
+                                    env={**os.environ, **account_env(account)},
+                                    preexec_fn=die_with_parent)
+        except OSError as e:
+            log(f"Could not start account {account['name']!r}: {e}", "ERROR")
+            self._schedule_restart(account)
+            return
+        self.procs[account["name"]] = (proc, time.monotonic())
+        log(f"Account {account['name']!r} started (pid {proc.pid}, "
+            f"data in {account['data_dir']})")
+
+    def _schedule_restart(self, account: dict) -> None:
+        failures = self._failures.get(account["name"], 0)
+        delay = RESTART_DELAYS[min(failures, len(RESTART_DELAYS) - 1)]
+        self._failures[account["name"]] = failures + 1
+        self._restart_at[account["name"]] = time.monotonic() + delay
+        log(f"Account {account['name']!r} restarts in {delay}s", "WARN")
+
+    def _watch(self) -> None:
+        while not self._stop.wait(1):
+            for account in self.accounts:
+                name = account["name"]
+                if name in self._restart_at:
+                    if time.monotonic() >= self._restart_at[name]:
+                        del self._restart_at[name]
+                        self._spawn(account)
+                    continue
+                proc, started = self.procs[name]
+                if proc.poll() is None:
+                    continue
+                log(f"Account {name!r} exited with {proc.returncode}", "WARN")
+                if time.monotonic() - started >= STABLE_RUN:
+                    self._failures[name] = 0
+                self._schedule_restart(account)
+
+
+class BrowserPool:
+    """At most `size` processes hold a slot at once: slot i is an exclusive
+    flock on <lock_dir>/slot-<i>.lock, released by the kernel if the holder
+    dies. Within one process slot() is re-entrant (nested steps share the
+    slot)."""
+
+    def __init__(self, lock_dir: str, size: int, poll: float = 0.05):
+        self.lock_dir = lock_dir
+        self.size = size
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._fd = None
+
+    @contextmanager
+    def slot(self, label: str, cancel: threading.Event | None = None):
+        """Hold a slot for the block, waiting for one if all are taken.
+        Yields without one if `cancel` is set while waiting."""
+        with self._lock:
+            nested = self._depth > 0
+            self._depth += 1
+        try:
+            if not nested:
+                started = time.monotonic()
+                self._fd = self._acquire(cancel)
+                waited = time.monotonic() - started
+                if waited >= 1:
+                    log(f"Waited {waited:.1f}s for a browser slot ({label})")
+            yield
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0 and self._fd is not None:
+                    os.close(self._fd)  # drops the flock
+                    self._fd = None
+
+    def _acquire(self, cancel: threading.Event | None) -> int | None:
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            for i in range(self.size):
+                fd = os.open(os.path.join(self.lock_dir, f"slot-{i}.lock"),
+                             os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if cancel is None:
+                time.sleep(self.poll)
+            elif cancel.wait(self.poll):
+                return None
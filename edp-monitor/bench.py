@@ -0,0 +1,232 @@
+# bench.py — end-to-end latency benchmark against mock_portal.py
+"""
+Runs run_one_attempt and sync_history_from_portal against a local mock EDP
+portal in a throwaway headless Chromium profile, and reports wall time and
+driver command counts per scenario, for the Selenium (chromedriver) and the
+CDP (cdp_backend.py) browser backends. A second table gives per-command
+round-trip latency of each backend on a rendered detail page. Needs selenium
++ Chromium/chromedriver (and websocket-client for CDP); never touches /data
+or ntfy.sh.
+
+Run with: python3 bench.py [--render-delay-ms 800] [--repeat 3] [--backend cdp]
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from helpers import month_key
+from mock_portal import MockPortal
+
+TARGETS = [{"name": "Pingo Doce", "partner_id": 1197},
+           {"name": "Domino's", "partner_id": 1199},
+           {"name": "Galp", "partner_id": 1201}]
+
+# (label, kind, MockPortal overrides, stock {partner_id: n}, config overrides,
+#  warm_catalog) — warm_catalog runs the scenario once unmeasured first so
+#  the detail-URL cache is populated.
+SCENARIOS = [
+    ("sequential / all sold out", "attempt", {}, {1197: 0, 1199: 0, 1201: 0},
+     {"attempt_mode": "sequential"}, False),
+    ("sequential / one available", "attempt", {}, {1197: 2, 1199: 0, 1201: 0},
+     {"attempt_mode": "sequential"}, False),
+    ("single_pass / all sold out", "attempt", {"sold_out_on_cards": True},
+     {1197: 0, 1199: 0, 1201: 0}, {"attempt_mode": "single_pass"}, False),
+    ("single_pass / one available", "attempt", {"sold_out_on_cards": True},
+     {1197: 2, 1199: 0, 1201: 0}, {"attempt_mode": "single_pass"}, False),
+    ("cached detail URLs / all sold out", "attempt", {},
+     {1197: 0, 1199: 0, 1201: 0}, {"attempt_mode": "sequential"}, True),
+    ("parallel tabs / all sold out", "attempt", {},
+     {1197: 0, 1199: 0, 1201: 0}, {"attempt_mode": "parallel"}, True),
+    ("parallel tabs / one available", "attempt", {},
+     {1197: 0, 1199: 0, 1201: 2}, {"attempt_mode": "parallel"}, True),
+    ("portal sync / one active code", "sync", {}, {1197: 2, 1199: 0, 1201: 0},
+     {}, False),
+]
+
+
+class CommandCounter:
+    """Count every command a driver sends (all element and driver calls
+    funnel through WebDriver.execute, or CdpDriver.execute for CDP)."""
+
+    def __init__(self, driver):
+        self.counts = Counter()
+        original = driver.execute
+
+        def execute(command, *args, **kwargs):
+            self.counts[command] += 1
+            return original(command, *args, **kwargs)
+        driver.execute = execute
+
+    def reset(self) -> None:
+        self.counts.clear()
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+def make_driver(em, profile_dir: str, backend: str):
+    if backend == "cdp":
+        return em.CdpDriver.launch(em.CHROMIUM_PATH, profile_dir,
+                                   em.chromium_arguments(headless=True))
+    options = em.Options()
+    for argument in em.chromium_arguments(headless=True):
+        options.add_argument(argument)
+    options.add_argument(f"--user-data-dir={profile_dir}")
+    options.binary_location = em.CHROMIUM_PATH
+    return em.webdriver.Chrome(service=em.Service(em.CHROMEDRIVER_PATH),
+                               options=options)
+
+
+# (label, call) — the driver calls an attempt is made of, each timed alone
+# on a rendered detail page
+PROBES = [
+    ("current_url", lambda em, d: d.current_url),
+    ("execute_script (snapshot)",
+     lambda em, d: d.execute_script(em.DETAIL_SNAPSHOT_JS)),
+    ("execute_async_script (wait)",
+     lambda em, d: em.wait_for_js(d, "return document.body;", 5)),
+    ("find_element + .text",
+     lambda em, d: d.find_element(em.By.TAG_NAME, "body").text),
+]
+
+
+def measure_commands(em, driver, args) -> list:
+    """[(label, median ms, p95 ms)] per PROBES entry."""
+    portal = MockPortal(render_delay_ms=0)
+    base = portal.start()
+    try:
+        driver.get(f"{base}/beneficios/detalhe/1197-pingo-doce")
+        em.wait_for_js(driver, "return document.querySelector("
+                               "'button.edp-large-button');", 10)
+        rows = []
+        for label, call in PROBES:
+            samples = []
+            for _ in range(args.samples):
+                started = time.perf_counter()
+                call(em, driver)
+                samples.append((time.perf_counter() - started) * 1000)
+            samples.sort()
+            rows.append((label, statistics.median(samples),
+                         samples[min(len(samples) - 1,
+                                     int(len(samples) * 0.95))]))
+        return rows
+    finally:
+        portal.stop()
+
+
+def run_scenario(em, driver, counter, scenario, args) -> dict:
+    label, kind, portal_kw, stock, overrides, warm_catalog = scenario
+    portal = MockPortal(render_delay_ms=args.render_delay_ms,
+                        claim_delay_ms=args.claim_delay_ms, **portal_kw)
+    base = portal.start()
+    em.PACKS_URL = f"{base}/beneficios/pack"
+    config = {**em.DEFAULT_CONFIG, "targets": TARGETS, **overrides}
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            em.JOURNAL = em.ClaimJournal(f"{data_dir}/claims.jsonl")
+            em.RESTOCKS = em.RestockLog(f"{data_dir}/restock.jsonl")
+            em.CATALOG_PATH = f"{data_dir}/catalog_cache.json"
+            for pid, n in stock.items():
+                portal.set_stock(pid, n)
+            catalog = {}
+            if warm_catalog:
+                em.run_one_attempt(driver, config, {}, catalog)
+            if kind == "sync":
+                portal.claim(1197)
+            history = {}
+
+            counter.reset()
+            started = time.monotonic()
+            if kind == "sync":
+                result = em.sync_history_from_portal(
+                    driver, history, config, month_key(datetime.now()))
+            else:
+                result = em.run_one_attempt(driver, config, history, catalog)
+            wall_ms = (time.monotonic() - started) * 1000
+    finally:
+        portal.stop()
+    return {"label": label, "wall_ms": wall_ms, "commands": counter.total,
+            "top": counter.counts.most_common(3), "result": result}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--render-delay-ms", type=int, default=800,
+                        help="mock Angular render delay per page")
+    parser.add_argument("--claim-delay-ms", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--backend", choices=("selenium", "cdp", "both"),
+                        default="both")
+    parser.add_argument("--samples", type=int, default=50,
+                        help="timed calls per command in the latency table")
+    parser.add_argument("--chromium", default=None)
+    parser.add_argument("--chromedriver", default=None)
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the monitor's own log lines")
+    args = parser.parse_args()
+
+    import edp_monitor as em
+    if args.chromium:
+        em.CHROMIUM_PATH = args.chromium
+    if args.chromedriver:
+        em.CHROMEDRIVER_PATH = args.chromedriver
+    em.TRACER.path = None
+    em.notify_phone = lambda topic, title, message: None
+
+    backends = ("selenium", "cdp") if args.backend == "both" \
+        else (args.backend,)
+    if "cdp" in backends and em.CdpDriver is None:
+        print("CDP backend unavailable (websocket-client missing)")
+        return 1
+
+    rows, latencies = [], {}
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as profile_dir:
+            driver = make_driver(em, profile_dir, backend)
+            counter = CommandCounter(driver)
+            try:
+                latencies[backend] = measure_commands(em, driver, args)
+                for scenario in SCENARIOS:
+                    runs = []
+                    for _ in range(args.repeat):
+                        out = io.StringIO()
+                        with contextlib.redirect_stdout(
+                                sys.stdout if args.verbose else out):
+                            runs.append(run_scenario(em, driver, counter,
+                                                     scenario, args))
+                    rows.append((backend, runs[-1], statistics.median(
+                        r["wall_ms"] for r in runs)))
+            finally:
+                driver.quit()
+
+    width = max(len(r["label"]) for _, r, _ in rows)
+    print(f"render delay {args.render_delay_ms} ms, claim delay "
+          f"{args.claim_delay_ms} ms, median of {args.repeat}\n")
+    print(f"{'scenario':<{width}}  {'backend':<8}  {'wall ms':>8}  {'cmds':>5}  "
+          "top commands")
+    for backend, run, wall_ms in rows:
+        top = ", ".join(f"{cmd}×{n}" for cmd, n in run["top"])
+        print(f"{run['label']:<{width}}  {backend:<8}  {wall_ms:>8.0f}  "
+              f"{run['commands']:>5}  {top}")
+        print(f"{'':<{width}}  {'':<8}  → {run['result']}")
+
+    width = max(len(label) for label, _ in PROBES)
+    print(f"\nper-command latency, {args.samples} calls each\n")
+    print(f"{'command':<{width}}  {'backend':<8}  {'p50 ms':>7}  {'p95 ms':>7}")
+    for label, _ in PROBES:
+        for backend in backends:
+            _, p50, p95 = next(r for r in latencies[backend] if r[0] == label)
+            print(f"{label:<{width}}  {backend:<8}  {p50:>7.2f}  {p95:>7.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+# browser_host.py — a Chromium that outlives the monitor process
+"""
+Whenever the monitor process exited inside a running container (s6 restarts
+the edp-monitor service after a crash or a fatal error; AccountRunner does
+the same for an account's process), the next one used to cold-launch
+Chromium: process start, profile load, an empty cache and a fresh Angular
+bootstrap before the first check.
+
+BrowserHost instead starts the headless Chromium in its own session (so it
+isn't taken down with the monitor), with a DevTools port on 127.0.0.1, and
+records it in /data/browser.json. The next monitor process finds it there,
+checks that it is the same process, still answers on its DevTools endpoint
+and was started with the same switches, and attaches to it (chromedriver's
+debuggerAddress, or the CDP backend's websocket) instead of launching.
+Anything stale is killed first: a leftover Chromium holds the profile lock,
+and a second one on the same profile would just hand its command line over
+and exit.
+
+Chromium stays a process of the add-on container, so stopping or
+restarting the add-on stops it too: the next container always launches a
+fresh one. Stdlib only.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import time
+import urllib.request
+from datetime import datetime
+
+from helpers import log, process_tree_pids, wait_for_path
+
+DEVTOOLS_READY_TIMEOUT = 20  # seconds for Chromium to open its debug port
+HEALTH_TIMEOUT = 2  # seconds for a running Chromium to answer /json/version
+
+
+class BrowserStartError(Exception):
+    """Chromium exited, or never opened its DevTools port."""
+
+
+def read_devtools_url(port_file: str) -> str | None:
+    """Browser websocket URL from Chromium's DevToolsActivePort file
+    ("<port>\\n/devtools/browser/<id>"), or None while it's incomplete."""
+    try:
+        with open(port_file) as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return None
+    if len(lines) < 2 or not lines[0].strip().isdigit() \
+            or not lines[1].startswith("/devtools/"):
+        return None
+    return f"ws://127.0.0.1:{lines[0].strip()}{lines[1].strip()}"
+
+
+def devtools_port(ws_url: str) -> int:
+    """The port of a ws://127.0.0.1:<port>/devtools/... URL."""
+    return int(ws_url.split("://", 1)[1].split("/", 1)[0].rsplit(":", 1)[1])
+
+
+def pid_alive(pid: int, proc_root: str = "/proc") -> bool:
+    """True if `pid` exists and isn't a zombie."""
+    try:
+        with open(f"{proc_root}/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def pid_cmdline(pid: int, proc_root: str = "/proc") -> list:
+    try:
+        with open(f"{proc_root}/{pid}/cmdline", "rb") as f:
+            return f.read().decode(errors="replace").split("\0")
+    except OSError:
+        return []
+
+
+def profile_owner(user_data_dir: str) -> int | None:
+    """Pid of the live Chromium holding `user_data_dir`'s SingletonLock (a
+    symlink to "<hostname>-<pid>"), if any."""
+    try:
+        target = os.readlink(os.path.join(user_data_dir, "SingletonLock"))
+        pid = int(target.rsplit("-", 1)[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pid if pid_alive(pid) else None
+
+
+def devtools_browser_url(port: int,
+                         timeout: float = HEALTH_TIMEOUT) -> str | None:
+    """webSocketDebuggerUrl from a DevTools endpoint's /json/version, or
+    None if nothing healthy answers there."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/json/version",
+                                    timeout=timeout) as resp:
+            return json.load(resp).get("webSocketDebuggerUrl")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class AdoptedProcess:
+    """The Popen calls the monitor makes on Chromium (pid, poll, wait,
+    terminate, kill), for a process it may not have started."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self) -> int | None:
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)  # ours: reap it
+            if pid:
+                self.returncode = os.waitstatus_to_exitcode(status)
+                return self.returncode
+        except ChildProcessError:
+            pass
+        if not pid_alive(self.pid):
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"pid {self.pid}", timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def terminate(self) -> None:
+        self._signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self._signal(signal.SIGKILL)
+
+    def _signal(self, signum: int) -> None:
+        try:
+            os.kill(self.pid, signum)
+        except OSError:
+            pass
+
+
+def start_chromium(binary: str, user_data_dir: str, arguments: list = (),
+                   detach: bool = False) -> tuple:
+    """Start Chromium on `user_data_dir` with a DevTools port and return
+    (process, browser websocket URL). `detach` puts it in its own session,
+    so it survives this process. Raises BrowserStartError."""
+    port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+    try:
+        os.remove(port_file)
+    except FileNotFoundError:
+        pass
+    cmd = [binary, "--remote-debugging-port=0",
+           f"--user-data-dir={user_data_dir}", "--no-first-run",
+           "--no-default-browser-check", *arguments, "about:blank"]
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               start_new_session=detach)
+    deadline = time.monotonic() + DEVTOOLS_READY_TIMEOUT
+    while True:
+        if process.poll() is not None:
+            raise BrowserStartError(
+                f"Chromium exited with {process.returncode} before opening "
+                "its DevTools port")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            process.kill()
+            process.wait()
+            raise BrowserStartError("Chromium DevTools port not open after "
+                                    f"{DEVTOOLS_READY_TIMEOUT}s")
+        if wait_for_path(port_file, min(remaining, 0.5)):
+            ws_url = read_devtools_url(port_file)
+            if ws_url is not None:
+                return process, ws_url
+            time.sleep(0.01)  # file still being written
+
+
+class BrowserHost:
+    """The detached Chromium on `user_data_dir`, recorded in `state_path`
+    as {pid, ws_url, port, arguments, started_at}."""
+
+    def __init__(self, state_path: str, binary: str, user_data_dir: str):
+        self.state_path = state_path
+        self.binary = binary
+        self.user_data_dir = user_data_dir
+
+    def find(self, arguments: list) -> dict | None:
+        """The recorded Chromium, if it is alive, healthy and was started
+        with `arguments`. A recorded one that isn't is stopped."""
+        record = self._load()
+        if record is None:
+            return None
+        problem = self._check(record, arguments)
+        if problem is None:
+            return record
+        log(f"Recorded Chromium (pid {record['pid']}) not reusable: {problem}",
+            "WARN")
+        self.stop(record)
+        return None
+
+    def start(self, arguments: list) -> dict:
+        """Launch a detached Chromium and record it. Raises
+        BrowserStartError."""
+        owner = profile_owner(self.user_data_dir)
+        if owner is not None:
+            log(f"Chromium pid {owner} still holds the profile — stopping it",
+                "WARN")
+            self._terminate(owner)
+        process, ws_url = start_chromium(self.binary, self.user_data_dir,
+                                         arguments, detach=True)
+        record = {
+            "pid": process.pid,
+            "ws_url": ws_url,
+            "port": devtools_port(ws_url),
+            "arguments": list(arguments),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._save(record)
+        return record
+
+    def stop(self, record: dict | None = None, grace: float = 10) -> None:
+        """SIGTERM the recorded Chromium (SIGKILL after `grace` seconds) and
+        forget it."""
+        record = record or self._load()
+        if record is not None and self._is_ours(record):
+            self._terminate(record["pid"], grace)
+        self.forget()
+
+    def forget(self) -> None:
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
+
+    def _check(self, record: dict, arguments: list) -> str | None:
+        if not self._is_ours(record):
+            return "process gone"
+        if record.get("arguments") != list(arguments):
+            return "started with other switches"
+        if devtools_browser_url(record["port"]) != record["ws_url"]:
+            return "DevTools endpoint not answering"
+        return None
+
+    def _is_ours(self, record: dict) -> bool:
+        """Alive, and still Chromium on our profile (not a reused pid)."""
+        return pid_alive(record["pid"]) and \
+            f"--user-data-dir={self.user_data_dir}" in pid_cmdline(
+                record["pid"])
+
+    def _terminate(self, pid: int, grace: float = 10) -> None:
+        process = AdoptedProcess(pid)
+        process.terminate()
+        try:
+            process.wait(grace)
+        except subprocess.TimeoutExpired:
+            for child in reversed(process_tree_pids(pid)):
+                AdoptedProcess(child).kill()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                log(f"Chromium pid {pid} survived SIGKILL", "ERROR")
+
+    def _load(self) -> dict | None:
+        try:
+            with open(self.state_path) as f:
+                record = json.load(f)
+            if isinstance(record, dict) and isinstance(record.get("pid"), int) \
+                    and record.get("ws_url") and record.get("port"):
+                return record
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _save(self, record: dict) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,485 @@
+# cdp_backend.py — chromedriver-free browser backend for EDP Voucher Monitor
+"""
+With Selenium every driver call goes Python → HTTP → chromedriver → CDP →
+renderer: an extra process and a JSON re-encoding on each of the dozens of
+round trips per attempt. CdpDriver instead starts the same Chromium binary
+on the same profile with --remote-debugging-port and speaks the Chrome
+DevTools Protocol to it over one websocket (websocket-client).
+
+It implements the slice of the Selenium WebDriver API the monitor uses —
+get / back / refresh / current_url, execute_script / execute_async_script
+(elements can be passed in and returned), find_element(s) by CSS selector or
+tag name with .text / .click() / .send_keys() / .find_element(), tabs via
+window handles and switch_to, execute_cdp_cmd, timeouts and quit() — and
+raises Selenium's exception classes, so callers can't tell the two apart.
+A lost connection reads "disconnected: ...", like chromedriver's, so the
+supervisor treats it as a dead session.
+
+Selected with `browser_backend: cdp`; bench.py compares both. attach()
+connects to a Chromium that is already running (browser_host.py).
+"""
+
+import itertools
+import json
+import subprocess
+import threading
+
+import websocket
+from selenium.common.exceptions import (
+    JavascriptException,
+    NoSuchElementException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+
+from browser_host import BrowserStartError, start_chromium
+
+# Only these events are kept; everything else (Network.*) is dropped
+WATCHED_EVENTS = ("Page.loadEventFired", "Target.detachedFromTarget")
+
+# execute_script bodies run as `function () { <script> }` like WebDriver's.
+# An element result can't travel by value: it is parked on window and the
+# caller fetches a handle to it with a second call.
+_RESULT = ("(r => (r instanceof Element) ? "
+           "(window.__edpElement = r, {__edp_element__: true}) : r)")
+SYNC_WRAPPER = "function () { return %s((function () { %s }).apply(null, arguments)); }"
+ASYNC_WRAPPER = """function () {
+    const args = Array.from(arguments);
+    return new Promise((resolve, reject) => {
+        args.push(resolve);
+        try { (function () { %s }).apply(null, args); } catch (e) { reject(e); }
+    }).then(%s);
+}"""
+
+# WebDriver's Keys codepoints → (key, code, windowsVirtualKeyCode)
+SPECIAL_KEYS = {
+    "\ue00c": ("Escape", "Escape", 27),
+    "\ue006": ("Enter", "Enter", 13),
+    "\ue007": ("Enter", "NumpadEnter", 13),
+    "\ue004": ("Tab", "Tab", 9),
+    "\ue003": ("Backspace", "Backspace", 8),
+}
+
+
+def css_selector(by: str, value: str) -> str:
+    """A Selenium locator as a CSS selector (only the strategies that are
+    CSS underneath are supported)."""
+    if by == "css selector":
+        return value
+    if by == "tag name":
+        return value
+    if by == "id":
+        return f"#{value}"
+    if by == "class name":
+        return f".{value}"
+    raise WebDriverException(f"locator strategy {by!r} not supported by "
+                             "the CDP backend")
+
+
+class _Connection:
+    """One DevTools websocket: calls are matched to replies by id on a
+    reader thread; watched events are kept with a sequence number so a
+    waiter can ask for "the first one after I sent my command"."""
+
+    def __init__(self, ws_url: str):
+        self.ws = websocket.create_connection(ws_url, suppress_origin=True,
+                                              enable_multithread=True)
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._replies = {}
+        self._waiting = set()
+        self._events = []  # (seq, method, sessionId, params)
+        self.seq = 0
+        self.closed = None
+        threading.Thread(target=self._read, name="cdp-reader",
+                         daemon=True).start()
+
+    def call(self, method: str, params: dict | None = None,
+             session_id: str | None = None, timeout: float = 30) -> dict:
+        msg_id = next(self._ids)
+        msg = {"id": msg_id, "method": method, "params": params or {}}
+        if session_id:
+            msg["sessionId"] = session_id
+        with self._cond:
+            if self.closed:
+                raise WebDriverException(f"disconnected: {self.closed}")
+            self._waiting.add(msg_id)
+        try:
+            self.ws.send(json.dumps(msg))
+            with self._cond:
+                if not self._cond.wait_for(
+                        lambda: msg_id in self._replies or self.closed,
+                        timeout):
+                    raise TimeoutException(
+                        f"timeout: no reply to {method} within {timeout:.0f}s")
+                if msg_id not in self._replies:
+                    raise WebDriverException(f"disconnected: {self.closed}")
+                reply = self._replies.pop(msg_id)
+        except websocket.WebSocketException as e:
+            raise WebDriverException(f"disconnected: {e}") from e
+        finally:
+            with self._cond:
+                self._waiting.discard(msg_id)
+        if "error" in reply:
+            message = reply["error"].get("message", "")
+            if "Could not find object with given id" in message \
+                    or "Cannot find context" in message:
+                raise StaleElementReferenceException(
+                    f"stale element reference: {message}")
+            if "No target with given id" in message \
+                    or "No session with given id" in message:
+                raise NoSuchWindowException(f"no such window: {message}")
+            raise WebDriverException(f"{method}: {message}")
+        return reply.get("result", {})
+
+    def wait_event(self, method: str, session_id: str | None, after: int,
+                   timeout: float) -> dict | None:
+        """Params of the first `method` event (for `session_id`) with a
+        sequence number above `after`; None on timeout."""
+        def find():
+            for seq, name, sid, params in self._events:
+                if seq > after and name == method and sid == session_id:
+                    return params
+            return None
+        with self._cond:
+            self._cond.wait_for(lambda: find() is not None or self.closed,
+                                timeout)
+            found = find()
+            if found is None and self.closed:
+                raise WebDriverException(f"disconnected: {self.closed}")
+            return found
+
+    def close(self) -> None:
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+    def _read(self) -> None:
+        try:
+            while True:
+                msg = json.loads(self.ws.recv())
+                with self._cond:
+                    if "id" in msg:
+                        if msg["id"] in self._waiting:
+                            self._replies[msg["id"]] = msg
+                    elif msg.get("method") in WATCHED_EVENTS:
+                        self.seq += 1
+                        self._events.append((self.seq, msg["method"],
+                                             msg.get("sessionId"),
+                                             msg.get("params", {})))
+                        del self._events[:-200]
+                    else:
+                        continue
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.closed = f"DevTools connection closed ({e or type(e).__name__})"
+                self._cond.notify_all()
+
+
+class _ChromiumService:
+    """Stands in for Selenium's Service: `process` is Chromium itself (a
+    Popen, or browser_host.AdoptedProcess)."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def stop(self) -> None:
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class _SwitchTo:
+    def __init__(self, driver):
+        self._driver = driver
+
+    def window(self, handle: str) -> None:
+        self._driver._attach(handle)
+
+    def new_window(self, type_hint: str = "tab") -> None:
+        target = self._driver.execute("Target.createTarget",
+                                      {"url": "about:blank"}, session=None)
+        self._driver._attach(target["targetId"])
+
+
+class CdpElement:
+    """A DOM node, held as a Runtime remote object id."""
+
+    def __init__(self, driver, object_id: str):
+        self._driver = driver
+        self.object_id = object_id
+
+    def _call(self, function: str, *args, by_value: bool = True):
+        result = self._driver.execute("Runtime.callFunctionOn", {
+            "objectId": self.object_id,
+            "functionDeclaration": function,
+            "arguments": [{"value": a} for a in args],
+            "returnByValue": by_value,
+        })
+        self._driver._raise_for_exception(result)
+        return result["result"]
+
+    @property
+    def text(self) -> str:
+        return self._call("function () { return this.innerText; }"
+                          ).get("value") or ""
+
+    def get_attribute(self, name: str):
+        return self._call("function (n) { return this.getAttribute(n); }",
+                          name).get("value")
+
+    def find_element(self, by: str, value: str) -> "CdpElement":
+        result = self._call("function (s) { return this.querySelector(s); }",
+                            css_selector(by, value), by_value=False)
+        if result.get("subtype") == "null":
+            raise NoSuchElementException(
+                f"no such element: {by} {value!r} under element")
+        return CdpElement(self._driver, result["objectId"])
+
+    def click(self) -> None:
+        """A trusted mouse click at the element's centre, like WebDriver's."""
+        box = self._call("""function () {
+            this.scrollIntoView({block: 'center', inline: 'center'});
+            const r = this.getBoundingClientRect();
+            return [r.left + r.width / 2, r.top + r.height / 2,
+                    r.width, r.height];
+        }""")["value"]
+        x, y, width, height = box
+        if not width or not height:
+            raise WebDriverException("element not interactable: element has "
+                                     "no size")
+        for kind in ("mouseMoved", "mousePressed", "mouseReleased"):
+            params = {"type": kind, "x": x, "y": y}
+            if kind != "mouseMoved":
+                params.update(button="left", clickCount=1)
+            self._driver.execute("Input.dispatchMouseEvent", params)
+
+    def send_keys(self, *values) -> None:
+        self._call("function () { this.focus(); }")
+        for value in values:
+            for char in value:
+                special = SPECIAL_KEYS.get(char)
+                if special is None:
+                    self._driver.execute("Input.insertText", {"text": char})
+                    continue
+                key, code, vk = special
+                for kind in ("rawKeyDown", "keyUp"):
+                    self._driver.execute("Input.dispatchKeyEvent", {
+                        "type": kind, "key": key, "code": code,
+                        "windowsVirtualKeyCode": vk})
+
+
+class CdpDriver:
+    """A Chromium started with a DevTools port, driven over CDP. Create it
+    with launch(); `service.process` is the Chromium process."""
+
+    def __init__(self, process, conn: _Connection):
+        self.service = _ChromiumService(process)
+        self.switch_to = _SwitchTo(self)
+        self._conn = conn
+        self._sessions = {}  # targetId -> sessionId
+        self._current = None
+        self.script_timeout = 30.0
+        self.page_load_timeout = 300.0
+
+    @classmethod
+    def launch(cls, binary: str, user_data_dir: str,
+               arguments: list = ()) -> "CdpDriver":
+        """Start Chromium on `user_data_dir` and attach to its first tab.
+        Raises WebDriverException if it doesn't come up."""
+        try:
+            process, ws_url = start_chromium(binary, user_data_dir, arguments)
+        except BrowserStartError as e:
+            raise WebDriverException(str(e)) from e
+        try:
+            return cls.attach(ws_url, process)
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+
+    @classmethod
+    def attach(cls, ws_url: str, process) -> "CdpDriver":
+        """Connect to the running Chromium at `ws_url` (its browser
+        websocket) and attach to its first tab. `process` is that Chromium,
+        what quit() stops."""
+        driver = cls(process, _Connection(ws_url))
+        pages = [t for t in driver.execute("Target.getTargets",
+                                           session=None)["targetInfos"]
+                 if t["type"] == "page"]
+        if pages:
+            driver._attach(pages[0]["targetId"])
+        else:
+            driver.switch_to.new_window("tab")
+        return driver
+
+    # --- plumbing -----------------------------------------------------------
+
+    def execute(self, method: str, params: dict | None = None,
+                session: bool | None = True, timeout: float = 30) -> dict:
+        """Send one CDP command to the current tab (`session=None`: to the
+        browser). Every command of this backend goes through here."""
+        session_id = None
+        if session:
+            if self._current is None:
+                raise NoSuchWindowException("no such window: no current tab "
+                                            "(closed?)")
+            session_id = self._sessions[self._current]
+        return self._conn.call(method, params, session_id, timeout)
+
+    def _attach(self, target_id: str) -> None:
+        if target_id not in self._sessions:
+            result = self.execute("Target.attachToTarget",
+                                  {"targetId": target_id, "flatten": True},
+                                  session=None)
+            self._sessions[target_id] = result["sessionId"]
+            self._current = target_id
+            self.execute("Page.enable")
+        self._current = target_id
+
+    def _raise_for_exception(self, result: dict) -> None:
+        details = result.get("exceptionDetails")
+        if details:
+            exc = details.get("exception", {})
+            raise JavascriptException(
+                "javascript error: "
+                f"{exc.get('description') or details.get('text', '')}")
+
+    def _unwrap(self, result: dict):
+        self._raise_for_exception(result)
+        value = result["result"].get("value")
+        if isinstance(value, dict) and value.get("__edp_element__"):
+            handle = self.execute("Runtime.evaluate", {
+                "expression": "window.__edpElement"})["result"]
+            return CdpElement(self, handle["objectId"])
+        return value
+
+    def _run(self, declaration: str, args: tuple, timeout: float,
+             await_promise: bool):
+        elements = [a for a in args if isinstance(a, CdpElement)]
+        if not elements:
+            expression = f"({declaration}).apply(null, {json.dumps(list(args))})"
+            return self._unwrap(self.execute("Runtime.evaluate", {
+                "expression": expression, "returnByValue": True,
+                "awaitPromise": await_promise}, timeout=timeout))
+        return self._unwrap(self.execute("Runtime.callFunctionOn", {
+            "objectId": elements[0].object_id,
+            "functionDeclaration": declaration,
+            "arguments": [{"objectId": a.object_id}
+                          if isinstance(a, CdpElement) else {"value": a}
+                          for a in args],
+            "returnByValue": True, "awaitPromise": await_promise,
+        }, timeout=timeout))
+
+    def _navigate(self, method: str, params: dict) -> None:
+        session_id = self._sessions[self._current]
+        mark = self._conn.seq
+        result = self.execute(method, params)
+        if result.get("errorText"):
+            raise WebDriverException(f"unknown error: {result['errorText']}")
+        if method == "Page.navigate" and not result.get("loaderId"):
+            return  # same-document navigation: no load event
+        if self._conn.wait_event("Page.loadEventFired", session_id, mark,
+                                 self.page_load_timeout) is None:
+            raise TimeoutException("timeout: Timed out receiving message "
+                                   "from renderer")
+
+    # --- WebDriver API subset -------------------------------------------------
+
+    def get(self, url: str) -> None:
+        self._navigate("Page.navigate", {"url": url})
+
+    def refresh(self) -> None:
+        self._navigate("Page.reload", {})
+
+    def back(self) -> None:
+        self.execute_script("history.back();")
+
+    @property
+    def current_url(self) -> str:
+        return self.execute_script("return location.href;")
+
+    @property
+    def title(self) -> str:
+        return self.execute_script("return document.title;")
+
+    def execute_script(self, script: str, *args):
+        return self._run(SYNC_WRAPPER % (_RESULT, script), args,
+                         self.script_timeout + 30, await_promise=False)
+
+    def execute_async_script(self, script: str, *args):
+        try:
+            return self._run(ASYNC_WRAPPER % (script, _RESULT), args,
+                             self.script_timeout, await_promise=True)
+        except TimeoutException:
+            raise TimeoutException(
+                f"script timeout: result was not received in "
+                f"{self.script_timeout:.0f} seconds") from None
+
+    def set_script_timeout(self, seconds: float) -> None:
+        self.script_timeout = float(seconds)
+
+    def set_page_load_timeout(self, seconds: float) -> None:
+        self.page_load_timeout = float(seconds)
+
+    def find_element(self, by: str, value: str) -> CdpElement:
+        result = self.execute("Runtime.evaluate", {
+            "expression": f"document.querySelector({json.dumps(css_selector(by, value))})"})
+        self._raise_for_exception(result)
+        if result["result"].get("subtype") == "null":
+            raise NoSuchElementException(f"no such element: {by} {value!r}")
+        return CdpElement(self, result["result"]["objectId"])
+
+    def find_elements(self, by: str, value: str) -> list:
+        result = self.execute("Runtime.evaluate", {
+            "expression": "Array.from(document.querySelectorAll("
+                          f"{json.dumps(css_selector(by, value))}))"})
+        self._raise_for_exception(result)
+        props = self.execute("Runtime.getProperties", {
+            "objectId": result["result"]["objectId"],
+            "ownProperties": True})["result"]
+        nodes = sorted((int(p["name"]), p["value"]["objectId"])
+                       for p in props if p["name"].isdigit())
+        return [CdpElement(self, object_id) for _, object_id in nodes]
+
+    def execute_cdp_cmd(self, cmd: str, cmd_args: dict) -> dict:
+        return self.execute(cmd, cmd_args)
+
+    @property
+    def current_window_handle(self) -> str:
+        if self._current is None:
+            raise NoSuchWindowException("no such window: no current tab")
+        return self._current
+
+    @property
+    def window_handles(self) -> list:
+        infos = self.execute("Target.getTargets", session=None)["targetInfos"]
+        return [t["targetId"] for t in infos if t["type"] == "page"]
+
+    def close(self) -> None:
+        """Close the current tab; like WebDriver, switch_to.window() is
+        needed before the next command."""
+        target = self.current_window_handle
+        self.execute("Target.closeTarget", {"targetId": target}, session=None)
+        self._sessions.pop(target, None)
+        self._current = None
+
+    def detach(self) -> None:
+        """Disconnect, leaving Chromium running."""
+        self._conn.close()
+
+    def quit(self) -> None:
+        try:
+            self.execute("Browser.close", session=None, timeout=5)
+        except Exception:
+            pass
+        self._conn.close()
+        self.service.stop()
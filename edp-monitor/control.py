@@ -0,0 +1,185 @@
+# control.py — local control API for EDP Voucher Monitor
+"""
+A small HTTP endpoint inside the add-on, so "claim now" no longer means
+hassio.addon_restart (which tears down Chromium and pays the whole startup
+again). Requests are served by a daemon thread that only puts jobs on the
+monitor's Scheduler; the main loop picks them up within milliseconds and
+runs them on the already-warm browser. Stdlib only.
+
+    POST /attempt[?target=Name]  attempt every unclaimed target (or one) now
+    POST /sync                   sync with the portal's active codes now
+    GET  /state                  month, browser, per-target claim and state
+    GET  /history                every journaled claim, by month
+    GET  /next                   pending jobs, next attempt first
+
+Triggers answer 202 with what was queued. Every request needs
+`Authorization: Bearer <token>`: the `control_token` option, or else one
+generated on first start and kept in /data (load_or_create_token), since
+any container on the hassio network can reach the port. A manual attempt
+is queued as `manual:<target>`, next to the target's slot job, which it
+never replaces.
+"""
+
+import hmac
+import json
+import os
+import secrets
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from helpers import log
+from scheduler import Scheduler
+
+DEFAULT_PORT = 8099
+
+
+def load_or_create_token(path: str) -> tuple:
+    """(token, created): the token stored at `path`, or a new random one
+    written there (mode 0600) if there is none."""
+    try:
+        with open(path) as f:
+            token = f.read().strip()
+        if token:
+            return token, False
+    except FileNotFoundError:
+        pass
+    token = secrets.token_urlsafe(24)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return token, True
+
+
+def describe_jobs(jobs: list) -> list:
+    """JSON-friendly view of Scheduler jobs."""
+    out = []
+    for job in jobs:
+        entry = {"key": job.key, "kind": job.kind,
+                 "due": job.due.isoformat(timespec="seconds"),
+                 "strict": job.strict}
+        if job.kind == "attempt":
+            slot = job.payload["slot"]
+            entry["target"] = job.payload["target"]
+            entry["slot"] = slot.isoformat(timespec="seconds") if slot else None
+        out.append(entry)
+    return out
+
+
+class ControlServer:
+    """Control API over `sched`.
+
+    `targets` are the configured target names; `pending` returns the names
+    still unclaimed this month; `state` and `history` return the bodies of
+    GET /state and GET /history. They are called on the server thread.
+    """
+
+    def __init__(self, sched: Scheduler, targets: list, pending, state,
+                 history, token: str = ""):
+        self.sched = sched
+        self.targets = targets
+        self.pending = pending
+        self.state = state
+        self.history = history
+        self.token = token
+        self._server = None
+
+    def start(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT) -> int:
+        """Serve on `host`:`port` (0 = ephemeral) in a daemon thread.
+        Returns the bound port. Raises ValueError without a token."""
+        if not self.token:
+            raise ValueError("the control API needs a token")
+        control = self
+
+        class Handler(_ControlHandler):
+            pass
+        Handler.control = control
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="control",
+                         daemon=True).start()
+        return self._server.server_address[1]
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def trigger_attempt(self, target: str | None = None) -> tuple:
+        """Queue an immediate attempt. Returns (http_status, body)."""
+        if target is not None and target not in self.targets:
+            return 404, {"error": f"unknown target {target!r}",
+                         "targets": self.targets}
+        names = [n for n in self.pending() if target in (None, n)]
+        now = datetime.now()
+        for name in names:
+            self.sched.schedule(now, "attempt", key=f"manual:{name}",
+                                payload={"target": name, "slot": None},
+                                strict=True)
+        log(f"Control API: attempt now for {names or 'nothing (all claimed)'}")
+        return 202, {"queued": names}
+
+    def trigger_sync(self) -> tuple:
+        self.sched.schedule(datetime.now(), "sync")
+        log("Control API: portal sync now")
+        return 202, {"queued": ["sync"]}
+
+    def next_jobs(self) -> dict:
+        jobs = describe_jobs(self.sched.pending())
+        attempts = [j for j in jobs if j["kind"] == "attempt"]
+        return {"next_attempt": attempts[0] if attempts else None,
+                "jobs": jobs}
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    control: ControlServer = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body) -> None:
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorised(self) -> bool:
+        token = self.control.token
+        given = self.headers.get("Authorization", "")
+        if hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            return True
+        self._send(401, {"error": "unauthorised"})
+        return False
+
+    def do_GET(self):
+        if not self._authorised():
+            return
+        path = urlparse(self.path).path.rstrip("/")
+        control = self.control
+        if path == "/state":
+            return self._send(200, control.state())
+        if path == "/history":
+            return self._send(200, control.history())
+        if path == "/next":
+            return self._send(200, control.next_jobs())
+        if path in ("/attempt", "/sync"):
+            return self._send(405, {"error": "use POST"})
+        return self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self._authorised():
+            return
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        if path == "/attempt":
+            target = parse_qs(url.query).get("target", [None])[-1]
+            return self._send(*self.control.trigger_attempt(target))
+        if path == "/sync":
+            return self._send(*self.control.trigger_sync())
+        return self._send(404, {"error": "not found"})
@@ -0,0 +1,200 @@
+# display.py — on-demand Xvfb / x11vnc / noVNC stack for EDP Voucher Monitor
+"""
+The virtual display and its web VNC view are only needed while a human has
+to see the browser (login, or the always-headed debug mode). DisplayStack
+starts them as managed child processes on demand, probes each one for
+readiness instead of sleeping, and tears them down after an idle timeout.
+
+Each runs in its own process group (so a stop takes the noVNC proxy's
+websockify with it) and gets SIGTERM if the monitor dies. The groups are
+also recorded in a state file: leftovers of a monitor that was killed
+outright are stopped before the next start, along with an Xvfb still
+holding the display's lock, which would otherwise keep the new one from
+starting while its socket passed the readiness probe.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from browser_host import pid_alive, pid_cmdline
+from helpers import die_with_parent, log, wait_for_path, wait_for_port
+
+
+class DisplayStack:
+    """Xvfb on `display`, x11vnc on `vnc_port`, noVNC proxy on `web_port`."""
+
+    def __init__(self, display: str = ":99", vnc_port: int = 5900,
+                 web_port: int = 6080, idle_timeout: float = 300,
+                 tmp_dir: str = "/tmp"):
+        self.display = display
+        self.vnc_port = vnc_port
+        self.web_port = web_port
+        self.idle_timeout = idle_timeout
+        number = display.lstrip(":")
+        self.lock_path = os.path.join(tmp_dir, f".X{number}-lock")
+        self.state_path = os.path.join(tmp_dir, f".edp-display{number}.json")
+        self.procs = {}
+        self._lock = threading.Lock()
+        self._idle_timer = None
+
+    def _commands(self) -> list:
+        """(name, argv, readiness probe) in start order."""
+        socket_path = self._socket_path()
+        return [
+            ("Xvfb",
+             ["Xvfb", self.display, "-screen", "0", "1280x720x24"],
+             lambda: wait_for_path(socket_path, 10)),
+            ("x11vnc",
+             ["x11vnc", "-display", self.display, "-forever", "-shared",
+              "-nopw", "-rfbport", str(self.vnc_port), "-q"],
+             lambda: wait_for_port("127.0.0.1", self.vnc_port, 10)),
+            ("noVNC",
+             ["/opt/novnc/utils/novnc_proxy", "--vnc",
+              f"localhost:{self.vnc_port}", "--listen", str(self.web_port)],
+             lambda: wait_for_port("127.0.0.1", self.web_port, 15)),
+        ]
+
+    def running(self) -> bool:
+        return bool(self.procs) and all(p.poll() is None
+                                        for p in self.procs.values())
+
+    def ensure_started(self) -> bool:
+        """Start whatever part of the stack isn't running, in order, and
+        point DISPLAY at it. Cancels any pending idle teardown. Returns
+        False if a component didn't become ready."""
+        with self._lock:
+            self._cancel_idle_timer()
+            os.environ["DISPLAY"] = self.display
+            started = time.monotonic()
+            if not self.procs:
+                self._stop_leftovers()
+            for name, argv, ready in self._commands():
+                proc = self.procs.get(name)
+                if proc is not None and proc.poll() is None:
+                    continue
+                log(f"Starting {name}...")
+                try:
+                    self.procs[name] = proc = subprocess.Popen(
+                        argv, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL, start_new_session=True,
+                        preexec_fn=die_with_parent)
+                except OSError as e:
+                    log(f"Could not start {name}: {e}", "ERROR")
+                    return False
+                self._save_state()
+                if not ready():
+                    log(f"{name} not ready in time", "ERROR")
+                    return False
+                # The probe can pass on something another process left
+                if proc.poll() is not None:
+                    log(f"{name} exited with {proc.returncode}", "ERROR")
+                    return False
+            log(f"Display stack ready in {time.monotonic() - started:.2f}s — "
+                f"noVNC: http://<your-ip>:{self.web_port}")
+            return True
+
+    def release(self) -> None:
+        """Nobody needs the display right now: stop it after idle_timeout,
+        unless ensure_started() is called again first."""
+        with self._lock:
+            if not self.procs:
+                return
+            self._cancel_idle_timer()
+            self._idle_timer = threading.Timer(self.idle_timeout,
+                                               self._idle_stop)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+            log(f"Display stack idle — stopping in {self.idle_timeout:.0f}s")
+
+    def _idle_stop(self) -> None:
+        # A login may have reclaimed the stack while this timer was firing.
+        if threading.current_thread() is not self._idle_timer:
+            return
+        log("Display stack idle timeout reached")
+        self.stop()
+
+    def _cancel_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def stop(self) -> None:
+        """Terminate the stack in reverse start order."""
+        with self._lock:
+            self._cancel_idle_timer()
+            for name in reversed(list(self.procs)):
+                proc = self.procs.pop(name)
+                if proc.poll() is not None:
+                    continue
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                except ProcessLookupError:
+                    pass
+                log(f"Stopped {name}")
+            self._save_state()
+
+    def _stop_leftovers(self) -> None:
+        """Stop the process groups a previous monitor recorded, and any Xvfb
+        still holding the display lock; clear a stale lock and socket."""
+        try:
+            with open(self.state_path) as f:
+                pgids = [int(pgid) for pgid in json.load(f).values()]
+        except (OSError, ValueError, TypeError, AttributeError):
+            pgids = []
+        for pgid in pgids:
+            _stop_group(pgid, "leftover display process group")
+        try:
+            with open(self.lock_path) as f:
+                owner = int(f.read().strip())
+        except (OSError, ValueError):
+            owner = None
+        if owner is not None and owner not in pgids \
+                and "Xvfb" in " ".join(pid_cmdline(owner)):
+            _stop_group(owner, f"leftover X server on {self.display}",
+                        group=False)
+        # Nothing of ours runs yet: a socket left there is stale, and would
+        # pass Xvfb's readiness probe before the new server is up
+        for path in (self.lock_path, self._socket_path()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _socket_path(self) -> str:
+        return os.path.join(os.path.dirname(self.lock_path), ".X11-unix",
+                            f"X{self.display.lstrip(':')}")
+
+    def _save_state(self) -> None:
+        try:
+            with open(self.state_path, "w") as f:
+                json.dump({name: proc.pid for name, proc in self.procs.items()
+                           if proc.poll() is None}, f)
+        except OSError as e:
+            log(f"Could not record the display processes: {e}", "WARN")
+
+
+def _stop_group(pid: int, label: str, group: bool = True) -> None:
+    """SIGTERM `pid`'s process group (or just `pid`), SIGKILL after 5s."""
+    kill = os.killpg if group else os.kill
+    try:
+        kill(pid, signal.SIGTERM)
+    except OSError:
+        return  # already gone
+    log(f"Stopping {label} (pid {pid})", "WARN")
+    deadline = time.monotonic() + 5
+    while pid_alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if not pid_alive(pid):
+        return
+    try:
+        kill(pid, signal.SIGKILL)
+    except OSError:
+        pass
@@ -2,27 +2,78 @@
 """EDP Voucher Monitor — Home Assistant Add-on."""
 
 import json
+import os
+import signal
+import subprocess
 import sys
+import threading
 import time
 import traceback
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 
 # Force unbuffered output so HA addon log tails immediately
 sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
 
 from helpers import (
-    compute_next_wakeup,
+    by_priority,
+    cached_detail_url,
+    card_looks_available,
+    desktop_user_agent,
+    end_of_day_time,
+    entity_slug,
     find_claimed_targets,
-    load_history,
+    format_page_weight,
+    format_phase_timings,
+    load_catalog,
     log,
+    match_pack_cards,
     month_key,
+    next_attempt_per_target,
     parse_voucher_status,
-    save_history,
+    process_tree_pids,
+    process_tree_rss,
+    save_catalog_entry,
+    set_log_label,
+    should_hibernate,
     should_run_immediately,
     sleep_until,
+    summarise_page_weight,
     unclaimed_for_month,
+    wait_for_port,
 )
+from accounts import (
+    ACCOUNTS_DIR,
+    DISPLAY_BASE,
+    NOVNC_BASE_PORT,
+    AccountRunner,
+    BrowserPool,
+    account_config,
+    account_plan,
+)
+from browser_host import AdoptedProcess, BrowserHost, BrowserStartError
+from control import (
+    DEFAULT_PORT as CONTROL_BASE_PORT,
+    ControlServer,
+    load_or_create_token,
+)
+from display import DisplayStack
+from ha_publisher import StatePublisher
+from http_checker import HttpChecker
+from journal import ClaimJournal
+from notifier import Notifier
+from restock import RestockLog, learned_slots
+from scheduler import Scheduler
+from supervisor import (
+    BrowserSupervisor,
+    BrowserUnavailable,
+    CircuitBreaker,
+    is_dead_session,
+    is_navigation_error,
+)
+from tracing import Tracer
 
 log("Starting EDP Monitor script...")
 
@@ -34,70 +85,819 @@ except Exception as e:
 
 try:
     from selenium import webdriver
-    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+    from selenium.common.exceptions import (
+        NoSuchElementException,
+        TimeoutException,
+        WebDriverException,
+    )
     from selenium.webdriver.chrome.options import Options
     from selenium.webdriver.chrome.service import Service
     from selenium.webdriver.common.by import By
     from selenium.webdriver.common.keys import Keys
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.webdriver.support.ui import WebDriverWait
     log("selenium OK")
 except Exception as e:
     log(f"Failed to import selenium: {e}", "ERROR")
     traceback.print_exc()
     sys.exit(1)
 
-CONFIG_PATH = "/data/options.json"
-PROFILE_PATH = "/data/chrome-profile"
-HISTORY_PATH = "/data/claim_history.json"
-PACKS_URL = "https://particulares.cliente.edp.pt/beneficios/pack"
+try:
+    from cdp_backend import CdpDriver
+except Exception as e:
+    CdpDriver = None
+    log(f"Failed to import the CDP backend: {e}", "WARN")
+
+# Set by accounts.AccountRunner when this process monitors an extra account:
+# its name, and the data directory and port offset that are its own.
+ACCOUNT = os.environ.get("EDP_ACCOUNT")
+ACCOUNT_SLUG = os.environ.get("EDP_ACCOUNT_SLUG", "")
+ACCOUNT_INDEX = int(os.environ.get("EDP_ACCOUNT_INDEX", "0"))
+BASE_DATA_DIR = "/data"
+DATA_DIR = os.environ.get("EDP_DATA_DIR", BASE_DATA_DIR)
+
+CONFIG_PATH = f"{BASE_DATA_DIR}/options.json"
+POOL_DIR = f"{BASE_DATA_DIR}/{ACCOUNTS_DIR}/.pool"
+PROFILE_PATH = f"{DATA_DIR}/chrome-profile"
+HISTORY_PATH = f"{DATA_DIR}/claim_history.json"  # pre-journal format, migrated
+JOURNAL_PATH = f"{DATA_DIR}/claims.jsonl"
+CATALOG_PATH = f"{DATA_DIR}/catalog_cache.json"
+TRACE_PATH = f"{DATA_DIR}/trace.jsonl"
+OUTBOX_PATH = f"{DATA_DIR}/ntfy_outbox.json"
+RESTOCK_PATH = f"{DATA_DIR}/restock.jsonl"
+BROWSER_STATE_PATH = f"{DATA_DIR}/browser.json"
+CONTROL_TOKEN_PATH = f"{DATA_DIR}/control_token"
+NOVNC_PORT = NOVNC_BASE_PORT + ACCOUNT_INDEX
+CONTROL_PORT = CONTROL_BASE_PORT + ACCOUNT_INDEX
+HA_API_URL = "http://supervisor/core/api"
+# EDP_PORTAL_URL points the monitor at another portal, e.g. mock_portal.py
+PORTAL_URL = os.environ.get("EDP_PORTAL_URL",
+                            "https://particulares.cliente.edp.pt").rstrip("/")
+PACKS_URL = f"{PORTAL_URL}/beneficios/pack"
+CHROMIUM_PATH = "/usr/bin/chromium-browser"
+CHROMEDRIVER_PATH = "/usr/bin/chromedriver"
 
 DEFAULT_CONFIG = {
     "ntfy_topic": "edp-voucher",
+    "ntfy_url": "https://ntfy.sh",
     "start_day": 1,
     "attempt_times": ["08:05", "08:35", "09:05"],
     "login_reminder_interval": 600,
+    "attempt_mode": "sequential",
+    "http_check_url": "",
+    "race_mode": False,
+    "race_lead_seconds": 20,
+    "race_poll_ms": 50,
+    "race_window_seconds": 60,
+    "headless": True,
+    "display_idle_timeout": 300,
+    "hibernate_threshold_minutes": 120,
+    "hibernate_wake_lead_seconds": 120,
+    "block_resources": True,
+    "blocked_url_patterns": [],
+    "sync_interval_hours": 6,
+    "keepalive_minutes": 20,
+    "adaptive_slots": False,
+    "attempt_budget": 3,
+    "restock_window_minutes": 10,
+    "adaptive_min_events": 5,
+    "adaptive_explore_slots": 1,
+    "restock_probe_minutes": 0,
+    "control_api": True,
+    "control_token": "",
+    "ha_sensors": True,
+    "browser_backend": "selenium",
+    "persistent_browser": True,
+    "accounts": [],
+    "browser_pool_size": 2,
+    "warm_standby": True,
+    "breaker_threshold": 3,
+    "breaker_cooldown_minutes": 10,
     "targets": [{"name": "Pingo Doce", "partner_id": 1197}],
 }
 
 
+TRACER = Tracer(TRACE_PATH)
+SHUTDOWN = threading.Event()  # set by SIGTERM (HA addon stop)
+JOURNAL = ClaimJournal(JOURNAL_PATH, legacy_path=HISTORY_PATH)
+NOTIFIER = Notifier(DEFAULT_CONFIG["ntfy_url"], OUTBOX_PATH)
+RESTOCKS = RestockLog(RESTOCK_PATH)
+# What the control API and the HA sensors report; written by the main loop
+STATUS = {"last_states": {}, "running": None, "login": None,
+          "last_attempt": None}
+PUBLISHER = StatePublisher(HA_API_URL, os.environ.get("SUPERVISOR_TOKEN"))
+BROWSER_POOL = None  # BrowserPool shared with the other accounts, if any
+
+
 def load_config() -> dict:
+    """Load add-on options, filling any key missing from an older
+    options.json with its DEFAULT_CONFIG value."""
     try:
         with open(CONFIG_PATH) as f:
-            return json.load(f)
+            return {**DEFAULT_CONFIG, **json.load(f)}
     except Exception as e:
         log(f"Error loading config, using defaults: {e}", "WARN")
         return DEFAULT_CONFIG
 
 
+@TRACER.traced("notify_phone")
 def notify_phone(topic: str, title: str, message: str) -> None:
-    try:
-        resp = requests.post(
-            f"https://ntfy.sh/{topic}",
-            data=message.encode("utf-8"),
-            headers={"Title": title, "Priority": "urgent", "Tags": "moneybag,rotating_light"},
-            timeout=10,
-        )
-        log(f"ntfy → '{title}' (status {resp.status_code})")
-    except Exception as e:
-        log(f"ntfy error: {e}", "ERROR")
+    """Queue an ntfy push; NOTIFIER's thread sends it (and retries it,
+    across restarts) without holding up the caller."""
+    NOTIFIER.send(topic, title, message)
 
 
-def create_driver():
+_user_agent = None
+
+
+def _headed_user_agent() -> str | None:
+    """The UA the installed Chromium sends when headed, so headless runs
+    don't announce themselves as "HeadlessChrome". Cached per process."""
+    global _user_agent
+    if _user_agent is None:
+        try:
+            version = subprocess.run([CHROMIUM_PATH, "--version"],
+                                     capture_output=True, text=True,
+                                     timeout=10).stdout
+        except Exception as e:
+            log(f"Could not read Chromium version: {e}", "WARN")
+            return None
+        _user_agent = desktop_user_agent(version)
+    return _user_agent
+
+
+CHROMEDRIVER_READY_TIMEOUT = 20  # seconds for chromedriver to open its port
+DRIVER_RETRY_DELAYS = (2, 5, 15)  # backoff between failed browser launches
+PAGE_LOAD_TIMEOUT = 30  # seconds; Selenium's own limit for driver.get
+# Watchdog deadline per supervised browser step, in seconds (see supervised)
+STEP_DEADLINES = {"session": 60, "packs": 60, "check": 60, "claim": 90,
+                  "sync": 120, "parallel": 60}
+
+
+class ProbedService(Service):
+    """chromedriver Service whose port is probed every 20ms until it accepts
+    connections (selenium backs off to 0.5s between probes), failing as soon
+    as the process exits instead of after the full timeout. Starting one
+    that is already running (a warm standby) is a no-op."""
+
+    def start(self) -> None:
+        if getattr(self, "process", None) is not None \
+                and self.process.poll() is None:
+            return
+        self._start_process(self.path)
+        deadline = time.monotonic() + CHROMEDRIVER_READY_TIMEOUT
+        try:
+            while not wait_for_port("127.0.0.1", self.port, 0.1):
+                self.assert_process_still_running()
+                if time.monotonic() >= deadline:
+                    raise WebDriverException(
+                        f"chromedriver not listening on port {self.port} "
+                        f"after {CHROMEDRIVER_READY_TIMEOUT}s")
+        except BaseException:
+            self.stop()
+            raise
+
+
+# Network.setBlockedURLs patterns (`*` wildcard) for what the scraper never
+# needs from the portal: images, media, web fonts, and the analytics, tag
+# manager and consent scripts it pulls from third parties. Stylesheets and
+# the Angular bundles are left alone — layout and the router depend on them.
+DEFAULT_BLOCKED_URLS = [
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*", "*.ico*",
+    "*.mp4*", "*.webm*",
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*connect.facebook.*", "*hotjar.com*", "*clarity.ms*",
+    "*adobedtm.com*", "*demdex.net*", "*omtrdc.net*", "*cookielaw.org*",
+    "*onetrust.com*",
+]
+
+
+def block_resources(driver, patterns: list) -> None:
+    """Apply the URL blocklist to the current tab (CDP state is per target,
+    so every new tab needs it too)."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        log(f"Could not set resource blocklist: {e}", "WARN")
+
+
+# Navigation + resource timing entries of the current document, reduced to
+# the fields summarise_page_weight reads.
+PAGE_WEIGHT_JS = """
+const pick = (e) => e && {initiatorType: e.initiatorType,
+                          transferSize: e.transferSize,
+                          startTime: e.startTime,
+                          loadEventEnd: e.loadEventEnd};
+return {
+    navigation: pick(performance.getEntriesByType('navigation')[0]) || null,
+    resources: performance.getEntriesByType('resource').map(pick),
+};
+"""
+
+
+def log_page_weight(driver, label: str) -> None:
+    """Log what the current page transferred and how long it took to load,
+    so the effect of the blocklist is visible in the add-on log."""
+    try:
+        with TRACER.span("nav.page_weight", target=label):
+            entries = driver.execute_script(PAGE_WEIGHT_JS)
+        summary = summarise_page_weight(entries["navigation"],
+                                        entries["resources"])
+    except Exception as e:
+        log(f"[{label}] Could not read page weight: {e}", "WARN")
+        return
+    log(f"[{label}] Page weight: {format_page_weight(summary)}")
+
+
+def chromium_arguments(headless: bool, images: bool | None = None) -> list:
+    """Command-line switches shared by both browser backends. `images`, if
+    given, turns image loading on or off for this run only (without
+    writing it into the profile, as the Selenium prefs do)."""
+    arguments = ["--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu",
+                 "--disable-software-rasterizer", "--window-size=1280,720"]
+    if headless:
+        arguments.append("--headless=new")
+        user_agent = _headed_user_agent()
+        if user_agent:
+            arguments.append(f"--user-agent={user_agent}")
+    if images is not None:
+        arguments.append("--blink-settings=imagesEnabled="
+                         f"{'true' if images else 'false'}")
+    return arguments
+
+
+@TRACER.traced("create_driver")
+def create_driver(headless: bool = False, blocked_urls: list | None = None,
+                  service: Service | None = None,
+                  debugger_address: str | None = None):
+    """Launch Chromium on PROFILE_PATH. `blocked_urls` (Network.setBlockedURLs
+    patterns) also turns off image loading; it is meant for headless runs,
+    the headed login view should get the full page. `service` is an already
+    running chromedriver to use (warm standby); by default one is started.
+    With `debugger_address` ("127.0.0.1:<port>") chromedriver attaches to
+    that running Chromium instead, which already has its switches."""
     options = Options()
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-software-rasterizer")
-    options.add_argument(f"--user-data-dir={PROFILE_PATH}")
-    options.add_argument("--window-size=1280,720")
-    options.binary_location = "/usr/bin/chromium-browser"
-    service = Service("/usr/bin/chromedriver")
+    if debugger_address:
+        options.debugger_address = debugger_address
+    else:
+        for argument in chromium_arguments(headless):
+            options.add_argument(argument)
+        options.add_argument(f"--user-data-dir={PROFILE_PATH}")
+        # Written into the profile's Preferences, so always set explicitly:
+        # otherwise a blocked headless run would leave images off for the
+        # login.
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images":
+                2 if blocked_urls else 1,
+        })
+        options.binary_location = CHROMIUM_PATH
+    service = service or ProbedService(CHROMEDRIVER_PATH)
     try:
-        return webdriver.Chrome(service=service, options=options)
+        driver = webdriver.Chrome(service=service, options=options)
     except Exception as e:
         log(f"Error creating driver: {e}", "ERROR")
+        service.stop()
         return None
+    # A page that never fires `load` errors out here, well inside the
+    # supervisor's step deadline
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    if blocked_urls:
+        block_resources(driver, blocked_urls)
+    return driver
+
+
+def create_cdp_driver(headless: bool = False, blocked_urls: list | None = None,
+                      attach_to: dict | None = None):
+    """create_driver for `browser_backend: cdp`: the same Chromium and
+    profile, driven over the DevTools websocket without chromedriver.
+    `attach_to` is a BrowserHost record of a running Chromium to use."""
+    if CdpDriver is None:
+        log("CDP backend unavailable (websocket-client missing)", "ERROR")
+        return None
+    try:
+        if attach_to is not None:
+            driver = CdpDriver.attach(attach_to["ws_url"],
+                                      AdoptedProcess(attach_to["pid"]))
+        else:
+            driver = CdpDriver.launch(
+                CHROMIUM_PATH, PROFILE_PATH,
+                chromium_arguments(headless, images=not blocked_urls))
+    except Exception as e:
+        log(f"Error creating CDP driver: {e}", "ERROR")
+        return None
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    if blocked_urls:
+        block_resources(driver, blocked_urls)
+    return driver
+
+
+class BrowserSession:
+    """The monitor's browser: stands in for a WebDriver (attribute access is
+    delegated to the current one) but can relaunch Chromium underneath.
+
+    While the EDP session is logged in Chromium runs headless; when a human
+    has to log in via noVNC it is relaunched headed on the Xvfb display, and
+    headless again afterwards. Both share PROFILE_PATH, so only one instance
+    runs at a time. `prefer_headless=False` keeps the old always-headed mode.
+
+    The `display` stack is started before any headed launch and released
+    (stopped after its idle timeout) once Chromium is headless again.
+    `blocked_urls` applies to headless launches only.
+
+    With `warm_standby` a spare chromedriver is kept running, so a relaunch
+    (recovery, login switch) only has to start Chromium. `supervisor`, when
+    set, is the BrowserSupervisor that supervised() runs steps under.
+    `backend` "cdp" drives Chromium over CDP directly (cdp_backend.py);
+    there is no chromedriver then, so no standby either.
+
+    With a `host` (BrowserHost), headless Chromium is started detached and
+    recorded, a launch first reattaches to the one an earlier monitor
+    process left running, and detach() leaves it running at exit. Headed
+    browsers (login) are never kept.
+    """
+
+    def __init__(self, prefer_headless: bool = True,
+                 display: DisplayStack | None = None,
+                 blocked_urls: list | None = None,
+                 warm_standby: bool = False, backend: str = "selenium",
+                 host: BrowserHost | None = None):
+        self.prefer_headless = prefer_headless
+        self.display = display
+        self.blocked_urls = blocked_urls
+        self.backend = backend
+        self.host = host
+        self.attached = None  # host's record of the Chromium in use
+        self.warm_standby = warm_standby and backend == "selenium"
+        self.supervisor = None
+        self.driver = None
+        self.headless = None
+        self._standby = None
+        self._standby_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        driver = self.__dict__.get("driver")
+        if driver is None:
+            raise AttributeError(f"browser not running (wanted .{name})")
+        return getattr(driver, name)
+
+    def launch(self, headless: bool | None = None) -> bool:
+        """(Re)start Chromium, headless or headed. Returns False on failure."""
+        if headless is None:
+            headless = self.prefer_headless
+        self.quit()
+        if not headless and self.display is not None:
+            self.display.ensure_started()
+        mode = "headless" if headless else "headed"
+        blocked = self.blocked_urls if headless else None
+        if self.host is not None and not headless:
+            self.host.stop()  # a kept headless Chromium holds the profile
+        if headless and self.host is not None:
+            self.driver = self._launch_persistent(blocked)
+        elif self.backend == "cdp":
+            log(f"Launching Chromium ({mode}, CDP)")
+            self.driver = create_cdp_driver(headless, blocked)
+        else:
+            service = self._take_standby()
+            log(f"Launching Chromium ({mode}"
+                f"{', standby chromedriver' if service else ''})")
+            self.driver = create_driver(headless, blocked, service)
+        self.headless = headless if self.driver is not None else None
+        if headless and self.display is not None:
+            self.display.release()
+        if self.warm_standby:
+            self._prepare_standby()
+        return self.driver is not None
+
+    def _launch_persistent(self, blocked: list | None):
+        """Reattach to the Chromium an earlier monitor process left running,
+        or start a detached one for the next process to reattach to."""
+        arguments = chromium_arguments(True, images=not blocked)
+        record = self.host.find(arguments)
+        if record is not None:
+            driver = self._attach(record, blocked)
+            if driver is not None:
+                log(f"Reattached to running Chromium (pid {record['pid']}, "
+                    f"started {record['started_at']})")
+                return driver
+            self.host.stop(record)
+        log("Launching Chromium (headless, persistent)")
+        try:
+            record = self.host.start(arguments)
+        except (BrowserStartError, OSError) as e:
+            log(f"Error starting Chromium: {e}", "ERROR")
+            return None
+        driver = self._attach(record, blocked)
+        if driver is None:
+            self.host.stop(record)
+        return driver
+
+    def _attach(self, record: dict, blocked: list | None):
+        if self.backend == "cdp":
+            driver = create_cdp_driver(True, blocked, attach_to=record)
+        else:
+            driver = create_driver(
+                True, blocked, self._take_standby(),
+                debugger_address=f"127.0.0.1:{record['port']}")
+        if driver is None:
+            return None
+        self.attached = record
+        if close_extra_tabs(driver) and blocked:
+            block_resources(driver, blocked)  # now on another tab
+        return driver
+
+    def _prepare_standby(self) -> None:
+        """Start a spare chromedriver in the background, if none is ready."""
+        def start():
+            service = ProbedService(CHROMEDRIVER_PATH)
+            try:
+                service.start()
+            except Exception as e:
+                log(f"Standby chromedriver failed to start: {e}", "WARN")
+                return
+            with self._standby_lock:
+                if self._standby is None and self.warm_standby:
+                    self._standby = service
+                    return
+            service.stop()
+
+        with self._standby_lock:
+            if self._standby is not None:
+                return
+        threading.Thread(target=start, name="standby", daemon=True).start()
+
+    def _take_standby(self) -> Service | None:
+        with self._standby_lock:
+            service, self._standby = self._standby, None
+        if service is None:
+            return None
+        if service.process.poll() is None:
+            return service
+        service.stop()
+        return None
+
+    def stop_standby(self) -> None:
+        service = self._take_standby()
+        if service is not None:
+            service.stop()
+
+    def show_for_login(self) -> bool:
+        """Make sure the browser is visible on the noVNC display."""
+        if self.driver is not None and self.headless is False:
+            return True
+        return self.launch(headless=False)
+
+    def hide_after_login(self) -> bool:
+        """Go back to the preferred (usually headless) mode."""
+        if self.driver is not None and self.headless == self.prefer_headless:
+            return True
+        return self.launch(self.prefer_headless)
+
+    def block_in_current_tab(self) -> None:
+        """Re-apply the blocklist after switching to a newly opened tab."""
+        if self.headless and self.blocked_urls:
+            block_resources(self.driver, self.blocked_urls)
+
+    def launch_with_retry(self) -> bool:
+        """launch(), retried after each of DRIVER_RETRY_DELAYS seconds."""
+        if self.launch():
+            return True
+        for delay in DRIVER_RETRY_DELAYS:
+            log(f"Driver create failed, retrying in {delay}s", "WARN")
+            time.sleep(delay)
+            if self.launch():
+                return True
+        return False
+
+    def _process_roots(self) -> list:
+        """chromedriver (or Chromium itself, for CDP), plus an attached
+        Chromium, which isn't chromedriver's child."""
+        roots = []
+        try:
+            roots.append(self.driver.service.process.pid)
+        except AttributeError:
+            pass
+        if self.attached is not None and self.attached["pid"] not in roots:
+            roots.append(self.attached["pid"])
+        return roots
+
+    def memory_bytes(self) -> int:
+        """RSS of chromedriver and every Chromium process."""
+        return sum(process_tree_rss(pid) for pid in self._process_roots())
+
+    def hibernate(self) -> int:
+        """Quit the browser for a long idle gap, letting Chromium write the
+        profile (cookies, local storage) on a clean shutdown. Returns the
+        resident memory released, in bytes."""
+        if self.driver is None:
+            return 0
+        rss = self.memory_bytes()
+        try:
+            # Unload the SPA first so its storage writes land before exit
+            self.driver.get("about:blank")
+        except Exception as e:
+            log(f"Could not leave the portal before hibernating: {e}", "WARN")
+        self.quit()
+        self.stop_standby()
+        if self.display is not None and self.display.running():
+            self.display.stop()
+        return rss
+
+    def kill(self) -> None:
+        """SIGKILL chromedriver and every Chromium process under it, for a
+        hung or crashed browser that quit() can't be trusted with. Any call
+        still blocked on chromedriver fails at once."""
+        if self.driver is None:
+            return
+        pids = [pid for root in self._process_roots()
+                for pid in process_tree_pids(root)]
+        if pids:
+            for pid in reversed(pids):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            log(f"Killed the browser ({len(pids)} process(es))", "WARN")
+            try:
+                self.driver.service.process.wait(5)
+            except Exception:
+                pass
+        if self.attached is not None:
+            self.host.forget()
+            self.attached = None
+        self.driver = None
+        self.headless = None
+
+    def quit(self) -> None:
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                log(f"Error quitting driver: {e}", "WARN")
+        if self.attached is not None:
+            # chromedriver's quit() leaves an attached Chromium running
+            self.host.stop(self.attached)
+            self.attached = None
+        self.driver = None
+        self.headless = None
+
+    def detach(self) -> None:
+        """At exit: leave a persistent Chromium running for the next monitor
+        process to reattach to. Any other browser is quit."""
+        if self.attached is None:
+            self.quit()
+            return
+        try:
+            if self.backend == "cdp":
+                self.driver.detach()
+            else:
+                # Only chromedriver: the browser isn't its child
+                self.driver.service.process.kill()
+                self.driver.service.process.wait(5)
+        except Exception as e:
+            log(f"Error detaching from the browser: {e}", "WARN")
+        log(f"Leaving Chromium (pid {self.attached['pid']}) running for the "
+            "next start")
+        self.attached = None
+        self.driver = None
+        self.headless = None
+
+
+def close_tabs_except(driver, keep: str) -> int:
+    """Close every tab but `keep` and switch back to it. Returns how many
+    were closed."""
+    handles = driver.window_handles
+    for handle in handles:
+        if handle != keep:
+            driver.switch_to.window(handle)
+            driver.close()
+    driver.switch_to.window(keep)
+    return len(handles) - 1
+
+
+def close_extra_tabs(driver) -> int:
+    """Close every tab but the first, e.g. race tabs a killed monitor
+    process left open in a reattached browser. Returns how many."""
+    try:
+        return close_tabs_except(driver, driver.window_handles[0])
+    except Exception as e:
+        log(f"Could not close leftover tabs: {e}", "WARN")
+        return 0
+
+
+def browser_slot(step: str):
+    """Context holding a BROWSER_POOL slot for one browser step; a no-op
+    with a single account."""
+    if BROWSER_POOL is None:
+        return nullcontext()
+    return BROWSER_POOL.slot(step, cancel=SHUTDOWN)
+
+
+def supervised(driver, step: str, fn, *args, retry: bool = True,
+               deadline: float | None = None, pooled: bool = True):
+    """fn(*args) under the BrowserSession's supervisor: bounded by the
+    step's STEP_DEADLINES entry, with the browser relaunched and the step
+    retried once (if `retry`) after a hang or crash. With several accounts
+    the step first takes a BROWSER_POOL slot, unless `pooled` is False
+    (fn then takes browser_slot() around its own browser steps). Plain
+    WebDrivers (bench, tests) run fn directly."""
+    supervisor = getattr(driver, "supervisor", None)
+    if supervisor is None:
+        return fn(*args)
+    with browser_slot(step) if pooled else nullcontext():
+        return supervisor.run(step, fn, *args, retry=retry, deadline=deadline)
+
+
+# Resolve as soon as the condition body (spliced in at COND, must `return`
+# a truthy value when met) holds: re-evaluated on every DOM mutation and on
+# every router URL change, not on a polling interval. Resolves null once
+# arguments[0] ms have passed. Angular's router moves the URL with
+# history.pushState/replaceState, which fire no event of their own, so those
+# are wrapped once per page to emit `edp:urlchange`.
+DOM_WAIT_JS = """
+const done = arguments[arguments.length - 1];
+const cond = () => { COND };
+if (!window.__edpUrlHook) {
+    window.__edpUrlHook = true;
+    for (const fn of ['pushState', 'replaceState']) {
+        const orig = history[fn];
+        history[fn] = function () {
+            const r = orig.apply(this, arguments);
+            window.dispatchEvent(new Event('edp:urlchange'));
+            return r;
+        };
+    }
+}
+let finished = false;
+const observer = new MutationObserver(() => check());
+const finish = (v) => {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    window.removeEventListener('popstate', check);
+    window.removeEventListener('edp:urlchange', check);
+    done(v);
+};
+const check = () => {
+    let v = null;
+    try { v = cond(); } catch (e) {}
+    if (v) finish(v);
+};
+const timer = setTimeout(() => finish(null), arguments[0]);
+observer.observe(document, {childList: true, subtree: true,
+                            attributes: true, characterData: true});
+window.addEventListener('popstate', check);
+window.addEventListener('edp:urlchange', check);
+check();
+"""
+
+
+def wait_for_js(driver, condition: str, timeout: float):
+    """Event-driven replacement for WebDriverWait(driver, timeout).until(...).
+
+    `condition` is a JS function body returning a truthy value once the page
+    is in the wanted state; that value (e.g. an element) is returned. Raises
+    TimeoutException after `timeout` seconds, like WebDriverWait. If the
+    document is replaced mid-wait (full navigation), the wait is re-armed
+    on the new document for the time that's left; any other error (a dead
+    session, a bug in `condition`) is raised as is.
+    """
+    script = DOM_WAIT_JS.replace("COND", condition)
+    deadline = time.monotonic() + timeout
+    unloaded = None
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutException(
+                f"JS condition not met within {timeout}s") from unloaded
+        driver.set_script_timeout(remaining + 5)
+        try:
+            result = driver.execute_async_script(script, int(remaining * 1000))
+        except TimeoutException:
+            raise
+        except WebDriverException as e:
+            if not is_navigation_error(e):
+                raise
+            # Document unloaded under the script — retry on the new one.
+            unloaded = e
+            time.sleep(0.05)
+            continue
+        if result:
+            return result
+        raise TimeoutException(f"JS condition not met within {timeout}s")
+
+
+# One round trip for the whole packs page: text, wrapper position and detail
+# link (when the card renders one) of every <benefits-card>, in DOM order.
+PACK_CARDS_JS = """
+return Array.from(document.querySelectorAll('benefits-card')).map((card, i) => {
+    const wrapper = card.querySelector('.benefits-card-wrapper');
+    const rect = wrapper ? wrapper.getBoundingClientRect() : null;
+    const link = card.querySelector('a[href*="/beneficios/detalhe/"]');
+    return {
+        index: i,
+        text: card.innerText || '',
+        has_wrapper: !!wrapper,
+        x: rect ? rect.left + 10 : null,
+        y: rect ? rect.top + 10 : null,
+        href: link ? link.href : null,
+    };
+});
+"""
+
+# Click the wrapper of the index-th card via dispatched pointer events
+# (Angular ignores plain .click() on this element). Re-checks the card text
+# so a re-rendered list can't send us to the wrong partner.
+CLICK_PACK_CARD_JS = """
+const card = document.querySelectorAll('benefits-card')[arguments[0]];
+if (!card || !(card.innerText || '').toLowerCase().includes(arguments[1])) {
+    return false;
+}
+const wrapper = card.querySelector('.benefits-card-wrapper');
+if (!wrapper) return false;
+const rect = wrapper.getBoundingClientRect();
+const x = rect.left + 10, y = rect.top + 10;
+['pointerdown','mousedown','pointerup','mouseup','click'].forEach(t => {
+    wrapper.dispatchEvent(new MouseEvent(t, {
+        bubbles: true, cancelable: true, view: window,
+        clientX: x, clientY: y, button: 0
+    }));
+});
+return true;
+"""
+
+
+def load_pack_cards(driver, label: str = "packs") -> list | None:
+    """Open /beneficios/pack and return every card as a dict (see
+    PACK_CARDS_JS). Returns None if no card rendered within 15s.
+    """
+    log(f"[{label}] Navigating to packs page")
+    with TRACER.span("nav.packs_get", target=label):
+        driver.get(PACKS_URL)
+    try:
+        with TRACER.span("nav.packs_render", target=label):
+            wait_for_js(driver, "return document.querySelector('benefits-card');",
+                        15)
+    except TimeoutException:
+        log(f"[{label}] No benefits-card rendered within 15s "
+            f"(at {driver.current_url})", "WARN")
+        return None
+    with TRACER.span("nav.cards_snapshot", target=label):
+        cards = driver.execute_script(PACK_CARDS_JS)
+    log(f"[{label}] Found {len(cards)} benefits-card elements on page")
+    log_page_weight(driver, label)
+    return cards
+
+
+def open_pack_card(driver, voucher_name: str, card: dict) -> bool:
+    """Go from the packs page to `card`'s detail page.
+
+    Uses the card's detail link when it has one; otherwise dispatches pointer
+    events on its wrapper, first stepping back to the packs page if an
+    earlier target moved us off it. Returns True once on /beneficios/detalhe/.
+    """
+    if card.get("href"):
+        log(f"[{voucher_name}] Opening detail link {card['href']}")
+        with TRACER.span("nav.card_link_get", target=voucher_name):
+            driver.get(card["href"])
+    else:
+        if "/beneficios/pack" not in driver.current_url:
+            try:
+                with TRACER.span("nav.packs_back", target=voucher_name):
+                    driver.back()
+                    wait_for_js(driver,
+                                "return document.querySelector('benefits-card');",
+                                15)
+            except TimeoutException:
+                log(f"[{voucher_name}] Packs page did not re-render after back",
+                    "WARN")
+                return False
+        if not card.get("has_wrapper"):
+            log(f"[{voucher_name}] benefits-card-wrapper not inside card", "ERROR")
+            return False
+        log(f"[{voucher_name}] Dispatching pointer events on card wrapper")
+        with TRACER.span("nav.card_click", target=voucher_name):
+            clicked = driver.execute_script(CLICK_PACK_CARD_JS, card["index"],
+                                            voucher_name.lower())
+        if not clicked:
+            log(f"[{voucher_name}] Card #{card['index']} no longer matches — "
+                f"packs list re-rendered?", "WARN")
+            return False
+
+    try:
+        with TRACER.span("nav.detail_route", target=voucher_name):
+            wait_for_js(
+                driver,
+                "return location.pathname.includes('/beneficios/detalhe/');",
+                10,
+            )
+    except TimeoutException:
+        log(f"[{voucher_name}] Did not navigate to detalhe page within 10s "
+            f"(still at {driver.current_url})", "ERROR")
+        return False
+
+    log(f"[{voucher_name}] Landed on {driver.current_url}")
+    return True
 
 
 def navigate_to_voucher(driver, voucher_name: str) -> bool:
@@ -105,96 +905,157 @@ def navigate_to_voucher(driver, voucher_name: str) -> bool:
 
     Logic:
     1. Go to /beneficios/pack
-    2. Find <benefits-card> whose text contains voucher_name (case-insensitive)
-    3. Click its .benefits-card-wrapper via dispatched pointer events
-       (Angular ignores plain .click() on this element)
+    2. Snapshot every <benefits-card> in one execute_script call and pick the
+       first whose text contains voucher_name (case-insensitive)
+    3. Follow its detail link, or click its .benefits-card-wrapper via
+       dispatched pointer events (Angular ignores plain .click() on this element)
     4. Wait up to 10s for URL to contain /beneficios/detalhe/
 
     Returns True if landed on a detail page; False if card not found
     or timeout. Caller decides whether to log/notify.
     """
-    log(f"[{voucher_name}] Navigating to packs page")
-    driver.get(PACKS_URL)
-    try:
-        WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.TAG_NAME, "benefits-card"))
-        )
-    except TimeoutException:
-        log(f"[{voucher_name}] No benefits-card rendered within 15s "
-            f"(at {driver.current_url})", "WARN")
+    cards = load_pack_cards(driver, voucher_name)
+    if cards is None:
         return False
 
-    cards = driver.find_elements(By.TAG_NAME, "benefits-card")
-    log(f"[{voucher_name}] Found {len(cards)} benefits-card elements on page")
-
-    target_card = None
-    for card in cards:
-        if voucher_name.lower() in card.text.lower():
-            target_card = card
-            break
-
+    target_card = match_pack_cards(cards, [voucher_name]).get(voucher_name)
     if not target_card:
         log(f"[{voucher_name}] Card not found on packs page", "WARN")
         return False
 
-    try:
-        wrapper = target_card.find_element(By.CSS_SELECTOR, ".benefits-card-wrapper")
-    except NoSuchElementException:
-        log(f"[{voucher_name}] benefits-card-wrapper not inside card", "ERROR")
-        return False
+    return open_pack_card(driver, voucher_name, target_card)
+
+
+# Truthy once a detail page has rendered its state (button or availability
+# copy), or has been redirected off /beneficios/detalhe/.
+DETAIL_RENDERED_COND = """
+if (!location.pathname.includes('/beneficios/detalhe/')) return true;
+if (document.querySelector('button.edp-large-button')) return true;
+return /c[óo]digos dispon|esgotad/i.test(document.body.innerText);
+"""
+
+
+# State of a parallel-mode tab navigating to arguments[0]: null while the
+# document it had before Page.navigate (marked __edpStale) is still there or
+# the new one hasn't rendered, "redirected" once a document at another URL
+# has replaced it, "rendered" once the detail page shows its state.
+PARALLEL_TAB_JS = """
+if (window.__edpStale) return null;
+if (location.href !== arguments[0]) return 'redirected';
+return (() => { COND })() ? 'rendered' : null;
+""".replace("COND", DETAIL_RENDERED_COND)
 
-    log(f"[{voucher_name}] Dispatching pointer events on card wrapper")
-    driver.execute_script(
-        """
-        const wrapper = arguments[0];
-        const rect = wrapper.getBoundingClientRect();
-        const x = rect.left + 10, y = rect.top + 10;
-        ['pointerdown','mousedown','pointerup','mouseup','click'].forEach(t => {
-            wrapper.dispatchEvent(new MouseEvent(t, {
-                bubbles: true, cancelable: true, view: window,
-                clientX: x, clientY: y, button: 0
-            }));
-        });
-        """,
-        wrapper,
-    )
+
+def open_detail_url(driver, voucher_name: str, url: str) -> bool:
+    """Open a known detail URL directly, skipping the packs page.
+
+    Waits up to 15s for the detail page to render its state (button or
+    availability copy). Returns False on a redirect away from
+    /beneficios/detalhe/ (stale link, login) or if nothing rendered.
+    """
+    log(f"[{voucher_name}] Opening cached detail page {url}")
+    with TRACER.span("nav.cached_get", target=voucher_name):
+        driver.get(url)
 
     try:
-        WebDriverWait(driver, 10).until(
-            lambda d: "/beneficios/detalhe/" in d.current_url
-        )
+        with TRACER.span("nav.cached_render", target=voucher_name):
+            wait_for_js(driver, DETAIL_RENDERED_COND, DETAIL_RENDER_TIMEOUT)
     except TimeoutException:
-        log(f"[{voucher_name}] Did not navigate to detalhe page within 10s "
-            f"(still at {driver.current_url})", "ERROR")
+        log(f"[{voucher_name}] Cached detail page did not render within "
+            f"{DETAIL_RENDER_TIMEOUT}s", "WARN")
+        return False
+
+    if "/beneficios/detalhe/" not in driver.current_url:
+        log(f"[{voucher_name}] Cached detail page redirected to "
+            f"{driver.current_url}", "WARN")
         return False
 
     log(f"[{voucher_name}] Landed on {driver.current_url}")
+    log_page_weight(driver, voucher_name)
+    return True
+
+
+def open_voucher(driver, target: dict, catalog: dict,
+                 card: dict | None = None) -> bool:
+    """Reach `target`'s detail page by the fastest known route.
+
+    1. Cached detail URL for (name, partner_id), if any — no packs page.
+    2. On a miss or redirect: the packs-page click path (`card` from an
+       earlier packs snapshot when we have one and no cache entry was tried,
+       else a fresh navigate_to_voucher).
+    Whatever URL the fallback lands on is written back to the catalog.
+    """
+    name = target["name"]
+    url = cached_detail_url(catalog, target)
+    if url:
+        if open_detail_url(driver, name, url):
+            return True
+        card = None  # we've left the packs page; start over from scratch
+
+    if card is not None:
+        ok = open_pack_card(driver, name, card)
+    else:
+        ok = navigate_to_voucher(driver, name)
+    if not ok:
+        return False
+
+    landed = driver.current_url
+    if landed != url:
+        cache_detail_url(catalog, target, landed)
     return True
 
 
+def cache_detail_url(catalog: dict, target: dict, url: str) -> None:
+    """Remember `url` as `target`'s detail page, in `catalog` and on disk."""
+    name = target["name"]
+    log(f"[{name}] Caching detail URL {url}")
+    save_catalog_entry(CATALOG_PATH, name, target.get("partner_id"), url,
+                       datetime.now())
+    catalog[name] = {
+        "partner_id": target.get("partner_id"),
+        "url": url,
+        "resolved_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+# Everything check_voucher needs from the detail page in one round trip,
+# reduced in-page to a few flags. Markers must match snapshot_from_text.
+DETAIL_SNAPSHOT_JS = """
+const text = document.body ? document.body.innerText : '';
+const lowered = text.toLowerCase();
+const btn = document.querySelector('button.btn.btn-primary.edp-large-button');
+const m = text.match(/C[óo]digos dispon[íi]veis:?\\s*(\\d+)/);
+return {
+    url: location.href,
+    button_present: !!btn,
+    button_disabled: !btn || btn.hasAttribute('disabled'),
+    codigos: m ? parseInt(m[1], 10) : null,
+    login: (lowered.includes('login') || lowered.includes('iniciar'))
+        && text.length < 500,
+    saldo: lowered.includes('saldo insuficiente'),
+    esgotado: lowered.includes('esgotad') || lowered.includes('volte no próximo'),
+};
+"""
+
+
+@TRACER.traced("check_voucher")
 def check_voucher(driver, voucher_name: str) -> tuple:
     """Inspect the current detail page and return (available, status).
 
-    Caller must have navigated to the detail page first. See parse_voucher_status
-    for the five possible status codes.
+    Caller must have navigated to the detail page first. The page is read
+    with a single DETAIL_SNAPSHOT_JS call; see parse_voucher_status for the
+    five possible status codes.
     """
-    body_text = driver.find_element(By.TAG_NAME, "body").text
-
-    try:
-        btn = driver.find_element(By.CSS_SELECTOR, "button.btn.btn-primary.edp-large-button")
-        btn_disabled = btn.get_attribute("disabled") is not None
-    except NoSuchElementException:
+    snap = driver.execute_script(DETAIL_SNAPSHOT_JS)
+    if not snap["button_present"]:
         log(f"[{voucher_name}] 'Gerar código' button not found - treating as disabled", "WARN")
-        btn_disabled = True
-
-    import re
-    m = re.search(r"C[óo]digos dispon[íi]veis:?\s*(\d+)", body_text)
-    codigos = int(m.group(1)) if m else None
 
-    available, status = parse_voucher_status(body_text, btn_disabled, codigos)
+    available, status = parse_voucher_status(snap)
 
-    log(f"[{voucher_name}] state={status} button_disabled={btn_disabled} "
+    codigos = snap["codigos"]
+    log(f"[{voucher_name}] state={status} button_disabled={snap['button_disabled']} "
         f"codigos_disponiveis={codigos if codigos is not None else '?'}")
+    RESTOCKS.observe(voucher_name, status, codigos)
 
     return (available, status)
 
@@ -203,96 +1064,138 @@ class ClaimError(Exception):
     """Raised when any step of the claim flow fails."""
 
 
-def claim_voucher(driver, voucher_name: str) -> dict:
+def claim_voucher(driver, voucher_name: str,
+                  slot: datetime | None = None) -> dict:
     """Run the claim flow on the voucher detail page. Caller MUST have navigated
     there and verified status == 'disponivel' (button enabled).
 
+    `slot` is the scheduled attempt time; when given, the slot-to-submit
+    latency is logged the moment the form is submitted.
+
     Returns {"code": str, "validity": str} on success.
     Raises ClaimError on any timeout / element-missing.
     """
     log(f"[{voucher_name}] Starting claim flow")
 
     # Step 1: Click 1st "Gerar código"
-    try:
-        btn1 = driver.find_element(By.CSS_SELECTOR, "button.btn.btn-primary.edp-large-button")
-    except NoSuchElementException:
-        raise ClaimError(f"[{voucher_name}] 1st 'Gerar código' button not found")
-    btn1.click()
+    with TRACER.span("claim.1_click_generate", target=voucher_name):
+        try:
+            btn1 = driver.find_element(
+                By.CSS_SELECTOR, "button.btn.btn-primary.edp-large-button")
+        except NoSuchElementException:
+            raise ClaimError(f"[{voucher_name}] 1st 'Gerar código' button not found")
+        btn1.click()
     log(f"[{voucher_name}] Clicked 1st 'Gerar código'")
 
     # Step 2: Wait for modal
-    try:
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "ngb-modal-window"))
-        )
-    except TimeoutException:
-        raise ClaimError(f"[{voucher_name}] Modal did not open within 10s")
+    with TRACER.span("claim.2_modal", target=voucher_name):
+        try:
+            wait_for_js(driver,
+                        "return document.querySelector('ngb-modal-window');", 10)
+        except TimeoutException:
+            raise ClaimError(f"[{voucher_name}] Modal did not open within 10s")
     log(f"[{voucher_name}] Modal opened")
 
     # Step 3: Click terms checkbox via JS click. Native cb.click() raises
     # ElementNotInteractableException because the input is visually hidden
     # (Bootstrap form-check pattern: opacity:0 with label overlay).
-    try:
-        cb = driver.find_element(
-            By.CSS_SELECTOR, "ngb-modal-window input#form-terms.form-check-input"
-        )
-    except NoSuchElementException:
-        raise ClaimError(f"[{voucher_name}] Terms checkbox not found")
-    driver.execute_script("arguments[0].click();", cb)
+    with TRACER.span("claim.3_terms", target=voucher_name):
+        try:
+            cb = driver.find_element(
+                By.CSS_SELECTOR, "ngb-modal-window input#form-terms.form-check-input"
+            )
+        except NoSuchElementException:
+            raise ClaimError(f"[{voucher_name}] Terms checkbox not found")
+        driver.execute_script("arguments[0].click();", cb)
     log(f"[{voucher_name}] Terms checkbox ticked")
 
     # Step 4: Wait for submit button to enable
-    def submit_enabled(d):
+    with TRACER.span("claim.4_submit_enabled", target=voucher_name):
         try:
-            b = d.find_element(
-                By.CSS_SELECTOR, "ngb-modal-window button.btn.btn-primary.submit-button"
+            submit = wait_for_js(
+                driver,
+                """
+                const b = document.querySelector(
+                    'ngb-modal-window button.btn.btn-primary.submit-button');
+                return b && !b.hasAttribute('disabled') ? b : null;
+                """,
+                10,
             )
-            return b if b.get_attribute("disabled") is None else False
-        except NoSuchElementException:
-            return False
-
-    try:
-        submit = WebDriverWait(driver, 10).until(submit_enabled)
-    except TimeoutException:
-        raise ClaimError(f"[{voucher_name}] Submit button did not enable within 10s")
+        except TimeoutException:
+            raise ClaimError(
+                f"[{voucher_name}] Submit button did not enable within 10s")
 
     # Step 5: Click submit
-    submit.click()
-    log(f"[{voucher_name}] Submit clicked")
+    with TRACER.span("claim.5_submit", target=voucher_name):
+        submit.click()
+    if slot is not None:
+        latency_ms = (datetime.now() - slot).total_seconds() * 1000
+        log(f"[{voucher_name}] Submit clicked — slot→submit {latency_ms:.0f} ms")
+    else:
+        log(f"[{voucher_name}] Submit clicked")
 
     # Step 6: Wait for success modal (the code element)
-    try:
-        WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, ".code-card-body-text-code"))
-        )
-    except TimeoutException:
-        raise ClaimError(
-            f"[{voucher_name}] Success modal with code did not appear within 15s"
-        )
+    with TRACER.span("claim.6_code_card", target=voucher_name):
+        try:
+            wait_for_js(
+                driver,
+                "return document.querySelector('.code-card-body-text-code');", 15)
+        except TimeoutException:
+            raise ClaimError(
+                f"[{voucher_name}] Success modal with code did not appear within 15s"
+            )
 
     # Step 7: Read code + validity
-    code = driver.find_element(By.CSS_SELECTOR, ".code-card-body-text-code").text.strip()
-    try:
-        validity_raw = driver.find_element(
-            By.CSS_SELECTOR, ".code-card-body-text-date"
-        ).text.strip()
-        # Strip "Até " prefix if present
-        validity = validity_raw.replace("Até ", "").strip()
-    except NoSuchElementException:
-        validity = "?"
+    with TRACER.span("claim.7_read_code", target=voucher_name):
+        code = driver.find_element(
+            By.CSS_SELECTOR, ".code-card-body-text-code").text.strip()
+        try:
+            validity_raw = driver.find_element(
+                By.CSS_SELECTOR, ".code-card-body-text-date"
+            ).text.strip()
+            # Strip "Até " prefix if present
+            validity = validity_raw.replace("Até ", "").strip()
+        except NoSuchElementException:
+            validity = "?"
 
     log(f"[{voucher_name}] Code captured: {code} (valid until {validity})")
 
     # Step 8: Close success modal with Escape
-    try:
-        driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
-    except Exception as e:
-        log(f"[{voucher_name}] Could not send Escape to close modal: {e}", "WARN")
+    with TRACER.span("claim.8_close_modal", target=voucher_name):
+        try:
+            driver.find_element(By.TAG_NAME, "body").send_keys(Keys.ESCAPE)
+        except Exception as e:
+            log(f"[{voucher_name}] Could not send Escape to close modal: {e}",
+                "WARN")
 
     return {"code": code, "validity": validity}
 
 
 CHECK_LOGIN_EVERY = 30  # seconds; decoupled from ntfy reminder cadence
+DETAIL_RENDER_TIMEOUT = 15  # seconds for a detail page to show its state
+PARALLEL_POLL = 0.05  # seconds between rounds over the parallel tabs
+
+# Settled state of the packs page: cards rendered (logged in) or bounced off
+# /beneficios (to the login page). Anything else is decided by body text.
+SESSION_STATE_COND = """
+if (document.querySelector('benefits-card')) return 'cards';
+if (!location.pathname.startsWith('/beneficios')) return 'login';
+return null;
+"""
+
+
+def page_needs_login(driver, timeout: float = 15) -> bool:
+    """Call right after driver.get(PACKS_URL): waits for the page to settle
+    (see SESSION_STATE_COND) rather than a fixed sleep, then decides whether
+    the EDP session is logged out."""
+    try:
+        state = wait_for_js(driver, SESSION_STATE_COND, timeout)
+    except TimeoutException:
+        state = None
+    if state:
+        return state == "login"
+    body_text = driver.find_element(By.TAG_NAME, "body").text.lower()
+    return ("login" in body_text or "iniciar" in body_text) and len(body_text) < 500
 
 
 def wait_for_login(driver, ntfy_topic: str, reminder_interval: int) -> None:
@@ -301,26 +1204,37 @@ def wait_for_login(driver, ntfy_topic: str, reminder_interval: int) -> None:
     Polls login status every CHECK_LOGIN_EVERY seconds (so user logging in
     immediately is detected within ~30s). Sends ntfy reminder only every
     `reminder_interval` seconds (so the user doesn't get spammed).
+
+    A BrowserSession is switched to a headed browser for the duration, so
+    the login page is visible over noVNC, and back once login is confirmed.
     """
+    if isinstance(driver, BrowserSession):
+        driver.show_for_login()
+        try:
+            driver.get(PACKS_URL)
+        except Exception as e:
+            log(f"Could not open login page in headed browser: {e}", "WARN")
     log("Login required - sending first notification", "WARN")
+    set_login_state("required")
     notify_phone(
         ntfy_topic,
         "EDP Monitor - Login Necessário",
-        "Login necessário! Abre noVNC porta 6080 para fazer login",
+        f"Login necessário! Abre noVNC porta {NOVNC_PORT} para fazer login",
     )
     last_reminder = time.time()
 
     while True:
-        time.sleep(CHECK_LOGIN_EVERY)
+        if SHUTDOWN.wait(CHECK_LOGIN_EVERY):
+            return
         log("Checking login status...")
         try:
             driver.get(PACKS_URL)
-            time.sleep(3)
-            body_text = driver.find_element(By.TAG_NAME, "body").text.lower()
-            still_login = ("login" in body_text or "iniciar" in body_text) and len(body_text) < 500
-            if not still_login:
+            if not page_needs_login(driver):
                 log("Login restored")
+                set_login_state("ok")
                 notify_phone(ntfy_topic, "EDP Monitor", "Login detectado! A retomar...")
+                if isinstance(driver, BrowserSession):
+                    driver.hide_after_login()
                 return
         except Exception as e:
             log(f"Error during login check: {e}", "ERROR")
@@ -330,103 +1244,533 @@ def wait_for_login(driver, ntfy_topic: str, reminder_interval: int) -> None:
             notify_phone(
                 ntfy_topic,
                 "EDP Monitor - Login Necessário",
-                "Login ainda em falta! Abre noVNC porta 6080",
+                f"Login ainda em falta! Abre noVNC porta {NOVNC_PORT}",
             )
             last_reminder = time.time()
 
 
-def run_one_attempt(driver, config: dict, history: dict) -> dict:
+def set_login_state(state: str) -> None:
+    """Record the EDP session state ("ok" / "required") for the control
+    API and the HA sensors."""
+    if STATUS["login"] != state:
+        STATUS["login"] = state
+        PUBLISHER.changed()
+
+
+def _packs_need_login(driver) -> bool:
+    driver.get(PACKS_URL)
+    return page_needs_login(driver)
+
+
+def validate_session(driver, config: dict) -> None:
+    """Open the packs page and, if the EDP session has lapsed, block in
+    wait_for_login until the user logs in again."""
+    log("Validating EDP session...")
+    try:
+        if supervised(driver, "session", _packs_need_login, driver):
+            log("Session NOT logged in", "WARN")
+            wait_for_login(driver, config["ntfy_topic"], config["login_reminder_interval"])
+        else:
+            log("Session OK")
+            set_login_state("ok")
+    except Exception as e:
+        log(f"Error validating session: {e}", "ERROR")
+        traceback.print_exc()
+
+
+@TRACER.traced("attempt")
+def run_one_attempt(driver, config: dict, history: dict, catalog: dict,
+                    checker=None, slot: datetime | None = None) -> dict:
     """Try once, right now, to claim each unclaimed target for the current month.
 
-    Mutates `history` in place and persists to disk on every successful claim.
+    Mutates `history` in place and persists to disk on every successful claim;
+    `catalog` likewise whenever a detail URL is (re)resolved.
     Returns dict {target_name: status} for the caller to decide whether to
     send a "still pending" notification.
+
+    `attempt_mode` "sequential" reaches each target on its own (cached
+    detail URL, else the packs page); "single_pass" loads the packs page
+    once for all targets and only visits the detail pages of targets whose
+    card doesn't already read as sold out; "parallel" loads every cached
+    detail page at once, one tab each (see _attempt_parallel). Targets are
+    taken in `priority` order (by_priority).
+
+    With an HttpChecker, targets the backend reports as sold out or short
+    of balance are settled without touching the browser. `slot` is the
+    scheduled time this attempt serves (None for unscheduled ones).
     """
     targets = config["targets"]
-    ntfy_topic = config["ntfy_topic"]
-    login_reminder = config["login_reminder_interval"]
     now = datetime.now()
     current = month_key(now)
-    states = {}
+    TRACER.attempt = now.isoformat(timespec="seconds")
 
     pending = unclaimed_for_month(targets, history, current)
     log(f"=== Attempt at {now.strftime('%Y-%m-%d %H:%M:%S')} | "
         f"pending={pending} ===")
-
     for target in targets:
-        name = target["name"]
-        if name not in pending:
-            log(f"[{name}] Already claimed for {current} - skip")
-            continue
+        if target["name"] not in pending:
+            log(f"[{target['name']}] Already claimed for {current} - skip")
+    pending_targets = [t for t in by_priority(targets) if t["name"] in pending]
 
-        log(f"[{name}] Checking availability...")
+    states = {}
+    if checker is not None and pending_targets:
+        states, pending_targets = _prefilter_over_http(driver, checker,
+                                                       pending_targets)
+
+    if config.get("attempt_mode") == "single_pass" and pending_targets:
+        resolved = _attempt_single_pass(driver, config, history, catalog,
+                                        pending_targets, current, slot)
+        if resolved is not None:
+            return {**states, **resolved}
+        log("Single-pass resolution failed - falling back to sequential", "WARN")
+
+    if config.get("attempt_mode") == "parallel" and len(pending_targets) > 1:
+        # Bounded by the tabs' render wait plus a claim per target
+        limit = (STEP_DEADLINES["parallel"]
+                 + STEP_DEADLINES["claim"] * len(pending_targets))
         try:
-            ok = navigate_to_voucher(driver, name)
-            if not ok:
-                states[name] = "erro: card_not_found_or_nav_failed"
-                continue
-            available, status = check_voucher(driver, name)
+            resolved, pending_targets = supervised(
+                driver, "parallel", _attempt_parallel, driver, config,
+                history, catalog, pending_targets, current, slot,
+                retry=False, deadline=limit)
+            states.update(resolved)
         except Exception as e:
-            log(f"[{name}] Error during check: {e}", "ERROR")
-            traceback.print_exc()
-            states[name] = f"erro: {e}"
+            log(f"Parallel attempt failed: {e} - falling back to sequential",
+                "ERROR")
+            unclaimed = unclaimed_for_month(targets, history, current)
+            pending_targets = [t for t in pending_targets
+                               if t["name"] in unclaimed]
+
+    for target in pending_targets:
+        states[target["name"]] = _attempt_target(
+            driver, config, history, catalog, target, current, slot=slot)
+    return states
+
+
+def _prefilter_over_http(driver, checker, pending_targets: list) -> tuple:
+    """Ask the backend about every pending target before rendering anything.
+
+    Returns ({name: status} for targets settled over HTTP, [targets that
+    still need the browser]) — the latter being those that look claimable,
+    need a login, or couldn't be answered. On a first login answer the
+    browser's cookies are reloaded once and that target re-asked, since
+    the HTTP session may simply be holding stale ones.
+    """
+    settled, remaining = {}, []
+    refreshed = False
+    for target in pending_targets:
+        available, status = checker.check(target)
+        if status == "precisa_login" and not refreshed:
+            refreshed = True
+            if refresh_http_cookies(driver, checker):
+                available, status = checker.check(target)
+        RESTOCKS.observe(target["name"], status)
+        if available is False:
+            settled[target["name"]] = status
+        else:
+            remaining.append(target)
+    log(f"HTTP pre-check: settled={settled} "
+        f"browser={[t['name'] for t in remaining]}")
+    return settled, remaining
+
+
+def refresh_http_cookies(driver, checker) -> bool:
+    """Copy every cookie of the Chromium profile into the HTTP checker's
+    session. Returns False if the browser couldn't be asked."""
+    try:
+        cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+    except Exception as e:
+        log(f"Could not read browser cookies for HTTP checks: {e}", "WARN")
+        return False
+    n = checker.load_cookies(cookies)
+    log(f"HTTP checker loaded {n} cookie(s) from the browser session")
+    return True
+
+
+def _attempt_single_pass(driver, config: dict, history: dict, catalog: dict,
+                         pending_targets: list, current: str,
+                         slot: datetime | None = None) -> dict | None:
+    """Resolve every pending target from one packs-page snapshot.
+
+    Returns None when the packs page didn't render any card (e.g. login
+    redirect) so the caller can fall back to the sequential path, which
+    knows how to wait for login.
+    """
+    try:
+        cards = supervised(driver, "packs", load_pack_cards, driver)
+    except Exception as e:
+        log(f"Packs page failed: {e}", "ERROR")
+        return None
+    if not cards:
+        return None
+    matched = match_pack_cards(cards, [t["name"] for t in pending_targets])
+
+    states = {}
+    for target in pending_targets:
+        name = target["name"]
+        card = matched.get(name)
+        if card is None:
+            log(f"[{name}] Card not found on packs page", "WARN")
+            states[name] = "erro: card_not_found_or_nav_failed"
             continue
+        if not card_looks_available(card["text"]):
+            log(f"[{name}] Card reads as sold out - skipping detail page")
+            states[name] = "esgotado"
+            continue
+        states[name] = _attempt_target(
+            driver, config, history, catalog, target, current, card, slot)
+    return states
 
-        states[name] = status
 
-        if status == "precisa_login":
-            wait_for_login(driver, ntfy_topic, login_reminder)
+def fill_detail_urls(driver, catalog: dict, targets: list) -> None:
+    """Cache the detail link of each of `targets` from one packs-page
+    snapshot. Targets whose card isn't found or has no link stay uncached.
+    """
+    try:
+        cards = supervised(driver, "packs", load_pack_cards, driver)
+    except Exception as e:
+        log(f"Packs page failed: {e}", "ERROR")
+        return
+    matched = match_pack_cards(cards or [], [t["name"] for t in targets])
+    for target in targets:
+        card = matched.get(target["name"])
+        if card and card.get("href"):
+            cache_detail_url(catalog, target, card["href"])
+
+
+def _attempt_parallel(driver, config: dict, history: dict, catalog: dict,
+                      pending_targets: list, current: str,
+                      slot: datetime | None = None) -> tuple:
+    """attempt_mode "parallel": start every pending target's cached detail
+    page loading in its own tab, one right after the other, then read the
+    tabs as they render and claim the available ones in priority order.
+    Time to first check is then about the same for every target, instead
+    of growing with its position in the list. Targets without a cached URL
+    get one from a single packs-page pass first (fill_detail_urls).
+
+    Returns ({name: status}, [targets left for the sequential path]): those
+    still without a cached URL, redirected, logged out or not rendered
+    within DETAIL_RENDER_TIMEOUT.
+    """
+    uncached = [t for t in pending_targets
+                if not cached_detail_url(catalog, t)]
+    if uncached:
+        fill_detail_urls(driver, catalog, uncached)
+    main_handle = driver.current_window_handle
+    tabs, later = {}, []
+    try:
+        for target in pending_targets:
+            url = cached_detail_url(catalog, target)
+            if not url:
+                later.append(target)
+                continue
+            if tabs:
+                driver.switch_to.new_window("tab")
+                if isinstance(driver, BrowserSession):
+                    driver.block_in_current_tab()
+            # Tells the tab's old document (about:blank, or whatever the main
+            # tab last showed) apart from the one being loaded
+            driver.execute_script("window.__edpStale = true;")
+            # Returns once the navigation starts, not when the page loaded
+            driver.execute_cdp_cmd("Page.navigate", {"url": url})
+            tabs[target["name"]] = (target, driver.current_window_handle, url)
+        log(f"Parallel: loading {list(tabs)} in {len(tabs)} tab(s)")
+        states, retry = _read_tabs(driver, config, history, current, slot,
+                                   tabs) if tabs else ({}, [])
+    finally:
+        close_tabs_except(driver, main_handle)
+    return states, retry + later
+
+
+def _read_tabs(driver, config: dict, history: dict, current: str,
+               slot: datetime | None, tabs: dict) -> tuple:
+    """Go round the loading tabs ({name: (target, handle, url)}, in
+    priority order), checking each one whose page has rendered at its URL
+    (PARALLEL_TAB_JS). After every round, claim what was found available,
+    in priority order. Returns ({name: status}, [targets to retry on their
+    own])."""
+    deadline = time.monotonic() + DETAIL_RENDER_TIMEOUT
+    waiting = dict(tabs)
+    states, retry = {}, []
+    while waiting:
+        available = []
+        for name, (target, handle, url) in list(waiting.items()):
+            driver.switch_to.window(handle)
             try:
-                ok = navigate_to_voucher(driver, name)
-                if not ok:
-                    states[name] = "erro: nav_failed_after_login"
-                    continue
-                available, status = check_voucher(driver, name)
-                states[name] = status
-            except Exception as e:
-                log(f"[{name}] Error after login retry: {e}", "ERROR")
-                states[name] = f"erro: {e}"
+                state = driver.execute_script(PARALLEL_TAB_JS, url)
+            except WebDriverException as e:
+                if not is_navigation_error(e):
+                    raise
+                continue  # document replaced mid-call: still navigating
+            if state is None:
+                continue
+            del waiting[name]
+            if state == "redirected":
+                log(f"[{name}] Detail page redirected to "
+                    f"{driver.current_url}", "WARN")
+                retry.append(target)
                 continue
+            is_available, status = check_voucher(driver, name)
+            if status == "precisa_login":
+                retry.append(target)  # the sequential path waits for login
+            elif is_available:
+                available.append(name)
+            else:
+                states[name] = status
+        for name in available:
+            log(f"[{name}] Available — claiming")
+            driver.switch_to.window(tabs[name][1])
+            states[name] = _claim_and_record(driver, config, history, name,
+                                             current, slot)
+        if waiting and time.monotonic() >= deadline:
+            log(f"Parallel: {list(waiting)} did not render within "
+                f"{DETAIL_RENDER_TIMEOUT}s", "WARN")
+            retry.extend(target for target, _, _ in waiting.values())
+            break
+        if waiting:
+            time.sleep(PARALLEL_POLL)
+    return states, retry
+
+
+def _attempt_target(driver, config: dict, history: dict, catalog: dict,
+                    target: dict, current: str, card: dict | None = None,
+                    slot: datetime | None = None) -> str:
+    """Check one target and claim it if available. `card` is its entry from
+    a packs-page snapshot, when the caller has one; `slot` the scheduled
+    time this attempt belongs to. Returns the target's status.
+    """
+    name = target["name"]
+    ntfy_topic = config["ntfy_topic"]
+    login_reminder = config["login_reminder_interval"]
+
+    log(f"[{name}] Checking availability...")
+    try:
+        checked = supervised(driver, "check", _open_and_check, driver,
+                             target, catalog, card)
+        if checked is None:
+            return "erro: card_not_found_or_nav_failed"
+        available, status = checked
+    except Exception as e:
+        log(f"[{name}] Error during check: {e}", "ERROR")
+        traceback.print_exc()
+        return f"erro: {e}"
+
+    if status == "precisa_login":
+        wait_for_login(driver, ntfy_topic, login_reminder)
+        try:
+            checked = supervised(driver, "check", _open_and_check, driver,
+                                 target, catalog)
+            if checked is None:
+                return "erro: nav_failed_after_login"
+            available, status = checked
+        except Exception as e:
+            log(f"[{name}] Error after login retry: {e}", "ERROR")
+            return f"erro: {e}"
+
+    if available is not True:
+        return status
 
-        if available is True:
+    return _claim_and_record(driver, config, history, name, current, slot)
+
+
+def _open_and_check(driver, target: dict, catalog: dict,
+                    card: dict | None = None) -> tuple | None:
+    """open_voucher then check_voucher, as one supervised step. None if
+    the detail page couldn't be reached."""
+    if not open_voucher(driver, target, catalog, card):
+        return None
+    return check_voucher(driver, target["name"])
+
+
+def _claim_and_record(driver, config: dict, history: dict, name: str,
+                      current: str, slot: datetime | None = None) -> str:
+    """Run claim_voucher on the current detail page, then persist, notify and
+    return the target's status. `slot` is passed through for latency logging.
+
+    The claim step is never retried on a fresh browser: the code may have
+    been generated before the crash, and the next portal sync will find it.
+    """
+    ntfy_topic = config["ntfy_topic"]
+    try:
+        result = supervised(driver, "claim", claim_voucher, driver, name, slot,
+                            retry=False)
+        history[name] = JOURNAL.record(name, current, result["code"],
+                                       result["validity"], datetime.now())
+        notify_phone(
+            ntfy_topic,
+            "Voucher reclamado!",
+            f"{name}: {result['code']} (válido até {result['validity']})",
+        )
+        log(f"[{name}] CLAIMED: {result['code']}")
+        return "reclamado"
+    except ClaimError as e:
+        log(f"[{name}] Claim failed: {e}", "ERROR")
+        notify_phone(
+            ntfy_topic,
+            "Erro ao reclamar voucher",
+            f"{name}: {e}",
+        )
+        return f"erro_claim: {e}"
+    except Exception as e:
+        log(f"[{name}] Unexpected error during claim: {e}", "ERROR")
+        if is_dead_session(e):
+            log(f"[{name}] Browser died mid-claim — check the portal's "
+                "active codes; the next sync records it if it went through",
+                "WARN")
+        else:
+            traceback.print_exc()
+        notify_phone(
+            ntfy_topic,
+            "Erro inesperado ao reclamar",
+            f"{name}: {e}",
+        )
+        return f"erro_claim: {e}"
+
+
+RACE_RELOAD_EVERY = 2.0  # seconds between reloads of a racing tab after the slot
+
+# Poll the detail page's main button in-page every arguments[1] ms for up to
+# arguments[0] ms; resolve true the instant it exists and is enabled.
+RACE_WAIT_JS = """
+const done = arguments[arguments.length - 1];
+const until = Date.now() + arguments[0];
+const probe = () => {
+    const b = document.querySelector('button.btn.btn-primary.edp-large-button');
+    if (b && !b.disabled) return done(true);
+    if (Date.now() >= until) return done(false);
+    setTimeout(probe, arguments[1]);
+};
+probe();
+"""
+
+
+@TRACER.traced("race")
+def race_slot(driver, config: dict, history: dict, catalog: dict,
+              slot: datetime) -> dict:
+    """Race mode: called `race_lead_seconds` before `slot`.
+
+    Opens every pending target's detail page in its own tab ahead of time
+    (which also leaves Chromium's DNS/TLS connections to the portal warm),
+    then polls each tab's "Gerar código" button in-page every
+    `race_poll_ms` and fires the claim flow the instant one enables. The
+    pages aren't reloaded before the slot, so polling there only catches a
+    button the page enables by itself (client-side). Stock the server adds
+    at the slot shows up from the first reload, at the slot. After that,
+    each tab is reloaded every RACE_RELOAD_EVERY seconds until
+    `race_window_seconds` past the slot.
+
+    Never returns before `slot`; targets whose page couldn't be pre-loaded
+    get a regular attempt at the slot instead. With several accounts each
+    pre-load, poll slice and claim takes its own BROWSER_POOL slot, so
+    accounts that outnumber the pool take turns instead of waiting for
+    the whole race.
+    """
+    current = month_key(slot)
+    TRACER.attempt = slot.isoformat(timespec="seconds")
+    pending = unclaimed_for_month(config["targets"], history, current)
+    pending_targets = [t for t in by_priority(config["targets"])
+                       if t["name"] in pending]
+    log(f"=== Race for slot {slot.strftime('%Y-%m-%d %H:%M:%S')} | "
+        f"pending={pending} ===")
+
+    main_handle = driver.current_window_handle
+    tabs = {}
+    for target in pending_targets:
+        with browser_slot("race preload"):
+            if tabs:
+                driver.switch_to.new_window("tab")
+                if isinstance(driver, BrowserSession):
+                    driver.block_in_current_tab()
             try:
-                result = claim_voucher(driver, name)
-                save_history(HISTORY_PATH, name, current,
-                             result["code"], result["validity"], datetime.now())
-                history[name] = {
-                    "month": current,
-                    "code": result["code"],
-                    "validity": result["validity"],
-                    "claimed_at": datetime.now().isoformat(timespec="seconds"),
-                }
-                notify_phone(
-                    ntfy_topic,
-                    "Voucher reclamado!",
-                    f"{name}: {result['code']} (válido até {result['validity']})",
-                )
-                states[name] = "reclamado"
-                log(f"[{name}] CLAIMED: {result['code']}")
-            except ClaimError as e:
-                log(f"[{name}] Claim failed: {e}", "ERROR")
-                notify_phone(
-                    ntfy_topic,
-                    "Erro ao reclamar voucher",
-                    f"{name}: {e}",
-                )
-                states[name] = f"erro_claim: {e}"
+                ok = open_voucher(driver, target, catalog)
             except Exception as e:
-                log(f"[{name}] Unexpected error during claim: {e}", "ERROR")
-                traceback.print_exc()
-                notify_phone(
-                    ntfy_topic,
-                    "Erro inesperado ao reclamar",
-                    f"{name}: {e}",
-                )
-                states[name] = f"erro_claim: {e}"
+                log(f"[{target['name']}] Pre-load failed: {e}", "WARN")
+                ok = False
+            if ok:
+                tabs[target["name"]] = driver.current_window_handle
+            elif tabs:
+                driver.close()
+                driver.switch_to.window(main_handle)
+    log(f"Race: pre-loaded {list(tabs)} "
+        f"({(slot - datetime.now()).total_seconds():.1f}s before slot)")
+
+    states = {}
+    try:
+        if tabs:
+            states = _race_tabs(driver, config, history, slot, current, tabs)
+    finally:
+        close_tabs_except(driver, main_handle)
+
+    leftovers = [t for t in pending_targets if t["name"] not in tabs]
+    if leftovers:
+        drift = sleep_until(slot, cancel=SHUTDOWN)
+        if drift is None:
+            return states
+        record_drift("race leftovers", drift)
+        states.update(run_one_attempt(
+            driver, {**config, "targets": leftovers}, history, catalog,
+            slot=slot))
+    return states
+
 
+def _race_tabs(driver, config: dict, history: dict, slot: datetime,
+               current: str, tabs: dict) -> dict:
+    """Poll pre-loaded tabs until each target is claimed or the race window
+    closes. Returns {name: status}; unclaimed tabs get a final check."""
+    poll_ms = config["race_poll_ms"]
+    slice_ms = max(poll_ms, int(RACE_RELOAD_EVERY * 1000 / len(tabs)))
+    deadline = slot + timedelta(seconds=config["race_window_seconds"])
+    driver.set_script_timeout(slice_ms / 1000 + 5)
+    first_reload = slot - timedelta(seconds=RACE_RELOAD_EVERY)
+    last_reload = {name: first_reload for name in tabs}
+    waiting = dict(tabs)
+    states = {}
+
+    while waiting and datetime.now() < deadline:
+        for name, handle in list(waiting.items()):
+            # The claim keeps the slot of the slice that saw the button
+            with browser_slot("race poll"):
+                driver.switch_to.window(handle)
+                now = datetime.now()
+                if now >= slot and (now - last_reload[name]).total_seconds() \
+                        >= RACE_RELOAD_EVERY:
+                    driver.refresh()
+                    last_reload[name] = datetime.now()
+                if not driver.execute_async_script(RACE_WAIT_JS, slice_ms,
+                                                   poll_ms):
+                    continue
+                log(f"[{name}] Button enabled at slot"
+                    f"{(datetime.now() - slot).total_seconds():+.3f}s — "
+                    "claiming")
+                RESTOCKS.observe(name, "disponivel")
+                states[name] = _claim_and_record(driver, config, history, name,
+                                                 current, slot)
+                del waiting[name]
+
+    for name, handle in waiting.items():
+        with browser_slot("race check"):
+            driver.switch_to.window(handle)
+            try:
+                _, states[name] = check_voucher(driver, name)
+            except Exception as e:
+                states[name] = f"erro: {e}"
+        log(f"[{name}] Race window closed without an enabled button "
+            f"(state={states[name]})")
     return states
 
 
+# One round trip for the whole active-codes page: partner line (null when
+# the card has none) and full text of every <benefits-card>, in DOM order.
+ACTIVE_CARDS_JS = """
+return Array.from(document.querySelectorAll('benefits-card')).map(card => {
+    const tip = card.querySelector('.benefits-card-footer-tip');
+    return {partner: tip ? tip.innerText.trim() : null,
+            text: card.innerText || ''};
+});
+"""
+
+
+@TRACER.traced("fetch_active_codes")
 def fetch_active_codes(driver) -> list:
     """Scrape /beneficios/ativos for currently-active codes.
 
@@ -442,9 +1786,7 @@ def fetch_active_codes(driver) -> list:
     log("Fetching active codes — going via /beneficios/pack first")
     driver.get(PACKS_URL)
     try:
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.TAG_NAME, "benefits-card"))
-        )
+        wait_for_js(driver, "return document.querySelector('benefits-card');", 30)
     except TimeoutException:
         log("Timeout waiting for /beneficios/pack to render — sync aborted",
             "WARN")
@@ -467,9 +1809,13 @@ def fetch_active_codes(driver) -> list:
         return []
 
     try:
-        WebDriverWait(driver, 30).until(
-            lambda d: "/beneficios/ativos" in d.current_url
-            and len(d.find_elements(By.TAG_NAME, "benefits-card")) > 0
+        wait_for_js(
+            driver,
+            """
+            return location.pathname.includes('/beneficios/ativos')
+                && document.querySelectorAll('benefits-card').length > 0;
+            """,
+            30,
         )
     except TimeoutException:
         log(f"No <benefits-card> rendered on /beneficios/ativos within 30s "
@@ -477,20 +1823,10 @@ def fetch_active_codes(driver) -> list:
             "WARN")
         return []
 
-    cards = driver.find_elements(By.TAG_NAME, "benefits-card")
+    cards = driver.execute_script(ACTIVE_CARDS_JS)
     log(f"Found {len(cards)} active code card(s)")
-
-    result = []
-    for card in cards:
-        try:
-            partner = card.find_element(
-                By.CSS_SELECTOR, ".benefits-card-footer-tip"
-            ).text.strip()
-        except NoSuchElementException:
-            continue
-        text = card.text
-        result.append((partner, text))
-    return result
+    return [(card["partner"], card["text"]) for card in cards
+            if card["partner"] is not None]
 
 
 def sync_history_from_portal(driver, history: dict, config: dict,
@@ -499,7 +1835,7 @@ def sync_history_from_portal(driver, history: dict, config: dict,
     them into the local history file. Returns count of new entries added.
     """
     try:
-        active = fetch_active_codes(driver)
+        active = supervised(driver, "sync", fetch_active_codes, driver)
     except Exception as e:
         log(f"Portal sync failed (will use local history only): {e}", "WARN")
         return 0
@@ -511,44 +1847,157 @@ def sync_history_from_portal(driver, history: dict, config: dict,
             continue
         log(f"[{name}] Portal sync detected active code "
             f"({validity}) — recording as claimed for {current_month}")
-        save_history(HISTORY_PATH, name, current_month,
-                     code="(portal-sync)", validity=validity,
-                     claimed_at=datetime.now())
-        history[name] = {
-            "month": current_month,
-            "code": "(portal-sync)",
-            "validity": validity,
-            "claimed_at": datetime.now().isoformat(timespec="seconds"),
-        }
+        history[name] = JOURNAL.record(name, current_month, "(portal-sync)",
+                                       validity, datetime.now(),
+                                       source="sync")
         added += 1
     log(f"Portal sync: {added} new history entr{'y' if added == 1 else 'ies'}")
     return added
 
 
 def main() -> None:
+    """Run the monitor for the main account (or, in an account process, for
+    that account), with one more process per extra account alongside."""
+    global BROWSER_POOL
+    started = time.monotonic()
     config = load_config()
+    if ACCOUNT is not None:
+        set_log_label(ACCOUNT)
+        account = next((a for a in account_plan(config, warn=False)
+                        if a["name"] == ACCOUNT), None)
+        if account is None:
+            log(f"Account {ACCOUNT!r} is no longer configured", "ERROR")
+            return
+        BROWSER_POOL = BrowserPool(POOL_DIR, config["browser_pool_size"])
+        run_monitor(account_config(config, account), started)
+        return
+
+    accounts = account_plan(config, BASE_DATA_DIR)
+    if not accounts:
+        run_monitor(account_config(config), started)
+        return
+    log(f"accounts={[a['name'] for a in accounts]} "
+        f"browser_pool_size={config['browser_pool_size']}")
+    BROWSER_POOL = BrowserPool(POOL_DIR, config["browser_pool_size"])
+    runner = AccountRunner(accounts, [sys.executable, os.path.abspath(__file__)])
+    runner.start()
+    try:
+        config = account_config(config)
+        if config["targets"]:
+            run_monitor(config, started)
+        else:
+            log("No targets for the main account — only running the others")
+            signal.signal(signal.SIGTERM, lambda signum, frame: SHUTDOWN.set())
+            SHUTDOWN.wait()
+    finally:
+        runner.stop()
+
+
+def run_monitor(config: dict, started: float) -> None:
     log("=" * 60)
     log("EDP Voucher Monitor — Starting")
     log("=" * 60)
-    log(f"ntfy_topic={config['ntfy_topic']}")
+    log(f"ntfy_topic={config['ntfy_topic']} ntfy_url={config['ntfy_url']}")
     log(f"start_day={config['start_day']}")
     log(f"attempt_times={config['attempt_times']}")
     log(f"login_reminder_interval={config['login_reminder_interval']}s")
+    log(f"attempt_mode={config['attempt_mode']}")
+    log(f"http_check_url={config['http_check_url'] or '(disabled)'}")
+    if config["http_check_url"]:
+        log("http_check_url is experimental: the endpoint's answers are "
+            "parsed by guessed field names — watch for an 'experimental "
+            "parser' ERROR", "WARN")
+    if config["race_mode"]:
+        log(f"race_mode: lead={config['race_lead_seconds']}s "
+            f"poll={config['race_poll_ms']}ms "
+            f"window={config['race_window_seconds']}s")
+    log(f"headless={config['headless']} "
+        f"display_idle_timeout={config['display_idle_timeout']}s")
+    log(f"sync_interval={config['sync_interval_hours']}h "
+        f"keepalive={config['keepalive_minutes']}min")
+    log(f"block_resources={config['block_resources']} "
+        f"extra_patterns={config['blocked_url_patterns']}")
+    log(f"hibernate: threshold={config['hibernate_threshold_minutes']}min "
+        f"wake_lead={config['hibernate_wake_lead_seconds']}s")
+    if config["hibernate_wake_lead_seconds"] < MIN_WAKE_LEAD_SECONDS:
+        log(f"hibernate_wake_lead_seconds below {MIN_WAKE_LEAD_SECONDS}s "
+            "would wake the browser at the slot itself — using "
+            f"{MIN_WAKE_LEAD_SECONDS}s", "WARN")
+    log(f"adaptive_slots={config['adaptive_slots']} "
+        f"budget={config['attempt_budget']} "
+        f"window={config['restock_window_minutes']}min "
+        f"min_events={config['adaptive_min_events']} "
+        f"explore={config['adaptive_explore_slots']} "
+        f"probe={config['restock_probe_minutes']}min")
+    log(f"browser_backend={config['browser_backend']} "
+        f"persistent_browser={config['persistent_browser']} "
+        f"warm_standby={config['warm_standby']} "
+        f"breaker={config['breaker_threshold']} failures/"
+        f"{config['breaker_cooldown_minutes']}min")
+    log(f"control_api={config['control_api']} "
+        f"token={'set' if config['control_token'] else '(generated)'}")
     log(f"targets={[t['name'] for t in config['targets']]}")
     log("=" * 60)
 
-    # Wait for Xvfb / x11vnc / noVNC
-    log("Waiting 10s for display services to be ready...")
-    time.sleep(10)
-
+    NOTIFIER.base_url = config["ntfy_url"]
+    NOTIFIER.start()
+
+    # Xvfb / x11vnc / noVNC are started on demand, before any headed launch
+    display = DisplayStack(display=f":{DISPLAY_BASE + ACCOUNT_INDEX}",
+                           vnc_port=5900 + ACCOUNT_INDEX, web_port=NOVNC_PORT,
+                           idle_timeout=config["display_idle_timeout"])
+    # chromedriver (a warm standby too) copies the environment when spawned,
+    # before any headed launch starts the display
+    os.environ["DISPLAY"] = display.display
+
+    # Chromium starts (or, after s6 restarted this process, is reattached
+    # to) in the background while local state loads; startup ends in an
+    # immediate attempt, so startup time is time-to-first-claim.
+    phases = [("config", time.monotonic() - started)]
     log("Creating Chrome driver...")
-    driver = create_driver()
-    if driver is None:
-        log("First driver create failed, retrying in 30s", "WARN")
-        time.sleep(30)
-        driver = create_driver()
-    if driver is None:
-        log("Driver creation failed twice. Aborting.", "ERROR")
+    blocked_urls = None
+    if config["block_resources"]:
+        blocked_urls = DEFAULT_BLOCKED_URLS + config["blocked_url_patterns"]
+    if config["browser_backend"] == "cdp" and CdpDriver is None:
+        log("browser_backend cdp needs websocket-client — using selenium",
+            "WARN")
+        config["browser_backend"] = "selenium"
+    host = BrowserHost(BROWSER_STATE_PATH, CHROMIUM_PATH, PROFILE_PATH)
+    if not config["persistent_browser"]:
+        host.stop()  # one kept by an earlier run would hold the profile
+        host = None
+    driver = BrowserSession(prefer_headless=config["headless"], display=display,
+                            blocked_urls=blocked_urls,
+                            warm_standby=config["warm_standby"],
+                            backend=config["browser_backend"],
+                            host=host)
+    driver.supervisor = BrowserSupervisor(
+        driver, STEP_DEADLINES,
+        breaker=CircuitBreaker(config["breaker_threshold"],
+                               config["breaker_cooldown_minutes"] * 60))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        launch_mark = time.monotonic()
+        launched = pool.submit(driver.launch_with_retry)
+
+        mark = time.monotonic()
+        history = JOURNAL.load()
+        log(f"Loaded claim journal: {history}")
+        catalog = load_catalog(CATALOG_PATH)
+        log(f"Loaded catalog cache: {len(catalog)} detail URL(s)")
+        log(f"Loaded restock log: {len(RESTOCKS.load())} transition(s)")
+        checker = None
+        if config["http_check_url"]:
+            try:
+                checker = HttpChecker(config["http_check_url"])
+            except ImportError as e:
+                log(f"HTTP checks disabled: {e}", "ERROR")
+        phases.append(("state", time.monotonic() - mark))
+
+        launched.result()
+        phases.append(("browser", time.monotonic() - launch_mark))
+    if driver.driver is None:
+        log(f"Driver creation failed {len(DRIVER_RETRY_DELAYS) + 1} times. "
+            "Aborting.", "ERROR")
         notify_phone(
             config["ntfy_topic"],
             "EDP Monitor - Erro Fatal",
@@ -557,67 +2006,422 @@ def main() -> None:
         return
     log("Driver created OK")
 
-    # Initial session validation
-    log("Validating EDP session...")
-    try:
-        driver.get(PACKS_URL)
-        time.sleep(5)
-        body_text = driver.find_element(By.TAG_NAME, "body").text.lower()
-        if ("login" in body_text or "iniciar" in body_text) and len(body_text) < 500:
-            log("Session NOT logged in", "WARN")
-            wait_for_login(driver, config["ntfy_topic"], config["login_reminder_interval"])
-        else:
-            log("Session OK")
-    except Exception as e:
-        log(f"Error validating session: {e}", "ERROR")
-        traceback.print_exc()
+    mark = time.monotonic()
+    validate_session(driver, config)
+    phases.append(("session", time.monotonic() - mark))
 
-    log(">>> noVNC available at port 6080 for visual inspection <<<")
+    if not config["headless"]:
+        log(f">>> noVNC available at port {NOVNC_PORT} for visual inspection "
+            "<<<")
 
-    history = load_history(HISTORY_PATH)
-    log(f"Loaded history: {history}")
+    if checker is not None:
+        refresh_http_cookies(driver, checker)
 
     # Reconcile local history with portal — picks up claims done manually
     # via the website (or via the EDP mobile app) so we don't waste daily
     # attempts on something already claimed.
+    mark = time.monotonic()
     sync_history_from_portal(driver, history, config,
                              month_key(datetime.now()))
+    phases.append(("sync", time.monotonic() - mark))
+    log(f"Startup: {format_phase_timings(phases, time.monotonic() - started)}")
+
+    sched = Scheduler(coalesce_seconds=JOB_COALESCE_SECONDS)
+    schedule_attempts(sched, config, history)
 
     # Startup-immediate: a restart doubles as a "try claim now" button.
     # If we're past start_day with unclaimed targets, run an attempt now
-    # before entering the regular schedule. Idempotent — claim flow only
-    # fires when the portal's button is enabled.
-    if should_run_immediately(datetime.now(), history,
-                              config["targets"], config["start_day"]):
+    # before the regular schedule. Idempotent — claim flow only fires when
+    # the portal's button is enabled.
+    now = datetime.now()
+    if should_run_immediately(now, history, config["targets"],
+                              config["start_day"]):
         log("Startup-immediate: running attempt now")
-        states = run_one_attempt(driver, config, history)
-        _maybe_notify_pending(config, history, states)
+        for name in unclaimed_for_month(config["targets"], history,
+                                        month_key(now)):
+            sched.schedule(now, "attempt", key=f"manual:{name}",
+                           payload={"target": name, "slot": None},
+                           strict=True)
+
+    control = None
+    if config["control_api"]:
+        control = ControlServer(
+            sched, [t["name"] for t in config["targets"]],
+            pending=lambda: unclaimed_for_month(config["targets"], history,
+                                                month_key(datetime.now())),
+            state=lambda: monitor_state(config, history, driver),
+            history=JOURNAL.snapshot, token=config["control_token"])
+        if not control.token:
+            control.token, created = load_or_create_token(CONTROL_TOKEN_PATH)
+            if created:
+                log(f"Control API token generated (kept in "
+                    f"{CONTROL_TOKEN_PATH}): {control.token}")
+            else:
+                log(f"Control API token: see {CONTROL_TOKEN_PATH}")
+        try:
+            control.start(port=CONTROL_PORT)
+            log(f"Control API listening on port {CONTROL_PORT} "
+                "(POST /attempt, /sync; GET /state, /history, /next)")
+        except OSError as e:
+            log(f"Control API could not listen on {CONTROL_PORT}: {e}", "WARN")
+            control = None
+
+    if config["ha_sensors"]:
+        PUBLISHER.source = lambda: ha_state_document(config, history, driver,
+                                                     sched)
+        PUBLISHER.start()
 
-    while True:
-        next_wakeup = compute_next_wakeup(
-            datetime.now(), history, config["targets"],
-            config["start_day"], config["attempt_times"],
-        )
-        log(f"Next wakeup: {next_wakeup.strftime('%Y-%m-%d %H:%M:%S')}")
-        sleep_until(next_wakeup)
+    try:
+        run_schedule(driver, config, history, catalog, checker, sched)
+    finally:
+        if SHUTDOWN.is_set():
+            log("SIGTERM received — shutting down")
+        if control is not None:
+            control.stop()
+        PUBLISHER.stop()
+        driver.detach()
+        driver.stop_standby()
+        display.stop()
+
+
+def monitor_state(config: dict, history: dict, driver) -> dict:
+    """Body of the control API's GET /state."""
+    now = datetime.now()
+    month = month_key(now)
+    targets = {}
+    for t in config["targets"]:
+        entry = history.get(t["name"])
+        targets[t["name"]] = {
+            "claimed": bool(entry) and entry.get("month") == month,
+            "last_claim": dict(entry) if entry else None,
+            "last_state": STATUS["last_states"].get(t["name"]),
+        }
+    return {"now": now.isoformat(timespec="seconds"), "month": month,
+            "browser": "hibernating" if driver.driver is None else "running",
+            "login": STATUS["login"], "running": STATUS["running"],
+            "last_attempt": STATUS["last_attempt"], "targets": targets}
+
+
+def ha_state_document(config: dict, history: dict, driver,
+                      sched: Scheduler) -> dict:
+    """The Home Assistant entities published by PUBLISHER: one overall
+    `sensor.edp_voucher_monitor` plus one `sensor.edp_voucher_<target>`
+    per target ({entity_id: {"state": ..., "attributes": {...}}}). An extra
+    account's are `sensor.edp_voucher_monitor_<account>` and
+    `sensor.edp_voucher_<account>_<target>`."""
+    now = datetime.now()
+    month = month_key(now)
+    next_attempts = {job.payload["target"]: job.payload["slot"] or job.due
+                     for job in reversed(sched.pending({"attempt"}))}
+    if STATUS["login"] == "required":
+        state = "login_required"
+    elif driver.driver is None:
+        state = "hibernating"
+    else:
+        state = "running"
+    upcoming = min(next_attempts.items(), key=lambda kv: kv[1], default=None)
+    last = STATUS["last_attempt"] or {}
+    suffix = f"_{ACCOUNT_SLUG}" if ACCOUNT else ""
+    prefix = f"{ACCOUNT_SLUG}_" if ACCOUNT else ""
+    label = f" ({ACCOUNT})" if ACCOUNT else ""
+    monitor_id = f"sensor.edp_voucher_monitor{suffix}"
+    doc = {monitor_id: {"state": state, "attributes": {
+        "friendly_name": f"EDP Voucher Monitor{label}",
+        "icon": "mdi:ticket-percent",
+        "login": STATUS["login"],
+        "month": month,
+        "pending": unclaimed_for_month(config["targets"], history, month),
+        "next_wakeup": _iso(upcoming[1]) if upcoming else None,
+        "next_target": upcoming[0] if upcoming else None,
+        "last_attempt_at": last.get("at"),
+        "last_attempt_latency_s": last.get("latency_s"),
+        "browser_circuit": (driver.supervisor.breaker.state
+                            if driver.supervisor else None),
+        "browser_recoveries": (driver.supervisor.recoveries
+                               if driver.supervisor else 0),
+    }}}
+    for t in config["targets"]:
+        name = t["name"]
+        entry = history.get(name) or {}
+        claimed = entry.get("month") == month
+        doc[f"sensor.edp_voucher_{prefix}{entity_slug(name)}"] = {
+            "state": "reclamado" if claimed
+            else STATUS["last_states"].get(name, "pendente")[:255],
+            "attributes": {
+                "friendly_name": f"EDP Voucher {name}{label}",
+                "icon": "mdi:ticket-confirmation" if claimed
+                else "mdi:ticket-outline",
+                "partner_id": t.get("partner_id"),
+                "code": entry.get("code") if claimed else None,
+                "validity": entry.get("validity") if claimed else None,
+                "claimed_at": entry.get("claimed_at") if claimed else None,
+                "next_attempt": _iso(next_attempts.get(name)),
+            },
+        }
+    return doc
+
+
+def _iso(when: datetime | None) -> str | None:
+    return when.isoformat(timespec="seconds") if when else None
+
+
+JOB_COALESCE_SECONDS = 60
+# A wake job closer than this to its attempt would be coalesced into the
+# attempt's batch, relaunching the browser at the slot instead of before it
+MIN_WAKE_LEAD_SECONDS = JOB_COALESCE_SECONDS + 30
+END_OF_DAY_DELAY_MINUTES = 15  # after the day's last slot; ≥ max race window
+
+
+def attempt_times_by_target(config: dict) -> dict:
+    """{name: attempt times} learned from the restock log for targets with
+    `adaptive_min_events` restocks seen; empty unless `adaptive_slots`.
+    `adaptive_explore_slots` of each target's budget stay on attempt_times,
+    rotating daily. Targets left out use the static attempt_times."""
+    if not config["adaptive_slots"]:
+        return {}
+    return learned_slots(RESTOCKS.records,
+                         [t["name"] for t in config["targets"]],
+                         config["attempt_budget"],
+                         config["restock_window_minutes"],
+                         config["adaptive_min_events"],
+                         config["attempt_times"],
+                         config["adaptive_explore_slots"])
+
+
+def all_attempt_times(config: dict, times_by_target: dict) -> list:
+    """Static attempt_times plus every learned slot: the day's slots for
+    the end-of-day summary."""
+    times = set(config["attempt_times"])
+    for slots in times_by_target.values():
+        times.update(slots)
+    return sorted(times)
+
+
+def schedule_attempts(sched: Scheduler, config: dict, history: dict) -> None:
+    """(Re)produce one strict attempt job per target at its next slot,
+    replacing the previous one. In race mode the job is due
+    `race_lead_seconds` early; payload["slot"] is always the slot itself.
+    With `adaptive_slots`, targets with enough observed restocks use their
+    learned slots instead of attempt_times. A slot job already due but not
+    yet run (e.g. it came up during a manual attempt) is kept."""
+    lead = timedelta(seconds=config["race_lead_seconds"]
+                     if config["race_mode"] else 0)
+    slots = next_attempt_per_target(datetime.now(), history,
+                                    config["targets"], config["start_day"],
+                                    config["attempt_times"],
+                                    attempt_times_by_target(config))
+    overdue = {job.key for job in sched.pending({"attempt"})
+               if job.due <= datetime.now()}
+    for name, slot in slots.items():
+        if f"attempt:{name}" in overdue:
+            continue  # its slot passed while another batch ran: still due
+        sched.schedule(slot - lead, "attempt", key=f"attempt:{name}",
+                       payload={"target": name, "slot": slot}, strict=True)
+
+
+def _schedule_every(sched: Scheduler, kind: str, interval: timedelta) -> None:
+    if interval:
+        sched.schedule(datetime.now() + interval, kind)
+
+
+def run_schedule(driver, config: dict, history: dict, catalog: dict,
+                 checker, sched: Scheduler) -> None:
+    """Main loop: take the next batch of due jobs from `sched` and run it.
+
+    Job kinds: per-target `attempt` slots (strict), periodic `sync` with the
+    portal's active codes, session `keepalive`, the daily `end_of_day`
+    summary, HTTP-only restock `probe`s, and `wake` after hibernation.
+    Jobs due within
+    JOB_COALESCE_SECONDS of each other share one batch: an attempt's packs
+    page load doubles as the keepalive, and waking re-validates the session.
+    A batch's attempts run before the maintenance jobs pulled into it.
+    STATUS is kept up to date for the control API and the HA sensors: the
+    keys of the batch in progress, the day's last per-target states and
+    the last attempt's latency.
+    Returns on SIGTERM, or on a fatal error (browser can't be relaunched).
+    """
+    sync_every = timedelta(hours=config["sync_interval_hours"])
+    keepalive_every = timedelta(minutes=config["keepalive_minutes"])
+    _schedule_every(sched, "sync", sync_every)
+    _schedule_every(sched, "keepalive", keepalive_every)
+    probe_every = timedelta(minutes=config["restock_probe_minutes"]
+                            if checker is not None else 0)
+    _schedule_every(sched, "probe", probe_every)
+    sched.schedule(end_of_day_time(datetime.now(),
+                                   all_attempt_times(
+                                       config, attempt_times_by_target(config)),
+                                   END_OF_DAY_DELAY_MINUTES), "end_of_day")
+    last_states, states_day = {}, None
+
+    def on_sigterm(signum, frame):
+        SHUTDOWN.set()
+        sched.wake()
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    while not SHUTDOWN.is_set():
+        next_attempt = sched.peek({"attempt"})
+        if next_attempt is not None:
+            log(f"Next attempt: {next_attempt.payload['target']} at "
+                f"{next_attempt.due.strftime('%Y-%m-%d %H:%M:%S')}")
+            if (driver.driver is not None
+                    and should_hibernate(datetime.now(), next_attempt.due,
+                                         config["hibernate_threshold_minutes"])):
+                hibernate_until(driver, config, sched, next_attempt.due)
+
+        batch = sched.next_batch(SHUTDOWN)
+        if not batch:
+            continue
+        kinds = {job.kind for job in batch}
+        keys = ", ".join(job.key for job in batch)
+        record_drift(keys, sched.last_drift)
+        log(f"Running jobs: {keys}")
+        STATUS["running"] = keys
+        PUBLISHER.changed()
+
+        session_checked = False
+        if driver.driver is None and kinds - {"end_of_day", "probe"}:
+            log("Waking from hibernation")
+            if not driver.launch_with_retry():
+                log("Could not relaunch the browser after hibernation", "ERROR")
+                notify_phone(
+                    config["ntfy_topic"],
+                    "EDP Monitor - Erro Fatal",
+                    "Falha ao reabrir o browser. Verificar logs do addon.",
+                )
+                return
+            validate_session(driver, config)
+            session_checked = True
+
+        # Attempts first: maintenance coalesced into their batch must not
+        # hold up a claim at its slot
+        attempts = [job for job in batch if job.kind == "attempt"]
+        if attempts:
+            if states_day != datetime.now().date():
+                last_states, states_day = {}, datetime.now().date()
+            last_states.update(_run_attempt_jobs(driver, config, history,
+                                                 catalog, checker, attempts))
+            STATUS["last_states"] = dict(last_states)
+            # From the slot (or the trigger, for a manual attempt) to verdict
+            began = min(job.payload["slot"] or job.due for job in attempts)
+            STATUS["last_attempt"] = {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "latency_s": round((datetime.now() - began).total_seconds(), 1),
+            }
+            schedule_attempts(sched, config, history)
+            if "keepalive" not in kinds:
+                _schedule_every(sched, "keepalive", keepalive_every)
+
+        if "keepalive" in kinds:
+            if not session_checked and "attempt" not in kinds:
+                validate_session(driver, config)
+            _schedule_every(sched, "keepalive", keepalive_every)
+
+        if "sync" in kinds:
+            sync_history_from_portal(driver, history, config,
+                                     month_key(datetime.now()))
+            _schedule_every(sched, "sync", sync_every)
+
+        if "probe" in kinds:
+            probe_restocks(config, history, checker)
+            _schedule_every(sched, "probe", probe_every)
+
+        if "end_of_day" in kinds:
+            if states_day == datetime.now().date():
+                _maybe_notify_pending(config, history, last_states)
+            # Learned slots follow the day's observations
+            schedule_attempts(sched, config, history)
+            sched.schedule(end_of_day_time(datetime.now(),
+                                           all_attempt_times(
+                                               config,
+                                               attempt_times_by_target(config)),
+                                           END_OF_DAY_DELAY_MINUTES),
+                           "end_of_day")
+        STATUS["running"] = None
+        PUBLISHER.changed()
+
+
+def probe_restocks(config: dict, history: dict, checker) -> None:
+    """Ask the backend over HTTP (no browser) about every target still
+    unclaimed this month, only to note stock changes in the restock log:
+    the more often a target is seen, the tighter each restock is timed."""
+    for name in unclaimed_for_month(config["targets"], history,
+                                    month_key(datetime.now())):
+        target = next(t for t in config["targets"] if t["name"] == name)
+        _, status = checker.check(target)
+        RESTOCKS.observe(name, status)
+
+
+def record_drift(label: str, drift: float) -> None:
+    """Log how far from its target a timer woke and keep it in the trace
+    (`timer.drift` in the tracing report)."""
+    log(f"Woke for {label}: {drift * 1000:+.1f} ms vs target")
+    TRACER.measure("timer.drift", int(drift * 1e9), jobs=label)
+
+
+def _run_attempt_jobs(driver, config: dict, history: dict, catalog: dict,
+                      checker, jobs: list) -> dict:
+    """One run_one_attempt (or race_slot) per distinct slot in `jobs`,
+    restricted to those jobs' targets."""
+    by_slot = {}
+    for job in jobs:
+        by_slot.setdefault(job.payload["slot"], []).append(job.payload["target"])
+    states = {}
+    for slot, names in by_slot.items():
+        slot_config = {**config, "targets": [t for t in config["targets"]
+                                             if t["name"] in names]}
+        if slot is not None and config["race_mode"]:
+            # Bounded by the race window plus the claim deadline
+            limit = ((slot - datetime.now()).total_seconds()
+                     + config["race_window_seconds"] + STEP_DEADLINES["claim"])
+            try:
+                states.update(supervised(driver, "race", race_slot, driver,
+                                         slot_config, history, catalog, slot,
+                                         retry=False, deadline=limit,
+                                         pooled=False))
+            except Exception as e:
+                log(f"Race for {names} failed: {e}", "ERROR")
+                states.update({name: f"erro: {e}" for name in names
+                               if name not in states})
+        else:
+            states.update(run_one_attempt(driver, slot_config, history,
+                                          catalog, checker, slot=slot))
+    return states
 
-        states = run_one_attempt(driver, config, history)
-        _maybe_notify_pending(config, history, states)
+
+def hibernate_until(driver, config: dict, sched: Scheduler,
+                    attempt_due: datetime) -> None:
+    """Quit the browser until `hibernate_wake_lead_seconds` (at least
+    MIN_WAKE_LEAD_SECONDS) before the attempt job due at `attempt_due`: a
+    `wake` job is scheduled there, and
+    pending syncs/keepalives that would need the browser earlier are
+    deferred to it."""
+    wake_due = attempt_due - timedelta(seconds=max(
+        config["hibernate_wake_lead_seconds"], MIN_WAKE_LEAD_SECONDS))
+    if wake_due <= datetime.now():
+        return
+    freed = driver.hibernate()
+    log(f"Hibernating until {wake_due.strftime('%Y-%m-%d %H:%M:%S')}: "
+        f"browser quit, ~{freed / 2**20:.0f} MB resident released")
+    sched.schedule(wake_due, "wake")
+    for job in sched.pending({"sync", "keepalive"}):
+        if job.due < wake_due:
+            sched.schedule(wake_due, job.kind, job.key, job.payload)
 
 
 def _maybe_notify_pending(config: dict, history: dict, states: dict) -> None:
-    """Send an end-of-day ntfy iff we just finished today's last attempt
-    with unclaimed targets remaining. Avoids spamming between intra-day slots.
+    """Send the end-of-day ntfy (run by the `end_of_day` job) iff today's
+    attempts are over with unclaimed targets remaining. Stays quiet if
+    another attempt is still due today, to avoid spamming between slots.
     """
     now = datetime.now()
     pending = unclaimed_for_month(config["targets"], history, month_key(now))
     if not pending:
         return
 
-    next_wakeup = compute_next_wakeup(
-        now, history, config["targets"],
-        config["start_day"], config["attempt_times"],
-    )
+    next_wakeup = min(next_attempt_per_target(
+        now, history, config["targets"], config["start_day"],
+        config["attempt_times"], attempt_times_by_target(config),
+    ).values())
     if next_wakeup.date() <= now.date():
         # Next attempt is still today — not end of day yet, stay quiet
         return
@@ -648,4 +2452,8 @@ if __name__ == "__main__":
     except Exception as e:
         log(f"FATAL: {e}", "ERROR")
         traceback.print_exc()
+        NOTIFIER.flush(15)
         sys.exit(1)
+    # main() returns after a fatal error it has notified about, or on
+    # SIGTERM, where s6 allows only a few seconds (the outbox keeps the rest)
+    NOTIFIER.flush(2 if SHUTDOWN.is_set() else 15)
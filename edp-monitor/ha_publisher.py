@@ -0,0 +1,129 @@
+# ha_publisher.py — Home Assistant sensors for EDP Voucher Monitor
+"""
+Publishes the monitor's state as Home Assistant entities through the
+Supervisor's Core API proxy (POST /core/api/states/<entity_id>, needs
+`homeassistant_api: true` and the SUPERVISOR_TOKEN the Supervisor injects).
+
+A `source` callable builds the whole state document ({entity_id: {"state",
+"attributes"}}). One daemon thread rebuilds it when changed() is called,
+or every `refresh_seconds` regardless, and posts only the entities that
+differ from what Home Assistant was last sent. Rounds are at least
+`min_interval` seconds apart, so a burst of changes is published once, with
+its final values. Every `resync_seconds` everything is sent again, which
+restores entities after a Home Assistant restart.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+try:
+    import requests
+except ImportError:  # edp_monitor still runs, without sensors
+    requests = None
+
+from helpers import log
+
+
+class StatePublisher:
+    """Publisher to the Core API at `base_url` (e.g.
+    http://supervisor/core/api). Without a `token` it stays disabled."""
+
+    def __init__(self, base_url: str, token: str | None, source=None,
+                 min_interval: float = 10, refresh_seconds: float = 60,
+                 resync_seconds: float = 900, timeout: float = 10,
+                 session: requests.Session | None = None):
+        self.base_url = base_url
+        self.token = token
+        self.source = source
+        self.min_interval = min_interval
+        self.refresh_seconds = refresh_seconds
+        self.resync_seconds = resync_seconds
+        self.timeout = timeout
+        self.session = session
+        if session is None and requests is not None:
+            self.session = requests.Session()
+        self.published = {}  # entity_id -> body HA last accepted
+        self._resynced = time.monotonic()
+        self._failing = False
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if not self.token:
+            log("SUPERVISOR_TOKEN not set — Home Assistant sensors disabled",
+                "WARN")
+            return
+        if self.session is None:
+            log("requests not installed — Home Assistant sensors disabled",
+                "ERROR")
+            return
+        self._stop.clear()
+        self._changed.set()  # first round right away
+        self._thread = threading.Thread(target=self._run, name="ha-publisher",
+                                        daemon=True)
+        self._thread.start()
+
+    def changed(self) -> None:
+        """Ask for a publish round; cheap, callable from any thread."""
+        self._changed.set()
+
+    def stop(self, timeout: float = 5) -> None:
+        self._stop.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def publish_now(self) -> int:
+        """Build the document and post every entity that changed. Returns
+        the number of entities posted."""
+        if time.monotonic() - self._resynced >= self.resync_seconds:
+            self.published.clear()
+            self._resynced = time.monotonic()
+        posted = 0
+        for entity_id, body in self.source().items():
+            if self.published.get(entity_id) == body:
+                continue
+            if not self._post(entity_id, body):
+                break  # HA unreachable: retry the rest next round
+            self.published[entity_id] = body
+            posted += 1
+        return posted
+
+    def _run(self) -> None:
+        last_round = float("-inf")
+        while not self._stop.is_set():
+            self._changed.wait(self.refresh_seconds)
+            hold = last_round + self.min_interval - time.monotonic()
+            if hold > 0 and self._stop.wait(hold):
+                return
+            if self._stop.is_set():
+                return
+            self._changed.clear()
+            last_round = time.monotonic()
+            try:
+                self.publish_now()
+            except Exception as e:
+                log(f"Could not build Home Assistant state: {e}", "WARN")
+
+    def _post(self, entity_id: str, body: dict) -> bool:
+        try:
+            resp = self.session.post(
+                f"{self.base_url.rstrip('/')}/states/{entity_id}",
+                json=body, timeout=self.timeout,
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+            ok = resp.status_code < 400
+            error = f"HTTP {resp.status_code}"
+        except requests.RequestException as e:
+            ok, error = False, str(e)
+        if not ok and not self._failing:
+            log(f"Home Assistant state update failed ({entity_id}): {error}",
+                "WARN")
+        elif ok and self._failing:
+            log("Home Assistant state updates working again")
+        self._failing = not ok
+        return ok
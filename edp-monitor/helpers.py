@@ -3,10 +3,15 @@
 No Selenium / no requests imports. Stdlib only so tests.py can run anywhere.
 """
 
+import ctypes
 import json
 import os
 import re
+import signal
+import socket
+import threading
 import time
+import unicodedata
 from datetime import datetime, timedelta
 
 
@@ -22,19 +27,60 @@ def parse_attempt_time(time_str: str, ref: datetime) -> datetime:
     return ref.replace(hour=int(h), minute=int(m), second=0, microsecond=0)
 
 
+_log_label = ""
+
+
+def set_log_label(label: str) -> None:
+    """Tag every following log line of this process with `label` (the
+    account, when several monitors share the add-on log)."""
+    global _log_label
+    _log_label = f"[{label}] " if label else ""
+
+
 def log(msg: str, level: str = "INFO", _now: datetime | None = None) -> None:
     """Print a timestamped log line to stdout, flushed.
 
     `_now` is for testing; real callers don't pass it.
     """
     ts = (_now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{ts}] [{level}] {msg}", flush=True)
+    print(f"[{ts}] [{level}] {_log_label}{msg}", flush=True)
 
 
-def parse_voucher_status(body_text: str, button_disabled: bool,
+CODIGOS_RE = re.compile(r"C[óo]digos dispon[íi]veis:?\s*(\d+)")
+
+
+def snapshot_from_text(body_text: str, button_disabled: bool = True,
+                       codigos_disponiveis: int | None = None,
+                       button_present: bool = True, url: str = "") -> dict:
+    """Build a detail-page snapshot (the dict DETAIL_SNAPSHOT_JS returns
+    in-page) from raw body text. Markers here and in the JS must agree.
+
+    A missing button counts as disabled. `codigos_disponiveis` defaults to
+    the `Códigos disponíveis: N` count found in the text, if any.
+    """
+    lowered = body_text.lower()
+    if codigos_disponiveis is None:
+        m = CODIGOS_RE.search(body_text)
+        codigos_disponiveis = int(m.group(1)) if m else None
+    return {
+        "url": url,
+        "button_present": button_present,
+        "button_disabled": button_disabled or not button_present,
+        "codigos": codigos_disponiveis,
+        "login": (("login" in lowered or "iniciar" in lowered)
+                  and len(body_text) < 500),
+        "saldo": "saldo insuficiente" in lowered,
+        "esgotado": "esgotad" in lowered or "volte no próximo" in lowered,
+    }
+
+
+def parse_voucher_status(page, button_disabled: bool | None = None,
                          codigos_disponiveis: int | None = None) -> tuple:
-    """Decide voucher state from page body text + main button's disabled
-    flag + the parsed `Códigos disponíveis: N` count.
+    """Decide voucher state from a detail-page snapshot.
+
+    `page` is either the snapshot dict (see snapshot_from_text) or, as
+    before, the page body text — in which case the main button's disabled
+    flag and the parsed `Códigos disponíveis: N` count come as arguments.
 
     Returns (available, status_code):
       (True,  "disponivel")            — button enabled, can claim now
@@ -43,40 +89,317 @@ def parse_voucher_status(body_text: str, button_disabled: bool,
       (None,  "precisa_login")         — login redirect detected
       (None,  "erro: estado_incerto")  — unrecognised state
     """
-    lowered = body_text.lower()
+    if isinstance(page, str):
+        page = snapshot_from_text(page, bool(button_disabled),
+                                  codigos_disponiveis)
 
-    if (("login" in lowered or "iniciar" in lowered) and len(body_text) < 500):
+    if page["login"]:
         return (None, "precisa_login")
 
-    if not button_disabled:
+    if not page["button_disabled"]:
         return (True, "disponivel")
 
-    if "saldo insuficiente" in lowered:
+    if page["saldo"]:
         return (False, "saldo_insuficiente")
 
-    if "esgotad" in lowered or "volte no próximo" in lowered:
+    if page["esgotado"]:
         return (False, "esgotado")
 
     # Strongest signal: explicit zero count means there's nothing to claim,
     # regardless of what surrounding copy the portal happens to use.
-    if codigos_disponiveis == 0:
+    if page["codigos"] == 0:
         return (False, "esgotado")
 
     return (None, "erro: estado_incerto")
 
 
-def sleep_until(target: datetime) -> None:
-    """Sleep in 1-hour chunks until `target` is reached.
+# Field aliases accepted in the portal's voucher JSON, first match wins.
+API_CODES_KEYS = ("codigosDisponiveis", "availableCodes", "codesAvailable",
+                  "stock")
+API_ENABLED_KEYS = ("canGenerate", "available", "generateEnabled")
+API_SOLD_OUT_KEYS = ("esgotado", "soldOut")
+API_NO_BALANCE_KEYS = ("saldoInsuficiente", "insufficientBalance")
+
 
-    Chunked so SIGTERM during an HA addon stop can interrupt promptly.
+def _first_key(payload: dict, keys: tuple):
+    for key in keys:
+        if key in payload:
+            return payload[key]
+    return None
+
+
+def parse_api_voucher(payload) -> tuple:
+    """Map a portal voucher JSON document onto parse_voucher_status states.
+
+    The payload is translated into a detail-page snapshot (button disabled
+    flag, `Códigos disponíveis` count, sold-out / balance markers) so both
+    paths share one decision table. A payload with none of the known fields
+    yields "erro: estado_incerto" and the caller falls back to the browser.
+    """
+    if not isinstance(payload, dict):
+        return (None, "erro: estado_incerto")
+
+    codes = _first_key(payload, API_CODES_KEYS)
+    codes = codes if isinstance(codes, int) and not isinstance(codes, bool) else None
+    enabled = _first_key(payload, API_ENABLED_KEYS)
+    sold_out = _first_key(payload, API_SOLD_OUT_KEYS) is True
+    no_balance = _first_key(payload, API_NO_BALANCE_KEYS) is True
+
+    if enabled is None and codes is None and not (sold_out or no_balance):
+        return (None, "erro: estado_incerto")
+    return parse_voucher_status({
+        "url": "",
+        "button_present": enabled is not None,
+        "button_disabled": enabled is not True,
+        "codigos": codes,
+        "login": False,
+        "saldo": no_balance,
+        "esgotado": sold_out,
+    })
+
+
+def match_pack_cards(cards: list, names: list) -> dict:
+    """Pick, for each voucher name, the first packs-page card whose text
+    contains it (case-insensitive).
+
+    `cards` is the list of dicts returned by the packs-page snapshot script
+    (each has at least a "text" key). Returns {name: card} for names that
+    matched; unmatched names are absent.
+    """
+    matched = {}
+    for name in names:
+        needle = name.lower()
+        for card in cards:
+            if needle in (card.get("text") or "").lower():
+                matched[name] = card
+                break
+    return matched
+
+
+def card_looks_available(card_text: str) -> bool:
+    """Decide from a packs-page card's text whether its detail page is worth
+    opening. Only explicit sold-out copy rules a card out — anything else
+    (including text we don't recognise) still gets a detail-page check.
+    """
+    lowered = card_text.lower()
+    return not ("esgotad" in lowered or "volte no próximo" in lowered)
+
+
+FINAL_APPROACH_SECONDS = 2.0  # switch from wall-clock chunks to monotonic
+SPIN_SECONDS = 0.002  # busy-wait the last couple of ms instead of sleeping
+
+
+def _pause(seconds: float, cancel: threading.Event | None) -> bool:
+    """Sleep, or wait on `cancel`. True if cancelled."""
+    if cancel is None:
+        time.sleep(seconds)
+        return False
+    return cancel.wait(seconds)
+
+
+def wait_until_epoch(wanted: float, cancel: threading.Event | None = None,
+                     max_chunk: float = 60.0, clock=time.time) -> float | None:
+    """Block until wall-clock epoch time `wanted`; return the drift (actual
+    minus wanted, in seconds), or None if `cancel` got set first.
+
+    Far from the target it sleeps in chunks of at most `max_chunk`, reading
+    the wall clock again after each, so suspend, oversleep and NTP steps are
+    corrected within one chunk. The last FINAL_APPROACH_SECONDS run on the
+    monotonic clock: one sleep to SPIN_SECONDS short, then a busy-wait, which
+    keeps the wake within a few ms of the target.
     """
     while True:
-        now = datetime.now()
-        remaining = (target - now).total_seconds()
-        if remaining <= 0:
-            return
-        chunk = min(remaining, 3600)
-        time.sleep(chunk)
+        remaining = wanted - clock()
+        if remaining <= FINAL_APPROACH_SECONDS:
+            break
+        if _pause(min(remaining - FINAL_APPROACH_SECONDS, max_chunk), cancel):
+            return None
+    deadline = time.monotonic() + remaining
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        if left > SPIN_SECONDS and _pause(left - SPIN_SECONDS, cancel):
+            return None
+    return clock() - wanted
+
+
+def sleep_until(target: datetime, lead_seconds: float = 0,
+                cancel: threading.Event | None = None) -> float | None:
+    """Sleep until `lead_seconds` before `target` (see wait_until_epoch).
+
+    Returns the drift in seconds, or None if `cancel` (SIGTERM during an HA
+    addon stop) interrupted the sleep. Returns at once (with how late it
+    already is) if the time has passed.
+    """
+    return wait_until_epoch(target.timestamp() - lead_seconds, cancel)
+
+
+def entity_slug(name: str) -> str:
+    """Home Assistant object id for a target name: lowercase ASCII words
+    joined by underscores ("Domino's Pizzas" → "dominos_pizzas")."""
+    ascii_name = unicodedata.normalize("NFKD", name).encode(
+        "ascii", "ignore").decode()
+    words = re.findall(r"[a-z0-9]+", ascii_name.lower().replace("'", ""))
+    return "_".join(words) or "target"
+
+
+def desktop_user_agent(version_output: str) -> str | None:
+    """Build the reduced desktop-Linux UA headed Chromium sends from the
+    output of `chromium-browser --version` (e.g. "Chromium 126.0.6478.126
+    Alpine Linux"). Returns None if no version number is found.
+    """
+    m = re.search(r"(\d+)\.\d+\.\d+\.\d+", version_output)
+    if not m:
+        return None
+    return ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+            f"(KHTML, like Gecko) Chrome/{m.group(1)}.0.0.0 Safari/537.36")
+
+
+def wait_for_port(host: str, port: int, timeout: float,
+                  interval: float = 0.02) -> bool:
+    """Poll until a TCP connect to host:port succeeds. Returns False if it
+    didn't within `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=interval * 5):
+                return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+
+def wait_for_path(path: str, timeout: float, interval: float = 0.02) -> bool:
+    """Poll until `path` exists (e.g. the X server's socket). Returns False
+    if it didn't within `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def die_with_parent() -> None:
+    """preexec_fn: have the child SIGTERMed when this process dies without
+    stopping it (Linux prctl PR_SET_PDEATHSIG), so no orphan is left
+    running next to what the next start spawns."""
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(1, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass
+
+
+def format_phase_timings(phases: list, total: float) -> str:
+    """One log line for a startup breakdown: `phases` is a list of
+    (name, seconds) in the order they finished; `total` is wall time, which
+    is less than the sum when phases overlapped.
+    """
+    parts = [f"{name} {seconds:.2f}s" for name, seconds in phases]
+    parts.append(f"total {total:.2f}s")
+    return " | ".join(parts)
+
+
+def should_hibernate(now: datetime, next_wakeup: datetime,
+                     threshold_minutes: int) -> bool:
+    """True when the gap to the next wakeup is long enough to be worth
+    quitting the browser for. A threshold of 0 disables hibernation."""
+    if threshold_minutes <= 0:
+        return False
+    return (next_wakeup - now).total_seconds() > threshold_minutes * 60
+
+
+def _vm_rss_bytes(proc_root: str, pid: int) -> int:
+    try:
+        with open(f"{proc_root}/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def process_tree_pids(root_pid: int, proc_root: str = "/proc") -> list:
+    """`root_pid` followed by all its descendants (depth first), from the
+    ppid fields in /proc. Just [root_pid] if /proc can't be read."""
+    children = {}
+    try:
+        entries = os.listdir(proc_root)
+    except OSError:
+        entries = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"{proc_root}/{entry}/stat") as f:
+                stat = f.read()
+            # "pid (comm) state ppid ..." — comm may itself contain ") "
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack, seen = [], [root_pid], set()
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def process_tree_rss(root_pid: int, proc_root: str = "/proc") -> int:
+    """Resident memory in bytes of `root_pid` plus all its descendants, read
+    from /proc. Pages shared between processes (Chromium's renderers) are
+    counted once per process, so this is an upper bound. 0 if unreadable.
+    """
+    return sum(_vm_rss_bytes(proc_root, pid)
+               for pid in process_tree_pids(root_pid, proc_root))
+
+
+def summarise_page_weight(navigation: dict | None, resources: list) -> dict:
+    """Reduce a page's Performance API entries (the navigation entry plus
+    every resource entry, as plain dicts) to what was fetched and how long
+    the document took to load.
+
+    `bytes` is the sum of transferSize, which is 0 for cache hits and for
+    cross-origin responses without Timing-Allow-Origin. `load_ms` is None
+    until the load event has fired.
+    """
+    nav = navigation or {}
+    by_type = {}
+    total = nav.get("transferSize") or 0
+    for entry in resources:
+        size = entry.get("transferSize") or 0
+        kind = entry.get("initiatorType") or "other"
+        by_type[kind] = by_type.get(kind, 0) + size
+        total += size
+    load_end = nav.get("loadEventEnd") or 0
+    return {
+        "bytes": total,
+        "requests": len(resources) + (1 if navigation else 0),
+        "load_ms": round(load_end - (nav.get("startTime") or 0))
+                   if load_end > 0 else None,
+        "by_type": by_type,
+    }
+
+
+def format_page_weight(summary: dict) -> str:
+    """'412 KB in 37 requests, load 1184 ms (script 300 KB, css 80 KB, ...)'"""
+    load = (f"{summary['load_ms']} ms" if summary["load_ms"] is not None
+            else "not finished")
+    line = (f"{summary['bytes'] / 1024:.0f} KB in {summary['requests']} "
+            f"requests, load {load}")
+    heaviest = sorted(((size, kind) for kind, size in summary["by_type"].items()
+                       if size), reverse=True)
+    if heaviest:
+        line += " (" + ", ".join(f"{kind} {size / 1024:.0f} KB"
+                                 for size, kind in heaviest) + ")"
+    return line
 
 
 def month_key(now: datetime) -> str:
@@ -84,12 +407,9 @@ def month_key(now: datetime) -> str:
     return now.strftime("%Y-%m")
 
 
-def load_history(path: str) -> dict:
-    """Load claim history from disk. Returns {} if missing or corrupt.
-
-    Schema: {voucher_name: {"month": "YYYY-MM", "code": str,
-                            "validity": str, "claimed_at": ISO8601}}
-    """
+def _load_json_dict(path: str) -> dict:
+    """Load a JSON object from disk. Returns {} if missing, corrupt or not
+    an object."""
     try:
         with open(path) as f:
             data = json.load(f)
@@ -100,6 +420,25 @@ def load_history(path: str) -> dict:
         return {}
 
 
+def write_json_atomic(path: str, data: dict) -> None:
+    """Write `data` to `path` via fsync'd temp file + rename."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_history(path: str) -> dict:
+    """Load claim history from disk. Returns {} if missing or corrupt.
+
+    Schema: {voucher_name: {"month": "YYYY-MM", "code": str,
+                            "validity": str, "claimed_at": ISO8601}}
+    """
+    return _load_json_dict(path)
+
+
 def save_history(path: str, name: str, month: str, code: str, validity: str,
                  claimed_at: datetime) -> None:
     """Atomically update one entry in the history file."""
@@ -110,12 +449,54 @@ def save_history(path: str, name: str, month: str, code: str, validity: str,
         "validity": validity,
         "claimed_at": claimed_at.isoformat(timespec="seconds"),
     }
-    tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
-        f.flush()
-        os.fsync(f.fileno())
-    os.replace(tmp, path)
+    write_json_atomic(path, history)
+
+
+def load_catalog(path: str) -> dict:
+    """Load the detail-page catalog cache. Returns {} if missing or corrupt.
+
+    Schema: {voucher_name: {"partner_id": int, "url": str,
+                            "resolved_at": ISO8601}}
+    """
+    return _load_json_dict(path)
+
+
+def save_catalog_entry(path: str, name: str, partner_id: int | None, url: str,
+                       resolved_at: datetime) -> None:
+    """Atomically update one entry in the catalog cache file."""
+    catalog = load_catalog(path)
+    catalog[name] = {
+        "partner_id": partner_id,
+        "url": url,
+        "resolved_at": resolved_at.isoformat(timespec="seconds"),
+    }
+    write_json_atomic(path, catalog)
+
+
+def cached_detail_url(catalog: dict, target: dict) -> str | None:
+    """Return the cached detail URL for a config target, or None.
+
+    An entry only counts if it was resolved for the same partner_id the
+    target has now — editing a target's partner_id in config invalidates it.
+    """
+    entry = catalog.get(target["name"])
+    if not isinstance(entry, dict):
+        return None
+    if entry.get("partner_id") != target.get("partner_id"):
+        return None
+    url = entry.get("url")
+    if not isinstance(url, str) or "/beneficios/detalhe/" not in url:
+        return None
+    return url
+
+
+def by_priority(targets: list) -> list:
+    """`targets` in claim order: ascending `priority`, targets without one
+    after those with one, and config order among equals."""
+    ranked = sorted(enumerate(targets),
+                    key=lambda it: (it[1].get("priority") is None,
+                                    it[1].get("priority") or 0, it[0]))
+    return [target for _, target in ranked]
 
 
 def unclaimed_for_month(targets: list, history: dict, month: str) -> list:
@@ -173,6 +554,31 @@ def compute_next_wakeup(now: datetime, history: dict, targets: list,
     return parse_attempt_time(attempt_times[0], tomorrow)
 
 
+def next_attempt_per_target(now: datetime, history: dict, targets: list,
+                            start_day: int, attempt_times: list,
+                            times_by_target: dict | None = None) -> dict:
+    """compute_next_wakeup for each target on its own: {name: datetime}.
+    A target claimed this month gets next month's first slot even while
+    others still have slots today. `times_by_target` overrides
+    attempt_times per target name (learned restock slots)."""
+    times_by_target = times_by_target or {}
+    return {t["name"]: compute_next_wakeup(
+                now, history, [t], start_day,
+                times_by_target.get(t["name"]) or attempt_times)
+            for t in targets}
+
+
+def end_of_day_time(now: datetime, attempt_times: list,
+                    delay_minutes: int) -> datetime:
+    """When to send the end-of-day summary: `delay_minutes` after the day's
+    last attempt slot — today's if still ahead, else tomorrow's."""
+    last = max(parse_attempt_time(t, now) for t in attempt_times)
+    due = last + timedelta(minutes=delay_minutes)
+    if due <= now:
+        due += timedelta(days=1)
+    return due
+
+
 def parse_validity_to_month(text: str) -> str | None:
     """Parse 'Até DD Mmm YYYY' (Portuguese) into a 'YYYY-MM' month key.
 
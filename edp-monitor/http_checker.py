@@ -0,0 +1,107 @@
+# http_checker.py — browser-free availability checks for EDP Voucher Monitor
+"""
+Queries the portal's voucher JSON endpoint with the cookies of the logged-in
+Chromium session, over one pooled keep-alive requests.Session. Answers map
+onto the same parse_voucher_status states as the Selenium path, so the
+browser only has to be driven for targets that look claimable or when the
+session needs a login.
+
+Experimental: the portal's endpoint hasn't been pinned down, so
+`http_check_url` is user-supplied and parse_api_voucher accepts the field
+names such an endpoint is likely to use (API_*_KEYS). The first 200 answer
+it can't read is logged in full, once; unreadable answers always fall back
+to the browser.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # HttpChecker() raises; edp_monitor then skips HTTP checks
+    requests = None
+
+from helpers import (API_CODES_KEYS, API_ENABLED_KEYS, API_NO_BALANCE_KEYS,
+                     API_SOLD_OUT_KEYS, log, parse_api_voucher)
+
+
+class HttpChecker:
+    """Availability checker for `url_template` (formatted with the target's
+    `partner_id` and `name`)."""
+
+    def __init__(self, url_template: str, timeout: float = 5,
+                 session: requests.Session | None = None):
+        self.url_template = url_template
+        self.timeout = timeout
+        if session is None and requests is None:
+            raise ImportError("requests not installed")
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept": "application/json"})
+        self.unrecognised = None  # first body parse_api_voucher couldn't read
+
+    def load_cookies(self, cookies: list) -> int:
+        """Replace the session cookies with `cookies` (CDP/WebDriver cookie
+        dicts with name, value, domain, path). Returns how many were loaded.
+        """
+        self.session.cookies.clear()
+        for c in cookies:
+            self.session.cookies.set(c["name"], c["value"],
+                                     domain=c.get("domain", ""),
+                                     path=c.get("path", "/"))
+        return len(cookies)
+
+    def check(self, target: dict) -> tuple:
+        """Return (available, status) for `target`, like check_voucher.
+
+        Login is reported as (None, "precisa_login") on 401/403 or when the
+        request got redirected off the API to an HTML page. Transport errors
+        and unexpected bodies return an "erro: ..." status so the caller
+        can fall back to the browser.
+        """
+        name = target["name"]
+        url = self.url_template.format(partner_id=target.get("partner_id"),
+                                       name=name)
+        started = time.monotonic()
+        try:
+            resp = self.session.get(url, timeout=self.timeout,
+                                    allow_redirects=True)
+        except requests.RequestException as e:
+            log(f"[{name}] HTTP check failed: {e}", "WARN")
+            return (None, f"erro: http {type(e).__name__}")
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        content_type = resp.headers.get("Content-Type", "")
+        if resp.status_code in (401, 403) or (
+                resp.history and "json" not in content_type):
+            status = (None, "precisa_login")
+        elif resp.status_code != 200:
+            status = (None, f"erro: http {resp.status_code}")
+        else:
+            try:
+                payload = resp.json()
+                status = parse_api_voucher(payload)
+            except ValueError:
+                payload, status = resp.text, (None, "erro: http non-json body")
+            if status[1].startswith("erro:") and self.unrecognised is None:
+                self._report_unrecognised(url, payload)
+
+        log(f"[{name}] HTTP check state={status[1]} "
+            f"(HTTP {resp.status_code}, {elapsed_ms:.0f} ms)")
+        return status
+
+    def _report_unrecognised(self, url: str, payload) -> None:
+        self.unrecognised = payload
+        body = payload if isinstance(payload, str) else json.dumps(
+            payload, ensure_ascii=False)
+        known = (API_CODES_KEYS + API_ENABLED_KEYS + API_SOLD_OUT_KEYS
+                 + API_NO_BALANCE_KEYS)
+        log(f"HTTP check: {url} answered in a shape the experimental parser "
+            f"doesn't know (expected any of {', '.join(known)}): "
+            f"{body[:500]} — checks fall back to the browser; clear "
+            "http_check_url or report this body", "ERROR")
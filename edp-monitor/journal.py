@@ -0,0 +1,162 @@
+# journal.py — append-only claim journal for EDP Voucher Monitor
+"""
+Every claim and every portal-sync detection is one JSON line appended (and
+fsync'd) to /data/claims.jsonl, so recording an event costs the same however
+long the history gets, and earlier months are kept instead of overwritten.
+
+Replaying the file at startup builds two in-memory views: `view`, the latest
+event per voucher name in the old claim_history.json schema (what
+unclaimed_for_month / compute_next_wakeup read, plus a `source` key), and
+`months`, every event per month. An existing claim_history.json is migrated on first load.
+Stdlib only.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from helpers import load_history, log
+
+
+class ClaimJournal:
+    """Journal at `path`; `legacy_path` is the claim_history.json to migrate
+    from when the journal doesn't exist yet.
+
+    The file is compacted (one line per voucher and month, oldest first)
+    once it holds more than `compact_slack` lines beyond that.
+    """
+
+    def __init__(self, path: str, legacy_path: str | None = None,
+                 compact_slack: int = 256):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.compact_slack = compact_slack
+        self.view = {}
+        self.months = {}
+        self._lines = 0
+        self._torn_tail = False
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """Replay the journal (migrating first if needed) and return `view`.
+
+        Lines that don't parse, e.g. one cut short by a crash mid-append,
+        are skipped and dropped at the next compaction.
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                self._migrate()
+            self.view.clear()
+            self.months.clear()
+            self._lines = 0
+            self._torn_tail = False
+            try:
+                with open(self.path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return self.view
+            self._torn_tail = bool(data) and not data.endswith(b"\n")
+            for raw in data.splitlines():
+                self._lines += 1
+                try:
+                    event = json.loads(raw)
+                    self._apply(event)
+                except (ValueError, KeyError, TypeError):
+                    continue
+            self._maybe_compact()
+            return self.view
+
+    def record(self, name: str, month: str, code: str, validity: str,
+               claimed_at: datetime, source: str = "claim") -> dict:
+        """Append one event and fold it into the views. Returns the entry
+        as stored in `view[name]`."""
+        event = {
+            "name": name,
+            "month": month,
+            "code": code,
+            "validity": validity,
+            "claimed_at": claimed_at.isoformat(timespec="seconds"),
+            "source": source,
+        }
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self._torn_tail:
+                    f.write("\n")
+                    self._lines += 1
+                    self._torn_tail = False
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._lines += 1
+            self._apply(event)
+            self._maybe_compact()
+            return self.view[name]
+
+    def claims_in(self, month: str) -> dict:
+        """Every voucher recorded for `month` ({name: entry})."""
+        return dict(self.months.get(month, {}))
+
+    def snapshot(self) -> dict:
+        """Copy of `months` ({month: {name: entry}}), safe to read from
+        another thread while events are being recorded."""
+        with self._lock:
+            return {month: {name: dict(entry) for name, entry in names.items()}
+                    for month, names in sorted(self.months.items())}
+
+    def _apply(self, event: dict) -> None:
+        name, month = event["name"], event["month"]
+        entry = {
+            "month": month,
+            "code": event["code"],
+            "validity": event["validity"],
+            "claimed_at": event["claimed_at"],
+            "source": event.get("source", "claim"),
+        }
+        self.months.setdefault(month, {})[name] = entry
+        if self.view.get(name, {}).get("month", "") <= month:
+            self.view[name] = entry
+
+    def _maybe_compact(self) -> None:
+        unique = sum(len(names) for names in self.months.values())
+        if self._lines <= unique + self.compact_slack:
+            return
+        before = self._lines
+        self._write_all()
+        log(f"Claim journal compacted: {before} → {self._lines} lines")
+
+    def _write_all(self) -> None:
+        """Atomically rewrite the journal from `months`."""
+        tmp = self.path + ".tmp"
+        lines = 0
+        with open(tmp, "w", encoding="utf-8") as f:
+            for month in sorted(self.months):
+                for name, entry in self.months[month].items():
+                    f.write(json.dumps({"name": name, **entry},
+                                       ensure_ascii=False) + "\n")
+                    lines += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._lines = lines
+        self._torn_tail = False
+
+    def _migrate(self) -> None:
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        legacy = load_history(self.legacy_path)
+        for name, entry in legacy.items():
+            try:
+                self.months.setdefault(entry["month"], {})[name] = {
+                    "month": entry["month"],
+                    "code": entry.get("code", ""),
+                    "validity": entry.get("validity", ""),
+                    "claimed_at": entry.get("claimed_at", ""),
+                    "source": "migrated",
+                }
+            except (KeyError, TypeError):
+                continue
+        self._write_all()
+        log(f"Migrated {len(legacy)} entr{'y' if len(legacy) == 1 else 'ies'} "
+            f"from {self.legacy_path} to {self.path}")
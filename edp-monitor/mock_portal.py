@@ -0,0 +1,366 @@
+# mock_portal.py — offline stand-in for the EDP Packs portal
+"""
+Serves, from localhost, the slice of particulares.cliente.edp.pt that
+edp_monitor.py depends on: the Angular-ish packs page (`benefits-card` /
+`.benefits-card-wrapper`), detail pages with the `edp-large-button`, the
+`ngb-modal-window` claim modal (`#form-terms`, `.submit-button`), the
+`.code-card-body-text-*` success card, the "Códigos ativos" navbar link to
+/beneficios/ativos, and the login redirect. Rendering and claiming can be
+slowed down to mimic the real portal. Stdlib only.
+
+Run with: python3 mock_portal.py [--port 8088] [--render-delay-ms 800] ...
+Then point the monitor at it with EDP_PORTAL_URL=http://127.0.0.1:8088
+"""
+
+import argparse
+import json
+import random
+import string
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from helpers import PT_MONTHS
+
+DEFAULT_PARTNERS = [
+    {"partner_id": 1199, "name": "Domino's Pizzas", "category": "Restaurantes",
+     "value": "5 €", "stock": 0},
+    {"partner_id": 1197, "name": "Pingo Doce", "category": "Dia-a-dia",
+     "value": "10 €", "stock": 2},
+    {"partner_id": 1201, "name": "Galp", "category": "Mobilidade",
+     "value": "5 €", "stock": 3},
+]
+
+PT_MONTH_ABBR = {v: k.capitalize() for k, v in PT_MONTHS.items()}
+
+# Single-page app shell: every /beneficios/* URL serves it and the client
+# routes on location.pathname, so deep links and router clicks both work.
+# Timings come from /mock/state so they can change while a browser is open.
+APP_HTML = """<!doctype html>
+<html lang="pt"><head><meta charset="utf-8"><title>EDP Packs (mock)</title>
+<style>
+ benefits-card { display: block; border: 1px solid #ccc; margin: 8px; }
+ .benefits-card-wrapper { padding: 12px; cursor: pointer; }
+ ngb-modal-window { display: block; position: fixed; top: 20%; left: 20%;
+                    background: #fff; border: 2px solid #333; padding: 16px; }
+ .form-check-input { opacity: 0; }
+</style></head>
+<body>
+<nav>
+ <a class="nav-link" data-route="/beneficios/pack">Packs</a>
+ <a class="nav-link" data-route="/beneficios/ativos">Códigos ativos</a>
+</nav>
+<main id="app"></main>
+<script>
+const sleep = ms => new Promise(r => setTimeout(r, ms));
+const app = document.getElementById('app');
+const esc = s => String(s).replace(/[&<>"]/g,
+    c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]));
+let renderSeq = 0;
+
+function go(path) {
+    history.pushState({}, '', path);
+    render();
+}
+window.addEventListener('popstate', render);
+document.querySelectorAll('nav a').forEach(a =>
+    a.addEventListener('click', ev => { ev.preventDefault(); go(a.dataset.route); }));
+
+async function render() {
+    const seq = ++renderSeq;
+    app.innerHTML = '';
+    const state = await (await fetch('/mock/state')).json();
+    await sleep(state.render_delay_ms);
+    if (seq !== renderSeq) return;
+    const path = location.pathname;
+    if (path.startsWith('/beneficios/detalhe/')) renderDetail(state, path);
+    else if (path.startsWith('/beneficios/ativos')) renderActive(state);
+    else renderPacks(state);
+}
+
+function renderPacks(state) {
+    for (const p of state.partners) {
+        const card = document.createElement('benefits-card');
+        card.innerHTML = `<div class="benefits-card-wrapper">
+            <div>${esc(p.category)}</div><h3>${esc(p.name)}</h3>
+            <div>${esc(p.value)}</div>
+            ${p.stock === 0 && state.sold_out_on_cards ? '<div>Esgotado</div>' : ''}
+            </div>`;
+        // Like the real portal, plain .click() is not enough: navigation
+        // only happens after a pointerdown on the wrapper.
+        const wrapper = card.querySelector('.benefits-card-wrapper');
+        let armed = false;
+        wrapper.addEventListener('pointerdown', () => { armed = true; });
+        wrapper.addEventListener('click', () => {
+            if (armed) go('/beneficios/detalhe/' + p.slug);
+        });
+        app.appendChild(card);
+    }
+}
+
+function renderDetail(state, path) {
+    const slug = path.split('/').pop();
+    const p = state.partners.find(x => x.slug === slug);
+    if (!p) { app.innerHTML = '<p>Benefício não encontrado</p>'; return; }
+    const enabled = p.stock > 0 && !state.insufficient_balance;
+    let status = '';
+    if (p.stock > 0 && state.insufficient_balance) {
+        status = 'Saldo insuficiente. Tente novamente ao receber o seu saldo mensal';
+    } else if (p.stock === 0 && state.sold_out_copy) {
+        status = 'Esgotado neste momento. Volte no próximo mês';
+    }
+    app.innerHTML = `<h1>${esc(p.name)}</h1>
+        <p>${esc(p.category)} · ${esc(p.value)}</p>
+        <p>Códigos disponíveis: ${p.stock}</p>
+        <p>${status}</p>
+        <button class="btn btn-primary edp-large-button"
+            ${enabled ? '' : 'disabled'}>Gerar código</button>
+        <p>Como usar: apresente o código na loja.</p>`;
+    app.querySelector('.edp-large-button').addEventListener('click',
+        () => openModal(state, p));
+}
+
+function openModal(state, p) {
+    const modal = document.createElement('ngb-modal-window');
+    modal.innerHTML = `<div class="form-check">
+        <input type="checkbox" id="form-terms" class="form-check-input">
+        <label for="form-terms">Li e aceito os termos</label></div>
+        <button class="btn btn-primary submit-button" disabled>Gerar código</button>`;
+    const cb = modal.querySelector('#form-terms');
+    const submit = modal.querySelector('.submit-button');
+    cb.addEventListener('change', () => {
+        if (cb.checked) submit.removeAttribute('disabled');
+        else submit.setAttribute('disabled', '');
+    });
+    submit.addEventListener('click', async () => {
+        submit.setAttribute('disabled', '');
+        const resp = await fetch('/mock/claim/' + p.partner_id, {method: 'POST'});
+        const result = await resp.json();
+        await sleep(state.claim_delay_ms);
+        if (!resp.ok) { modal.innerHTML = `<p>${esc(result.error)}</p>`; return; }
+        modal.innerHTML = `<div class="code-card-body">
+            <div class="code-card-body-text-code">${esc(result.code)}</div>
+            <div class="code-card-body-text-date">Até ${esc(result.validity)}</div>
+            </div>`;
+    });
+    document.body.appendChild(modal);
+}
+
+document.addEventListener('keydown', ev => {
+    if (ev.key === 'Escape') {
+        document.querySelectorAll('ngb-modal-window').forEach(m => m.remove());
+    }
+});
+
+function renderActive(state) {
+    for (const c of state.claimed) {
+        const card = document.createElement('benefits-card');
+        card.innerHTML = `<div class="benefits-card-wrapper">
+            <div>Código gerado: ${esc(c.code)}</div>
+            <div>Até ${esc(c.validity)}</div>
+            <div class="benefits-card-footer-tip">${esc(c.category)} ${esc(c.name)}</div>
+            </div>`;
+        app.appendChild(card);
+    }
+}
+
+render();
+</script>
+</body></html>
+"""
+
+LOGIN_HTML = """<!doctype html>
+<html lang="pt"><head><meta charset="utf-8"><title>Login</title></head>
+<body><h1>Iniciar sessão</h1><a href="/mock/login">Login</a></body></html>
+"""
+
+
+def _slug(name: str) -> str:
+    return "".join(c if c.isalnum() else "-" for c in name.lower()).strip("-")
+
+
+def end_of_month_validity(now: datetime) -> str:
+    """'DD Mmm YYYY' for the last day of `now`'s month, as the portal
+    prints validities (without the 'Até ' prefix)."""
+    first_next = (now.replace(day=28) + timedelta(days=4)).replace(day=1)
+    last = first_next - timedelta(days=1)
+    return f"{last.day} {PT_MONTH_ABBR[last.month]} {last.year}"
+
+
+class MockPortal:
+    """In-process mock portal. All scenario knobs are plain attributes and
+    can be changed while it runs (they're read per request)."""
+
+    def __init__(self, partners: list | None = None, render_delay_ms: int = 0,
+                 claim_delay_ms: int = 0, login_required: bool = False,
+                 insufficient_balance: bool = False,
+                 sold_out_copy: bool = True, sold_out_on_cards: bool = False):
+        self.partners = [dict(p, slug=f"{p['partner_id']}-{_slug(p['name'])}")
+                         for p in (partners or DEFAULT_PARTNERS)]
+        self.render_delay_ms = render_delay_ms
+        self.claim_delay_ms = claim_delay_ms
+        self.login_required = login_required
+        self.insufficient_balance = insufficient_balance
+        self.sold_out_copy = sold_out_copy
+        self.sold_out_on_cards = sold_out_on_cards
+        self.claimed = []
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self, port: int = 0) -> str:
+        """Serve on 127.0.0.1:`port` (0 = ephemeral) in a daemon thread.
+        Returns the base URL."""
+        portal = self
+
+        class Handler(_PortalHandler):
+            pass
+        Handler.portal = portal
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def partner(self, partner_id: int) -> dict | None:
+        return next((p for p in self.partners if p["partner_id"] == partner_id),
+                    None)
+
+    def set_stock(self, partner_id: int, stock: int) -> None:
+        with self.lock:
+            self.partner(partner_id)["stock"] = stock
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                "render_delay_ms": self.render_delay_ms,
+                "claim_delay_ms": self.claim_delay_ms,
+                "insufficient_balance": self.insufficient_balance,
+                "sold_out_copy": self.sold_out_copy,
+                "sold_out_on_cards": self.sold_out_on_cards,
+                "partners": [dict(p) for p in self.partners],
+                "claimed": list(self.claimed),
+            }
+
+    def claim(self, partner_id: int) -> tuple:
+        """Take one code from `partner_id`'s stock. Returns (http_status, body)."""
+        with self.lock:
+            p = self.partner(partner_id)
+            if p is None:
+                return 404, {"error": "unknown partner"}
+            if p["stock"] <= 0 or self.insufficient_balance:
+                return 409, {"error": "Esgotado"}
+            p["stock"] -= 1
+            code = "D" + "".join(random.choices(string.ascii_uppercase
+                                                + string.digits, k=7))
+            entry = {"partner_id": partner_id, "name": p["name"],
+                     "category": p["category"], "code": code,
+                     "validity": end_of_month_validity(datetime.now())}
+            self.claimed.append(entry)
+            return 200, entry
+
+
+class _PortalHandler(BaseHTTPRequestHandler):
+    portal: MockPortal = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body, ctype: str = "application/json") -> None:
+        data = body if isinstance(body, bytes) else (
+            json.dumps(body, ensure_ascii=False).encode("utf-8")
+            if ctype == "application/json" else body.encode("utf-8"))
+        self.send_response(status)
+        self.send_header("Content-Type", f"{ctype}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _redirect(self, location: str) -> None:
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        portal = self.portal
+        portal.requests += 1
+        url = urlparse(self.path)
+        path = url.path
+
+        if path == "/login":
+            return self._send(200, LOGIN_HTML, "text/html")
+        if path == "/mock/login":
+            portal.login_required = False
+            return self._redirect("/beneficios/pack")
+        if path == "/mock/state":
+            return self._send(200, portal.state())
+        if path == "/mock/set":
+            # e.g. /mock/set?stock=1197:2&render_delay_ms=500&login_required=1
+            q = parse_qs(url.query)
+            for spec in q.pop("stock", []):
+                pid, n = spec.split(":")
+                portal.set_stock(int(pid), int(n))
+            for key, values in q.items():
+                current = getattr(portal, key, None)
+                if isinstance(current, bool):
+                    setattr(portal, key, values[-1] in ("1", "true"))
+                elif isinstance(current, int):
+                    setattr(portal, key, int(values[-1]))
+            return self._send(200, portal.state())
+
+        if portal.login_required:
+            return self._redirect("/login")
+        if path.startswith("/api/vouchers/"):
+            p = portal.partner(int(path.rsplit("/", 1)[-1]))
+            if p is None:
+                return self._send(404, {"error": "unknown partner"})
+            return self._send(200, {
+                "partnerId": p["partner_id"],
+                "codigosDisponiveis": p["stock"],
+                "canGenerate": p["stock"] > 0 and not portal.insufficient_balance,
+                "saldoInsuficiente": portal.insufficient_balance,
+            })
+        if path == "/" or path.startswith("/beneficios"):
+            return self._send(200, APP_HTML, "text/html")
+        return self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        portal = self.portal
+        portal.requests += 1
+        path = urlparse(self.path).path
+        if portal.login_required:
+            return self._send(401, {"error": "login"})
+        if path.startswith("/mock/claim/"):
+            status, body = portal.claim(int(path.rsplit("/", 1)[-1]))
+            return self._send(status, body)
+        return self._send(404, {"error": "not found"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--render-delay-ms", type=int, default=800)
+    parser.add_argument("--claim-delay-ms", type=int, default=500)
+    parser.add_argument("--login-required", action="store_true")
+    parser.add_argument("--insufficient-balance", action="store_true")
+    args = parser.parse_args()
+    mock = MockPortal(render_delay_ms=args.render_delay_ms,
+                      claim_delay_ms=args.claim_delay_ms,
+                      login_required=args.login_required,
+                      insufficient_balance=args.insufficient_balance)
+    print(f"Mock EDP portal on {mock.start(args.port)}/beneficios/pack")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,184 @@
+# notifier.py — background ntfy dispatcher for EDP Voucher Monitor
+"""
+notify_phone used to POST to ntfy inline, so a slow ntfy.sh held up the
+next target's check and a failed send (claimed code included) was lost.
+Notifier queues messages instead and sends them from one daemon thread over
+a keep-alive requests.Session. Every queued message is written to an
+on-disk outbox first and only removed once ntfy accepted it, so messages
+that failed, or were still queued at shutdown, go out after a restart.
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import threading
+import time
+import uuid
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:  # edp_monitor still runs, without notifications
+    requests = None
+
+from helpers import log, write_json_atomic
+
+RETRY_DELAYS = (5, 30, 120, 600)  # seconds; the last one repeats
+
+
+class Notifier:
+    """Queue for ntfy messages to `base_url` (e.g. https://ntfy.sh), with
+    pending ones persisted at `outbox_path` (None = memory only)."""
+
+    def __init__(self, base_url: str, outbox_path: str | None = None,
+                 timeout: float = 10, retry_delays: tuple = RETRY_DELAYS,
+                 session: requests.Session | None = None):
+        self.base_url = base_url
+        self.outbox_path = outbox_path
+        self.timeout = timeout
+        self.retry_delays = retry_delays
+        self.session = session
+        if session is None and requests is not None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        self.outbox = {}
+        self._queue = []  # heap of (due monotonic time, seq, message id)
+        self._seq = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self) -> None:
+        """Reload the outbox left by a previous run and start sending."""
+        if self.session is None:
+            log("requests not installed — ntfy notifications disabled",
+                "ERROR")
+            return
+        with self._cond:
+            for msg in sorted(self._load_outbox().values(),
+                              key=lambda m: m.get("created", 0)):
+                if msg["id"] not in self.outbox:
+                    self.outbox[msg["id"]] = msg
+                    self._push(msg["id"], 0)
+            if self.outbox:
+                log(f"ntfy outbox: {len(self.outbox)} message(s) from "
+                    "before the restart")
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="notifier",
+                                            daemon=True)
+            self._thread.start()
+
+    def send(self, topic: str, title: str, message: str) -> str:
+        """Queue a message; returns immediately with its id."""
+        if self.session is None:
+            log(f"ntfy error: requests not installed — dropped '{title}'",
+                "ERROR")
+            return ""
+        msg = {"id": uuid.uuid4().hex, "topic": topic, "title": title,
+               "message": message, "created": time.time(), "attempts": 0}
+        with self._cond:
+            self.outbox[msg["id"]] = msg
+            self._save_outbox()
+            self._push(msg["id"], 0)
+            self._cond.notify_all()
+        return msg["id"]
+
+    def flush(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the outbox to empty."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.outbox:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop the sender after the message in flight, if any. Whatever is
+        still queued stays in the outbox for the next start()."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _push(self, msg_id: str, delay: float) -> None:
+        self._seq += 1
+        heapq.heappush(self._queue, (time.monotonic() + delay, self._seq,
+                                     msg_id))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and (
+                        not self._queue
+                        or self._queue[0][0] > time.monotonic()):
+                    wait = (self._queue[0][0] - time.monotonic()
+                            if self._queue else None)
+                    self._cond.wait(wait)
+                if self._stopping:
+                    return
+                _, _, msg_id = heapq.heappop(self._queue)
+                msg = self.outbox.get(msg_id)
+                if msg is None:
+                    continue
+            outcome = self._post(msg)
+            with self._cond:
+                if outcome == "retry":
+                    msg["attempts"] += 1
+                    delay = self.retry_delays[
+                        min(msg["attempts"], len(self.retry_delays)) - 1]
+                    log(f"ntfy: '{msg['title']}' not delivered "
+                        f"(attempt {msg['attempts']}), retrying in {delay}s",
+                        "WARN")
+                    self._push(msg_id, delay)
+                else:
+                    self.outbox.pop(msg_id, None)
+                self._save_outbox()
+                self._cond.notify_all()
+
+    def _post(self, msg: dict) -> str:
+        """Send one message: "sent", "dropped" (ntfy rejected it for good)
+        or "retry"."""
+        try:
+            resp = self.session.post(
+                f"{self.base_url.rstrip('/')}/{msg['topic']}",
+                data=msg["message"].encode("utf-8"),
+                headers={"Title": msg["title"], "Priority": "urgent",
+                         "Tags": "moneybag,rotating_light"},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            log(f"ntfy error: {e}", "ERROR")
+            return "retry"
+        log(f"ntfy → '{msg['title']}' (status {resp.status_code})")
+        if resp.status_code < 400:
+            return "sent"
+        if resp.status_code == 429 or resp.status_code >= 500:
+            return "retry"
+        log(f"ntfy rejected '{msg['title']}', dropping it", "ERROR")
+        return "dropped"
+
+    def _load_outbox(self) -> dict:
+        if not self.outbox_path:
+            return {}
+        try:
+            with open(self.outbox_path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save_outbox(self) -> None:
+        if not self.outbox_path:
+            return
+        try:
+            # fsync'd: a queued message may hold a code just claimed
+            write_json_atomic(self.outbox_path, self.outbox)
+        except OSError as e:
+            log(f"Could not write ntfy outbox: {e}", "WARN")
@@ -0,0 +1,238 @@
+# restock.py — learned restock times for EDP Voucher Monitor
+"""
+Every availability check is reported to RestockLog.observe(). A change of a
+target's stock state (sold out ↔ in stock) or of its `Códigos disponíveis`
+count is appended to /data/restock.jsonl, with the time of the last check
+that still showed the previous state (`since`), so each restock is known
+to lie in the interval (since, ts].
+
+From those intervals the time-of-day distribution of restocks is estimated
+per target, attempt slots are placed greedily to cover as much of it as a
+daily attempt budget allows, and the expected hit rate of any slot set can
+be computed. Attempts are also what the log learns from, so part of the
+budget keeps going to the static slots, in rotation: learned slots alone
+would only ever observe their own times. Stdlib only.
+
+Report with: python3 restock.py [/data/restock.jsonl] [HH:MM ...]
+"""
+
+import json
+import sys
+import threading
+from datetime import date, datetime
+
+from helpers import log
+
+IN_STOCK = ("disponivel", "saldo_insuficiente")
+OUT_OF_STOCK = ("esgotado",)
+DAY_MINUTES = 24 * 60
+DEFAULT_WINDOW_MINUTES = 10
+
+
+def _stock_state(status: str, codigos: int | None) -> str | None:
+    if status in IN_STOCK or (codigos or 0) > 0:
+        return "in"
+    if status in OUT_OF_STOCK:
+        return "out"
+    return None  # login / error: says nothing about stock
+
+
+class RestockLog:
+    """Transitions appended to `path` (None = memory only, `self.records`)."""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.records = []
+        self._last = {}  # name -> (state, codigos, last seen in that state)
+        self._lock = threading.Lock()
+
+    def load(self) -> list:
+        self.records = []
+        if self.path is not None:
+            try:
+                with open(self.path) as f:
+                    for line in f:
+                        try:
+                            self.records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+            except FileNotFoundError:
+                pass
+        for rec in self.records:
+            self._last[rec["name"]] = (rec["state"], rec.get("codigos"),
+                                       rec["ts"])
+        return self.records
+
+    def observe(self, name: str, status: str, codigos: int | None = None,
+                at: datetime | None = None) -> dict | None:
+        """Note one check of `name`. Returns the transition record if this
+        check changed the target's stock state or code count."""
+        state = _stock_state(status, codigos)
+        if state is None:
+            return None
+        ts = (at or datetime.now()).isoformat(timespec="seconds")
+        with self._lock:
+            prev = self._last.get(name)
+            if prev is not None and prev[0] == state and (
+                    codigos is None or prev[1] is None or prev[1] == codigos):
+                self._last[name] = (state, codigos if codigos is not None
+                                    else prev[1], ts)
+                return None
+            rec = {"ts": ts, "name": name, "state": state, "status": status,
+                   "codigos": codigos,
+                   "prev_state": prev[0] if prev else None,
+                   "prev_codigos": prev[1] if prev else None,
+                   "since": prev[2] if prev else None}
+            self._last[name] = (state, codigos, ts)
+            self.records.append(rec)
+            if self.path is not None:
+                try:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    log(f"Could not write {self.path}: {e}", "WARN")
+        if rec["prev_state"] is not None:
+            counts = (f", codigos {rec['prev_codigos']} → {codigos}"
+                      if codigos is not None else "")
+            log(f"[{name}] Stock {rec['prev_state']} → {state}{counts} "
+                f"(last seen {rec['prev_state']} {rec['since']})")
+        return rec
+
+
+def restock_intervals(records: list, name: str) -> list:
+    """(earliest, latest) datetime bounds of every restock of `name`: a
+    sold out → in stock transition, or a rising code count."""
+    intervals = []
+    for rec in records:
+        if rec["name"] != name or rec.get("since") is None:
+            continue
+        restocked = (rec.get("prev_state") == "out" and rec["state"] == "in") \
+            or (rec["state"] == "in" and rec.get("codigos") is not None
+                and rec.get("prev_codigos") is not None
+                and rec["codigos"] > rec["prev_codigos"])
+        if restocked:
+            intervals.append((datetime.fromisoformat(rec["since"]),
+                              datetime.fromisoformat(rec["ts"])))
+    return intervals
+
+
+def restock_density(intervals: list) -> list:
+    """Probability mass per minute of the day (1440 floats summing to 1,
+    or all zeros without data). Each restock is spread evenly over its
+    interval, wrapped onto the clock; 24h or longer means "any time"."""
+    density = [0.0] * DAY_MINUTES
+    for start, end in intervals:
+        span = int((end - start).total_seconds() // 60)
+        if span >= DAY_MINUTES:
+            for m in range(DAY_MINUTES):
+                density[m] += 1 / DAY_MINUTES
+            continue
+        first = start.hour * 60 + start.minute
+        for i in range(span + 1):
+            density[(first + i) % DAY_MINUTES] += 1 / (span + 1)
+    total = sum(density)
+    return [d / total for d in density] if total else density
+
+
+def _minutes(slot: str) -> int:
+    h, m = slot.strip().split(":")
+    return int(h) * 60 + int(m)
+
+
+def _covered(slots_min: list, window: int) -> set:
+    covered = set()
+    for s in slots_min:
+        covered.update(range(max(0, s - window), s + 1))
+    return covered
+
+
+def expected_hit_rate(density: list, slots: list, window_minutes: int) -> float:
+    """Share of restocks an attempt would catch, assuming a restock at
+    minute r is still claimable by an attempt at s when 0 ≤ s − r ≤ window
+    (codes last about `window_minutes` before faster users take them)."""
+    covered = _covered([_minutes(s) for s in slots], window_minutes)
+    return sum(density[m] for m in covered)
+
+
+def choose_slots(density: list, budget: int, window_minutes: int) -> list:
+    """Greedily pick up to `budget` 'HH:MM' slots, each adding the most
+    not-yet-covered restock mass. Sorted; empty without data."""
+    chosen, covered = [], set()
+    for _ in range(budget):
+        best, best_gain = None, 0.0
+        for s in range(DAY_MINUTES):
+            gain = sum(density[m] for m in range(max(0, s - window_minutes),
+                                                 s + 1) if m not in covered)
+            if gain > best_gain + 1e-12:
+                best, best_gain = s, gain
+        if best is None:
+            break
+        chosen.append(best)
+        covered |= _covered([best], window_minutes)
+    return [f"{s // 60:02d}:{s % 60:02d}" for s in sorted(chosen)]
+
+
+def exploration_slots(static_slots: list, learned: list, count: int,
+                      day: date) -> list:
+    """`count` of the static slots not already learned, taken in a rotation
+    that advances by one each day, so every static slot keeps being tried."""
+    rest = [s for s in static_slots if s not in learned]
+    if not rest:
+        return []
+    start = day.toordinal() % len(rest)
+    return (rest[start:] + rest[:start])[:count]
+
+
+def learned_slots(records: list, names: list, budget: int,
+                  window_minutes: int, min_events: int,
+                  static_slots: list = (), explore: int = 0,
+                  day: date | None = None) -> dict:
+    """{name: slots} for every target with at least `min_events` restocks
+    observed; others are left out (caller keeps the static slots). Up to
+    `explore` of the `budget` slots (always leaving one learned) are
+    exploration_slots from `static_slots` for `day`."""
+    explore = min(explore, budget - 1, len(static_slots))
+    slots = {}
+    for name in names:
+        intervals = restock_intervals(records, name)
+        if len(intervals) >= min_events:
+            learned = choose_slots(restock_density(intervals),
+                                   budget - explore, window_minutes)
+            extra = exploration_slots(static_slots, learned, explore,
+                                      day or date.today())
+            slots[name] = sorted(set(learned) | set(extra))
+    return slots
+
+
+def format_report(records: list, static_slots: list, budget: int,
+                  window_minutes: int) -> str:
+    names = list(dict.fromkeys(r["name"] for r in records))
+    lines = []
+    for name in names:
+        intervals = restock_intervals(records, name)
+        lines.append(f"{name}: {len(intervals)} restock(s) observed")
+        if not intervals:
+            lines.append("")
+            continue
+        density = restock_density(intervals)
+        for h in range(24):
+            mass = sum(density[h * 60:(h + 1) * 60])
+            if mass >= 0.005:
+                lines.append(f"  {h:02d}:00  {mass * 100:5.1f}%  "
+                             f"{'#' * round(mass * 50)}")
+        learned = choose_slots(density, budget, window_minutes)
+        lines.append(f"  static  {', '.join(static_slots)}: expected hit rate "
+                     f"{expected_hit_rate(density, static_slots, window_minutes):.0%}")
+        lines.append(f"  learned {', '.join(learned)}: expected hit rate "
+                     f"{expected_hit_rate(density, learned, window_minutes):.0%}")
+        lines.append("")
+    return "\n".join(lines) if lines else "no restocks observed yet"
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "/data/restock.jsonl"
+    static = sys.argv[2:] or ["08:05", "08:35", "09:05"]
+    records = RestockLog(path).load()
+    print(f"{len(records)} transition(s) from {path}; "
+          f"window {DEFAULT_WINDOW_MINUTES} min, budget {len(static)}\n")
+    print(format_report(records, static, len(static), DEFAULT_WINDOW_MINUTES))
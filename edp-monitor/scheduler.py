@@ -0,0 +1,176 @@
+# scheduler.py — timed job queue for EDP Voucher Monitor
+"""
+A priority queue of jobs due at local wall-clock times (attempt slots are
+"08:05 local"), waited on with the monotonic clock. Stdlib only.
+
+Due times are naive local datetimes and are compared as epoch timestamps,
+so a DST change never shifts a job: a slot inside the skipped spring hour
+fires as soon as the clock has passed it, and one inside the repeated
+autumn hour fires once. Waits are chunked (at most `max_sleep` seconds) and
+each chunk compares wall-clock progress against monotonic progress, so an
+NTP step or manual clock change is noticed and the plan recomputed within
+one chunk.
+
+Jobs are either strict (must not run before they are due, e.g. a claim
+attempt at a restock slot) or flexible (maintenance that may run up to
+`coalesce_seconds` early or late). Jobs falling within that window are
+handed out together as one batch, so one page load can serve several.
+How late each batch started is kept in `last_drift`.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+from helpers import FINAL_APPROACH_SECONDS, log, wait_until_epoch
+
+CLOCK_JUMP_TOLERANCE = 2.0  # seconds of wall vs monotonic disagreement
+
+
+class Job:
+    """One scheduled unit of work. `key` identifies it for replacement and
+    cancellation (defaults to `kind`); `payload` is for the handler."""
+
+    __slots__ = ("due", "ts", "kind", "key", "payload", "strict", "seq",
+                 "cancelled")
+
+    def __init__(self, due: datetime, kind: str, key=None, payload=None,
+                 strict: bool = False, seq: int = 0):
+        self.due = due
+        self.ts = due.timestamp()
+        self.kind = kind
+        self.key = kind if key is None else key
+        self.payload = payload
+        self.strict = strict
+        self.seq = seq
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.ts, self.seq) < (other.ts, other.seq)
+
+    def __repr__(self):
+        return (f"Job({self.key!r} at {self.due:%Y-%m-%d %H:%M:%S}"
+                f"{', strict' if self.strict else ''})")
+
+
+class Scheduler:
+    """Thread-safe: jobs may be scheduled from other threads while the
+    owner blocks in next_batch(), which then re-plans immediately."""
+
+    def __init__(self, coalesce_seconds: float = 5.0, max_sleep: float = 60.0,
+                 clock=time.time):
+        self.coalesce_seconds = coalesce_seconds
+        self.max_sleep = max_sleep
+        self.clock = clock
+        self._heap = []
+        self._by_key = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self.last_drift = None
+
+    def schedule(self, due: datetime, kind: str, key=None, payload=None,
+                 strict: bool = False) -> Job:
+        """Queue a job, replacing any pending job with the same key."""
+        job = Job(due, kind, key, payload, strict, next(self._seq))
+        with self._lock:
+            old = self._by_key.get(job.key)
+            if old is not None:
+                old.cancelled = True
+            self._by_key[job.key] = job
+            heapq.heappush(self._heap, job)
+        self._changed.set()
+        return job
+
+    def cancel(self, key) -> bool:
+        with self._lock:
+            job = self._by_key.pop(key, None)
+            if job is None:
+                return False
+            job.cancelled = True
+        self._changed.set()
+        return True
+
+    def wake(self) -> None:
+        """Make a blocked next_batch() re-check its `stop` event now."""
+        self._changed.set()
+
+    def pending(self, kinds=None) -> list:
+        """Pending jobs in due order, optionally only those of `kinds`."""
+        with self._lock:
+            jobs = sorted(self._by_key.values())
+        return [j for j in jobs if kinds is None or j.kind in kinds]
+
+    def peek(self, kinds=None) -> Job | None:
+        jobs = self.pending(kinds)
+        return jobs[0] if jobs else None
+
+    def next_batch(self, stop: threading.Event | None = None) -> list:
+        """Block until the next batch is due and return it (due order).
+
+        Returns [] if `stop` is set first or nothing is scheduled.
+        """
+        while stop is None or not stop.is_set():
+            with self._lock:
+                self._changed.clear()
+                plan = self._plan()
+            if plan is None:
+                return []
+            run_at, batch = plan
+            if self._wait_until(run_at, stop):
+                self.last_drift = self.clock() - run_at
+                with self._lock:
+                    batch = [j for j in batch if not j.cancelled]
+                    for job in batch:
+                        job.cancelled = True  # taken: no longer pending
+                        if self._by_key.get(job.key) is job:
+                            del self._by_key[job.key]
+                    return batch
+        return []
+
+    def _plan(self):
+        """(run at, jobs) for the earliest batch. A flexible head job waits
+        for strict jobs due within the window; flexible jobs due within the
+        window after the run time are pulled forward into it."""
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        window = self.coalesce_seconds
+        head_ts = self._heap[0].ts
+        # Nothing past head + 2 windows can join this batch
+        jobs = sorted(j for j in self._heap if not j.cancelled
+                      and j.ts <= head_ts + 2 * window)
+        run_ts = head_ts
+        for job in jobs:
+            if job.ts > head_ts + window:
+                break
+            if job.strict:
+                run_ts = max(run_ts, job.ts)
+        batch = [j for j in jobs
+                 if j.ts <= run_ts or (not j.strict and j.ts <= run_ts + window)]
+        return run_ts, batch
+
+    def _wait_until(self, run_ts: float, stop) -> bool:
+        """Sleep towards epoch time `run_ts` in chunks. Returns True once it
+        is reached, False if the queue changed or the wall clock jumped
+        (caller re-plans) or `stop` was set. The final approach is
+        wait_until_epoch's monotonic one, so strict jobs start on time."""
+        while True:
+            remaining = run_ts - self.clock()
+            if remaining <= FINAL_APPROACH_SECONDS:
+                return wait_until_epoch(run_ts, self._changed,
+                                        clock=self.clock) is not None
+            chunk = min(remaining - FINAL_APPROACH_SECONDS, self.max_sleep)
+            wall0, mono0 = self.clock(), time.monotonic()
+            if self._changed.wait(chunk):
+                return False
+            if stop is not None and stop.is_set():
+                return False
+            jump = (self.clock() - wall0) - (time.monotonic() - mono0)
+            if abs(jump) > CLOCK_JUMP_TOLERANCE:
+                log(f"Wall clock jumped {jump:+.0f}s — re-planning "
+                    "scheduled jobs", "WARN")
+                return False
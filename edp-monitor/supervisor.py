@@ -0,0 +1,204 @@
+# supervisor.py — watchdog and recovery for the monitor's browser
+"""
+Every Selenium step used to run inline in the main loop. A hung chromedriver
+call (a renderer freeze inside driver.get) stalled the monitor indefinitely,
+and after a Chrome crash every following step failed on the same dead
+session.
+
+BrowserSupervisor runs each step in a worker thread with a deadline. If the
+deadline passes, the browser's process tree is killed, which also unblocks
+the stuck call. If the step fails because the session is gone, the browser
+is relaunched and the step retried once, unless the step isn't safe to
+repeat (a claim that may already have gone through). A CircuitBreaker stops
+relaunch storms: after `threshold` recoveries in a row it fails steps fast
+for `cooldown` seconds, then lets one step through to probe.
+
+The session is duck-typed (BrowserSession): `driver`, `launch()` -> bool
+and `kill()`. Stdlib only.
+"""
+
+import threading
+import time
+
+from helpers import log
+
+# Exception class names and message fragments meaning "this WebDriver
+# session is gone" (crashed or killed Chromium, dead chromedriver), as
+# opposed to a page that merely misbehaved.
+DEAD_SESSION_TYPES = (
+    "InvalidSessionIdException", "MaxRetryError", "NewConnectionError",
+    "ProtocolError", "RemoteDisconnected", "ConnectionRefusedError",
+    "ConnectionResetError", "BrokenPipeError",
+)
+DEAD_SESSION_MARKERS = (
+    "invalid session id", "session deleted", "chrome not reachable",
+    "disconnected:", "target crashed", "tab crashed",
+    "target window already closed", "connection refused",
+    "max retries exceeded", "remote end closed connection",
+    "browser not running",
+)
+# Raised when the page navigated under a script (chromedriver's and the CDP
+# backend's wording): the session is fine, the document just changed.
+NAVIGATION_TYPES = ("StaleElementReferenceException",)
+NAVIGATION_MARKERS = (
+    "document unloaded", "execution context was destroyed",
+    "cannot find context with specified id", "promise was collected",
+)
+
+
+class StepTimeout(Exception):
+    """A supervised step overran its deadline (the browser was killed)."""
+
+
+class BrowserUnavailable(Exception):
+    """The browser couldn't be (re)started, or the circuit is open."""
+
+
+def is_dead_session(exc: BaseException) -> bool:
+    """True if `exc` (or anything it was raised from) says the WebDriver
+    session itself is gone."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, StepTimeout):
+            return True
+        if type(exc).__name__ in DEAD_SESSION_TYPES:
+            return True
+        text = str(exc).lower()
+        if any(marker in text for marker in DEAD_SESSION_MARKERS):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def is_navigation_error(exc: BaseException) -> bool:
+    """True if `exc` only says the document went away under the call (a
+    navigation), so the call can be repeated on the new one. Never true
+    for a dead session."""
+    if is_dead_session(exc):
+        return False
+    if type(exc).__name__ in NAVIGATION_TYPES:
+        return True
+    text = str(exc).lower()
+    return any(marker in text for marker in NAVIGATION_MARKERS)
+
+
+class CircuitBreaker:
+    """closed → (threshold failures in a row) → open for `cooldown`
+    seconds → half-open: one trial; success closes, failure re-opens."""
+
+    def __init__(self, threshold: int = 3, cooldown: float = 600,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            log("Browser circuit closed again")
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = self.clock()
+            log(f"Browser circuit open after {self.failures} failed "
+                f"recover{'y' if self.failures == 1 else 'ies'}: browser "
+                f"steps fail fast for {self.cooldown:.0f}s", "ERROR")
+
+
+class BrowserSupervisor:
+    """Runs steps against `session` with per-step deadlines (seconds, by
+    step name; `default_deadline` for the rest) and transparent recovery."""
+
+    def __init__(self, session, deadlines: dict | None = None,
+                 default_deadline: float = 60,
+                 breaker: CircuitBreaker | None = None,
+                 kill_grace: float = 5):
+        self.session = session
+        self.deadlines = deadlines or {}
+        self.default_deadline = default_deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.kill_grace = kill_grace
+        self.recoveries = 0
+
+    def run(self, step: str, fn, *args, retry: bool = True,
+            deadline: float | None = None):
+        """Return fn(*args), run under the step's deadline.
+
+        On a timeout or dead session the browser is relaunched and, if
+        `retry`, fn run once more. Raises BrowserUnavailable if the browser
+        can't be brought back (or the circuit is open), StepTimeout /
+        the step's own exception otherwise.
+        """
+        if deadline is None:
+            deadline = self.deadlines.get(step, self.default_deadline)
+        attempts = 2 if retry else 1
+        for attempt in range(1, attempts + 1):
+            if not self.breaker.allow():
+                raise BrowserUnavailable(f"{step}: browser circuit open")
+            if self.session.driver is None:
+                self._relaunch(step)
+            try:
+                result = self._call(step, fn, args, deadline)
+            except Exception as e:
+                if not is_dead_session(e):
+                    raise
+                log(f"Browser step '{step}' failed on a dead session "
+                    f"({type(e).__name__}: {str(e)[:120]}) — recovering",
+                    "WARN")
+                if not isinstance(e, StepTimeout):  # else already killed
+                    self.session.kill()
+                self.breaker.failure()
+                if attempt == attempts:
+                    raise
+                continue
+            self.breaker.success()
+            return result
+
+    def _call(self, step: str, fn, args: tuple, deadline: float):
+        outcome = {}
+
+        def target():
+            try:
+                outcome["value"] = fn(*args)
+            except BaseException as e:
+                outcome["error"] = e
+        worker = threading.Thread(target=target, name=f"step-{step}",
+                                  daemon=True)
+        started = time.monotonic()
+        worker.start()
+        worker.join(deadline)
+        if worker.is_alive():
+            log(f"Browser step '{step}' still running after {deadline:.0f}s "
+                "— killing the browser", "ERROR")
+            self.session.kill()
+            worker.join(self.kill_grace)  # the stuck call errors out now
+            raise StepTimeout(f"{step} exceeded {deadline:.0f}s "
+                              f"(ran {time.monotonic() - started:.1f}s)")
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("value")
+
+    def _relaunch(self, step: str) -> None:
+        self.recoveries += 1
+        log(f"Relaunching the browser for '{step}' "
+            f"(recovery #{self.recoveries})", "WARN")
+        if self.session.launch():
+            return
+        self.breaker.failure()
+        raise BrowserUnavailable(f"{step}: browser relaunch failed")
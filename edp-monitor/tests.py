@@ -1,12 +1,17 @@
 # tests.py — stdlib-only test runner for helpers.py
 """
 Run with: python3 tests.py
-Tests only the pure logic in helpers.py (no Selenium, no requests).
+Tests the pure logic in helpers.py (no Selenium). The few tests that need
+`requests` raise SkipTest when it isn't installed.
 """
 
 import sys
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
+
+
+class SkipTest(Exception):
+    """Raised by a test whose optional dependency isn't available."""
 
 
 def run_all_tests():
@@ -17,6 +22,8 @@ def run_all_tests():
         try:
             fn()
             print(f"PASS  {name}")
+        except SkipTest as e:
+            print(f"SKIP  {name}: {e}")
         except AssertionError as e:
             failed += 1
             print(f"FAIL  {name}: {e}")
@@ -60,7 +67,7 @@ def test_parse_attempt_time_invalid_raises():
 
 import io
 import contextlib
-from helpers import log
+from helpers import log, set_log_label
 
 
 def test_log_default_level_info():
@@ -79,6 +86,18 @@ def test_log_custom_level():
     assert out == "[2026-04-30 22:15:30] [ERROR] oops\n", repr(out)
 
 
+def test_log_account_label():
+    buf = io.StringIO()
+    try:
+        set_log_label("Casa")
+        with contextlib.redirect_stdout(buf):
+            log("hello", _now=datetime(2026, 4, 30, 22, 15, 30))
+    finally:
+        set_log_label("")
+    out = buf.getvalue()
+    assert out == "[2026-04-30 22:15:30] [INFO] [Casa] hello\n", repr(out)
+
+
 from helpers import parse_voucher_status
 
 
@@ -133,6 +152,98 @@ def test_status_disponivel_overrides_zero_codigos_when_btn_enabled():
     assert available is True and status == "disponivel", (available, status)
 
 
+from helpers import snapshot_from_text
+
+SNAP_BASE = {"url": "https://x/beneficios/detalhe/1", "button_present": True,
+             "button_disabled": True, "codigos": None, "login": False,
+             "saldo": False, "esgotado": False}
+
+
+def test_snapshot_from_text_extracts_markers():
+    snap = snapshot_from_text("Códigos disponíveis: 3 Saldo insuficiente",
+                              button_disabled=True, url="u")
+    assert snap == {"url": "u", "button_present": True,
+                    "button_disabled": True, "codigos": 3, "login": False,
+                    "saldo": True, "esgotado": False}, snap
+
+
+def test_snapshot_from_text_missing_button_counts_as_disabled():
+    snap = snapshot_from_text("x" * 600, button_disabled=False,
+                              button_present=False)
+    assert snap["button_disabled"] is True, snap
+
+
+def test_snapshot_from_text_explicit_count_wins():
+    snap = snapshot_from_text("Códigos disponíveis: 3", codigos_disponiveis=0)
+    assert snap["codigos"] == 0, snap
+
+
+def test_status_from_snapshot_disponivel():
+    snap = {**SNAP_BASE, "button_disabled": False, "codigos": 2}
+    assert parse_voucher_status(snap) == (True, "disponivel")
+
+
+def test_status_from_snapshot_login_wins():
+    snap = {**SNAP_BASE, "button_disabled": False, "login": True}
+    assert parse_voucher_status(snap) == (None, "precisa_login")
+
+
+def test_status_from_snapshot_saldo_before_esgotado():
+    snap = {**SNAP_BASE, "saldo": True, "esgotado": True}
+    assert parse_voucher_status(snap) == (False, "saldo_insuficiente")
+
+
+def test_status_from_snapshot_zero_codes():
+    snap = {**SNAP_BASE, "codigos": 0}
+    assert parse_voucher_status(snap) == (False, "esgotado")
+
+
+def test_status_from_snapshot_uncertain():
+    assert parse_voucher_status(SNAP_BASE) == (None, "erro: estado_incerto")
+
+
+from helpers import card_looks_available, match_pack_cards
+
+PACK_CARDS = [
+    {"index": 0, "text": "Restaurantes\nDomino's Pizzas\n5 €", "href": None},
+    {"index": 1, "text": "Dia-a-dia\nPingo Doce\n10 €", "href": None},
+    {"index": 2, "text": "Dia-a-dia\nPingo Doce Online\nEsgotado", "href": None},
+]
+
+
+def test_match_pack_cards_first_match_wins():
+    got = match_pack_cards(PACK_CARDS, ["Pingo Doce"])
+    assert got["Pingo Doce"]["index"] == 1, got
+
+
+def test_match_pack_cards_case_insensitive_multiple_names():
+    got = match_pack_cards(PACK_CARDS, ["pingo doce", "DOMINO'S"])
+    assert got["pingo doce"]["index"] == 1, got
+    assert got["DOMINO'S"]["index"] == 0, got
+
+
+def test_match_pack_cards_missing_name_absent():
+    got = match_pack_cards(PACK_CARDS, ["Continente"])
+    assert got == {}, got
+
+
+def test_match_pack_cards_tolerates_missing_text():
+    got = match_pack_cards([{"index": 0, "text": None}], ["Pingo Doce"])
+    assert got == {}, got
+
+
+def test_card_looks_available_plain_card():
+    assert card_looks_available("Dia-a-dia\nPingo Doce\n10 €") is True
+
+
+def test_card_looks_available_esgotado():
+    assert card_looks_available("Pingo Doce ESGOTADO") is False
+
+
+def test_card_looks_available_volte_no_proximo():
+    assert card_looks_available("Volte no próximo mês") is False
+
+
 from helpers import (
     compute_next_wakeup,
     load_history,
@@ -306,6 +417,406 @@ def test_should_run_immediately_no_when_all_claimed_this_month():
     assert should_run_immediately(now, history, TARGETS_ONE, 1) is False
 
 
+from helpers import parse_api_voucher
+
+
+def test_api_voucher_enabled_is_disponivel():
+    got = parse_api_voucher({"canGenerate": True, "codigosDisponiveis": 3})
+    assert got == (True, "disponivel"), got
+
+
+def test_api_voucher_zero_codes_is_esgotado():
+    got = parse_api_voucher({"canGenerate": False, "availableCodes": 0})
+    assert got == (False, "esgotado"), got
+
+
+def test_api_voucher_sold_out_flag():
+    got = parse_api_voucher({"soldOut": True})
+    assert got == (False, "esgotado"), got
+
+
+def test_api_voucher_insufficient_balance_flag():
+    got = parse_api_voucher({"canGenerate": False, "saldoInsuficiente": True,
+                             "stock": 4})
+    assert got == (False, "saldo_insuficiente"), got
+
+
+def test_api_voucher_unknown_shape_is_uncertain():
+    assert parse_api_voucher({"foo": 1}) == (None, "erro: estado_incerto")
+    assert parse_api_voucher([1, 2]) == (None, "erro: estado_incerto")
+
+
+def test_api_voucher_bool_is_not_a_code_count():
+    got = parse_api_voucher({"stock": False, "canGenerate": False})
+    assert got == (None, "erro: estado_incerto"), got
+
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _serve(handler_cls):
+    """Start `handler_cls` on an ephemeral localhost port in a daemon thread.
+    Returns (server, base_url); caller shuts the server down."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class _VoucherApiStandIn(BaseHTTPRequestHandler):
+    """Stand-in for the portal's voucher endpoint: needs cookie session=ok,
+    otherwise redirects to an HTML login page like the real portal."""
+
+    stock = {"1197": {"canGenerate": True, "codigosDisponiveis": 2},
+             "1199": {"canGenerate": False, "codigosDisponiveis": 0}}
+
+    def do_GET(self):
+        if self.path == "/login":
+            body, ctype = b"<html>Iniciar sessao</html>", "text/html"
+        elif "session=ok" not in self.headers.get("Cookie", ""):
+            self.send_response(302)
+            self.send_header("Location", "/login")
+            self.end_headers()
+            return
+        else:
+            partner = self.path.rsplit("/", 1)[-1]
+            body = json.dumps(self.stock.get(partner, {})).encode()
+            ctype = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _http_checker_or_skip():
+    try:
+        import requests  # noqa: F401
+    except ImportError as e:
+        raise SkipTest(f"requests not installed ({e})")
+    from http_checker import HttpChecker
+    return HttpChecker
+
+
+def test_http_checker_against_stand_in_server():
+    HttpChecker = _http_checker_or_skip()
+    server, base = _serve(_VoucherApiStandIn)
+    try:
+        checker = HttpChecker(base + "/api/vouchers/{partner_id}")
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            assert checker.check(TARGETS_ONE[0]) == (None, "precisa_login")
+            checker.load_cookies([{"name": "session", "value": "ok",
+                                   "domain": "127.0.0.1", "path": "/"}])
+            assert checker.check(TARGETS_TWO[0]) == (True, "disponivel")
+            assert checker.check(TARGETS_TWO[1]) == (False, "esgotado")
+    finally:
+        server.shutdown()
+
+
+def test_http_checker_reports_an_unknown_shape_once():
+    HttpChecker = _http_checker_or_skip()
+    server, base = _serve(_VoucherApiStandIn)
+    try:
+        checker = HttpChecker(base + "/api/vouchers/{partner_id}")
+        checker.load_cookies([{"name": "session", "value": "ok",
+                               "domain": "127.0.0.1", "path": "/"}])
+        target = {"name": "Unknown", "partner_id": "9999"}
+        buf = io.StringIO()
+        with contextlib.redirect_stdout(buf):
+            for _ in range(3):
+                assert checker.check(target) == (None, "erro: estado_incerto")
+        assert buf.getvalue().count("experimental parser") == 1, buf.getvalue()
+        assert checker.unrecognised == {}
+    finally:
+        server.shutdown()
+
+
+def test_http_checker_connection_error_is_erro():
+    HttpChecker = _http_checker_or_skip()
+    server, base = _serve(_VoucherApiStandIn)
+    server.shutdown()
+    server.server_close()
+    checker = HttpChecker(base + "/api/vouchers/{partner_id}", timeout=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        available, status = checker.check(TARGETS_ONE[0])
+    assert available is None and status.startswith("erro: http"), status
+
+
+class _NtfyStandIn(BaseHTTPRequestHandler):
+    """Stand-in for ntfy.sh: records every POST; answers with the status
+    codes queued in `fail_with` first, then 200."""
+
+    received = []
+    fail_with = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = self.fail_with.pop(0) if self.fail_with else 200
+        if status == 200:
+            self.received.append((self.path, self.headers["Title"],
+                                  body.decode("utf-8")))
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+def _notifier_or_skip():
+    try:
+        import requests  # noqa: F401
+    except ImportError as e:
+        raise SkipTest(f"requests not installed ({e})")
+    from notifier import Notifier
+    return Notifier
+
+
+def _ntfy_stand_in(fail_with=()):
+    handler = type("_Ntfy", (_NtfyStandIn,),
+                   {"received": [], "fail_with": list(fail_with)})
+    server, base = _serve(handler)
+    return server, base, handler
+
+
+def test_notifier_sends_in_background():
+    Notifier = _notifier_or_skip()
+    server, base, ntfy = _ntfy_stand_in()
+    with tempfile.TemporaryDirectory() as d:
+        outbox = os.path.join(d, "outbox.json")
+        notifier = Notifier(base, outbox)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                notifier.start()
+                notifier.send("edp-test", "EDP Monitor - Código",
+                              "Pingo Doce: ABC123 (válido até 31/05)")
+                notifier.send("edp-test", "EDP Monitor", "segunda")
+                assert notifier.flush(5)
+        finally:
+            notifier.stop()
+            server.shutdown()
+        assert ntfy.received == [
+            ("/edp-test", "EDP Monitor - Código",
+             "Pingo Doce: ABC123 (válido até 31/05)"),
+            ("/edp-test", "EDP Monitor", "segunda"),
+        ]
+        with open(outbox) as f:
+            assert json.load(f) == {}
+
+
+def test_notifier_retries_with_backoff():
+    Notifier = _notifier_or_skip()
+    server, base, ntfy = _ntfy_stand_in(fail_with=[503, 429])
+    notifier = Notifier(base, retry_delays=(0.05, 0.1))
+    buf = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(buf):
+            notifier.start()
+            notifier.send("edp-test", "EDP Monitor", "hello")
+            assert notifier.flush(5)
+    finally:
+        notifier.stop()
+        server.shutdown()
+    assert [r[2] for r in ntfy.received] == ["hello"]
+    assert "attempt 2" in buf.getvalue()
+
+
+def test_notifier_drops_rejected_message():
+    Notifier = _notifier_or_skip()
+    server, base, ntfy = _ntfy_stand_in(fail_with=[400])
+    notifier = Notifier(base, retry_delays=(0.05,))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            notifier.start()
+            notifier.send("bad topic", "EDP Monitor", "x")
+            assert notifier.flush(5)
+    finally:
+        notifier.stop()
+        server.shutdown()
+    assert ntfy.received == []
+
+
+def test_notifier_outbox_survives_restart():
+    Notifier = _notifier_or_skip()
+    server, base, ntfy = _ntfy_stand_in()
+    down, down_base = _serve(_NtfyStandIn)
+    down.shutdown()
+    down.server_close()
+    with tempfile.TemporaryDirectory() as d:
+        outbox = os.path.join(d, "outbox.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            first = Notifier(down_base, outbox, timeout=1,
+                             retry_delays=(60,))
+            first.start()
+            first.send("edp-test", "EDP Monitor - Código", "XYZ789")
+            assert not first.flush(0.5)
+            first.stop()
+            with open(outbox) as f:
+                saved = list(json.load(f).values())
+            assert [m["message"] for m in saved] == ["XYZ789"]
+            assert saved[0]["attempts"] >= 1
+
+            second = Notifier(base, outbox)
+            try:
+                second.start()
+                assert second.flush(5)
+            finally:
+                second.stop()
+                server.shutdown()
+    assert [r[2] for r in ntfy.received] == ["XYZ789"]
+
+
+import subprocess
+
+WITHOUT_REQUESTS = """
+import sys
+sys.modules["requests"] = sys.modules["requests.adapters"] = None
+import ha_publisher, http_checker, notifier
+n = notifier.Notifier("http://127.0.0.1:9")
+n.start()
+assert n.send("t", "title", "body") == "" and n.flush(0)
+p = ha_publisher.StatePublisher("http://127.0.0.1:9", "token")
+p.start()
+assert p._thread is None
+try:
+    http_checker.HttpChecker("http://127.0.0.1:9/{partner_id}")
+    raise SystemExit("HttpChecker built without requests")
+except ImportError:
+    pass
+"""
+
+
+def test_http_modules_import_without_requests():
+    result = subprocess.run([sys.executable, "-c", WITHOUT_REQUESTS],
+                            capture_output=True, text=True, timeout=30,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert "notifications disabled" in result.stdout, result.stdout
+
+
+from helpers import cached_detail_url, load_catalog, save_catalog_entry
+
+DETAIL_URL = "https://particulares.cliente.edp.pt/beneficios/detalhe/abc-1197"
+
+
+def test_catalog_save_then_load_roundtrip():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "catalog.json")
+        save_catalog_entry(path, "Pingo Doce", 1197, DETAIL_URL,
+                           datetime(2026, 5, 4, 8, 5, 3))
+        save_catalog_entry(path, "Domino's", 1199, DETAIL_URL + "x",
+                           datetime(2026, 5, 4, 8, 5, 4))
+        c = load_catalog(path)
+        assert c["Pingo Doce"] == {"partner_id": 1197, "url": DETAIL_URL,
+                                   "resolved_at": "2026-05-04T08:05:03"}, c
+        assert c["Domino's"]["url"] == DETAIL_URL + "x"
+
+
+def test_catalog_load_missing_returns_empty():
+    assert load_catalog("/nonexistent/path/catalog.json") == {}
+
+
+def test_cached_detail_url_hit():
+    catalog = {"Pingo Doce": {"partner_id": 1197, "url": DETAIL_URL}}
+    assert cached_detail_url(catalog, TARGETS_ONE[0]) == DETAIL_URL
+
+
+def test_cached_detail_url_miss():
+    assert cached_detail_url({}, TARGETS_ONE[0]) is None
+
+
+def test_cached_detail_url_partner_id_changed_invalidates():
+    catalog = {"Pingo Doce": {"partner_id": 9999, "url": DETAIL_URL}}
+    assert cached_detail_url(catalog, TARGETS_ONE[0]) is None
+
+
+def test_cached_detail_url_rejects_non_detail_url():
+    catalog = {"Pingo Doce": {"partner_id": 1197,
+                              "url": "https://x/beneficios/pack"}}
+    assert cached_detail_url(catalog, TARGETS_ONE[0]) is None
+
+
+from helpers import sleep_until
+import time
+
+
+def test_sleep_until_past_target_returns_immediately():
+    started = time.monotonic()
+    sleep_until(datetime(2000, 1, 1))
+    assert time.monotonic() - started < 0.1
+
+
+def test_sleep_until_lead_returns_early():
+    from datetime import timedelta
+    started = time.monotonic()
+    sleep_until(datetime.now() + timedelta(seconds=30), lead_seconds=30)
+    assert time.monotonic() - started < 0.1
+
+
+def test_sleep_until_lead_sleeps_remaining():
+    from datetime import timedelta
+    started = time.monotonic()
+    sleep_until(datetime.now() + timedelta(seconds=10.2), lead_seconds=10)
+    elapsed = time.monotonic() - started
+    assert 0.1 < elapsed < 0.5, elapsed
+
+
+from helpers import wait_until_epoch
+
+
+def test_sleep_until_wakes_within_milliseconds():
+    from datetime import timedelta
+    drifts = []
+    for _ in range(5):
+        target = datetime.now() + timedelta(seconds=0.25)
+        drifts.append(sleep_until(target))
+    assert all(-0.001 <= d < 0.02 for d in drifts), drifts
+
+
+def test_sleep_until_cancel():
+    from datetime import timedelta
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    started = time.monotonic()
+    assert sleep_until(datetime.now() + timedelta(seconds=30),
+                       cancel=cancel) is None
+    assert time.monotonic() - started < 1
+
+
+def test_wait_until_epoch_rechecks_wall_clock_each_chunk():
+    # The wall clock steps 10s forward while we're in a coarse chunk: the
+    # next re-read notices the target has passed and returns late, not 10s
+    # later.
+    offset = [0.0]
+    clock = lambda: time.time() + offset[0]
+    threading.Timer(0.1, lambda: offset.__setitem__(0, 10.0)).start()
+    started = time.monotonic()
+    drift = wait_until_epoch(clock() + 5, max_chunk=0.2, clock=clock)
+    assert time.monotonic() - started < 1
+    assert drift > 4
+
+
+from helpers import desktop_user_agent
+
+
+def test_desktop_user_agent_from_chromium_version():
+    ua = desktop_user_agent("Chromium 126.0.6478.126 Alpine Linux\n")
+    assert ua == ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"), ua
+    assert "Headless" not in ua
+
+
+def test_desktop_user_agent_unparseable():
+    assert desktop_user_agent("") is None
+    assert desktop_user_agent("chromium: not found") is None
+
+
 from helpers import parse_validity_to_month, find_claimed_targets
 
 
@@ -395,5 +906,1870 @@ def test_should_run_immediately_yes_when_old_claim_only():
     assert should_run_immediately(now, history, TARGETS_ONE, 1) is True
 
 
+import socket as socket_mod
+from helpers import wait_for_path, wait_for_port
+
+
+def test_wait_for_port_open():
+    srv = socket_mod.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen()
+    try:
+        assert wait_for_port("127.0.0.1", srv.getsockname()[1], 1) is True
+    finally:
+        srv.close()
+
+
+def test_wait_for_port_closed_times_out():
+    srv = socket_mod.socket()
+    srv.bind(("127.0.0.1", 0))
+    port = srv.getsockname()[1]
+    srv.close()
+    started = time.monotonic()
+    assert wait_for_port("127.0.0.1", port, 0.2) is False
+    assert time.monotonic() - started < 1
+
+
+def test_wait_for_path_appears_later():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "X99")
+        threading.Timer(0.1, lambda: open(path, "w").close()).start()
+        assert wait_for_path(path, 2) is True
+        assert wait_for_path(path + "-missing", 0.1) is False
+
+
+from helpers import format_phase_timings
+
+
+def test_format_phase_timings():
+    line = format_phase_timings([("config", 0.004), ("browser", 1.8),
+                                 ("session", 0.456)], 2.3)
+    assert line == "config 0.00s | browser 1.80s | session 0.46s | total 2.30s"
+
+
+def test_format_phase_timings_no_phases():
+    assert format_phase_timings([], 0.1234) == "total 0.12s"
+
+
+from helpers import process_tree_rss, should_hibernate
+
+
+def test_should_hibernate_threshold():
+    now = datetime(2026, 5, 3, 9, 10)
+    assert should_hibernate(now, datetime(2026, 6, 1, 8, 5), 120)
+    assert should_hibernate(now, datetime(2026, 5, 4, 8, 5), 120)
+    # Intra-day gap between slots stays below the threshold
+    assert not should_hibernate(now, datetime(2026, 5, 3, 9, 35), 120)
+    assert not should_hibernate(now, datetime(2026, 5, 3, 11, 10), 120)
+
+
+def test_should_hibernate_disabled():
+    assert not should_hibernate(datetime(2026, 5, 3, 9, 10),
+                                datetime(2026, 6, 1, 8, 5), 0)
+
+
+def _fake_proc(root, pid, ppid, comm, rss_kb):
+    os.makedirs(os.path.join(root, str(pid)))
+    with open(os.path.join(root, str(pid), "stat"), "w") as f:
+        f.write(f"{pid} ({comm}) S {ppid} {pid} {pid} 0 -1\n")
+    with open(os.path.join(root, str(pid), "status"), "w") as f:
+        f.write(f"Name:\t{comm}\nVmRSS:\t  {rss_kb} kB\n")
+
+
+def test_process_tree_rss_sums_descendants():
+    with tempfile.TemporaryDirectory() as root:
+        _fake_proc(root, 10, 1, "chromedriver", 20000)
+        _fake_proc(root, 11, 10, "chromium-browser", 150000)
+        _fake_proc(root, 12, 11, "chromium (renderer)", 90000)
+        _fake_proc(root, 13, 11, "weird) S 10 name", 10000)
+        _fake_proc(root, 20, 1, "python3", 40000)
+        os.makedirs(os.path.join(root, "self"))
+        assert process_tree_rss(10, root) == (20000 + 150000 + 90000 + 10000) * 1024
+        assert process_tree_rss(12, root) == 90000 * 1024
+        assert process_tree_rss(99, root) == 0
+
+
+def test_process_tree_rss_live_process():
+    assert process_tree_rss(os.getpid()) > 0
+
+
+from helpers import format_page_weight, summarise_page_weight
+
+
+def test_summarise_page_weight():
+    nav = {"transferSize": 4096, "startTime": 0, "loadEventEnd": 1184.6}
+    resources = [
+        {"initiatorType": "script", "transferSize": 200 * 1024},
+        {"initiatorType": "script", "transferSize": 100 * 1024},
+        {"initiatorType": "css", "transferSize": 80 * 1024},
+        {"initiatorType": "img", "transferSize": 0},  # cached / opaque
+        {"initiatorType": "xmlhttprequest"},
+    ]
+    summary = summarise_page_weight(nav, resources)
+    assert summary["bytes"] == 4096 + 380 * 1024
+    assert summary["requests"] == 6
+    assert summary["load_ms"] == 1185
+    assert summary["by_type"] == {"script": 300 * 1024, "css": 80 * 1024,
+                                  "img": 0, "xmlhttprequest": 0}
+    assert format_page_weight(summary) == (
+        "384 KB in 6 requests, load 1185 ms (script 300 KB, css 80 KB)")
+
+
+def test_summarise_page_weight_before_load():
+    summary = summarise_page_weight({"transferSize": 0, "loadEventEnd": 0}, [])
+    assert summary == {"bytes": 0, "requests": 1, "load_ms": None, "by_type": {}}
+    assert format_page_weight(summary) == "0 KB in 1 requests, load not finished"
+    assert summarise_page_weight(None, [])["requests"] == 0
+
+
+from journal import ClaimJournal
+
+
+def test_journal_record_and_replay_keeps_every_month():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "claims.jsonl")
+        journal = ClaimJournal(path)
+        assert journal.load() == {}
+        journal.record("Pingo Doce", "2026-04", "AAA111", "30/04/2026",
+                       datetime(2026, 4, 1, 8, 5, 2))
+        entry = journal.record("Pingo Doce", "2026-05", "BBB222", "31/05/2026",
+                               datetime(2026, 5, 1, 8, 5, 1))
+        journal.record("Domino's", "2026-05", "(portal-sync)", "31/05/2026",
+                       datetime(2026, 5, 1, 9, 0), source="sync")
+        assert entry["code"] == "BBB222"
+        with open(path) as f:
+            assert len(f.readlines()) == 3
+
+        replayed = ClaimJournal(path)
+        view = replayed.load()
+        assert view["Pingo Doce"]["month"] == "2026-05"
+        assert view["Domino's"]["source"] == "sync"
+        assert replayed.claims_in("2026-04")["Pingo Doce"]["code"] == "AAA111"
+        assert unclaimed_for_month(TARGETS_TWO, view, "2026-05") == []
+        assert unclaimed_for_month(TARGETS_TWO, view, "2026-06") == [
+            "Pingo Doce", "Domino's"]
+
+
+def test_journal_migrates_legacy_history():
+    with tempfile.TemporaryDirectory() as d:
+        legacy = os.path.join(d, "claim_history.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            save_history(legacy, "Pingo Doce", "2026-05", "ABC123",
+                         "31/05/2026", datetime(2026, 5, 1, 8, 5))
+            journal = ClaimJournal(os.path.join(d, "claims.jsonl"),
+                                   legacy_path=legacy)
+            view = journal.load()
+        assert view["Pingo Doce"]["code"] == "ABC123"
+        assert view["Pingo Doce"]["source"] == "migrated"
+        # Only migrated once: later legacy writes are ignored
+        save_history(legacy, "Galp", "2026-05", "X", "31/05/2026",
+                     datetime(2026, 5, 2))
+        assert "Galp" not in ClaimJournal(journal.path, legacy).load()
+
+
+def test_journal_skips_torn_last_line():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "claims.jsonl")
+        journal = ClaimJournal(path)
+        journal.load()
+        journal.record("Pingo Doce", "2026-05", "ABC123", "31/05/2026",
+                       datetime(2026, 5, 1, 8, 5))
+        with open(path, "a") as f:
+            f.write('{"name": "Galp", "month": "2026-0')
+        journal = ClaimJournal(path)
+        assert list(journal.load()) == ["Pingo Doce"]
+        journal.record("Galp", "2026-05", "XYZ", "31/05/2026",
+                       datetime(2026, 5, 1, 9, 0))
+        assert sorted(ClaimJournal(path).load()) == ["Galp", "Pingo Doce"]
+
+
+def test_journal_compacts_duplicates():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "claims.jsonl")
+        journal = ClaimJournal(path, compact_slack=4)
+        journal.load()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(8):
+                journal.record("Pingo Doce", "2026-05", f"C{i}", "31/05/2026",
+                               datetime(2026, 5, 1, 8, i))
+        with open(path) as f:
+            assert len(f.readlines()) <= 5
+        view = ClaimJournal(path).load()
+        assert view["Pingo Doce"]["code"] == "C7"
+
+
+from helpers import end_of_day_time, next_attempt_per_target
+
+
+def test_next_attempt_per_target():
+    now = datetime(2026, 5, 3, 8, 10)
+    history = {"Pingo Doce": {"month": "2026-05", "code": "X"}}
+    slots = next_attempt_per_target(now, history, TARGETS_TWO, 1, SLOTS)
+    assert slots == {"Pingo Doce": datetime(2026, 6, 1, 8, 5),
+                     "Domino's": datetime(2026, 5, 3, 8, 35)}
+
+
+def test_end_of_day_time():
+    assert end_of_day_time(datetime(2026, 5, 3, 8, 10), SLOTS, 15) == \
+        datetime(2026, 5, 3, 9, 20)
+    assert end_of_day_time(datetime(2026, 5, 3, 9, 20), SLOTS, 15) == \
+        datetime(2026, 5, 4, 9, 20)
+    assert end_of_day_time(datetime(2026, 5, 31, 22, 0), ["09:05", "08:05"],
+                           0) == datetime(2026, 6, 1, 9, 5)
+
+
+from datetime import timedelta
+from scheduler import Scheduler
+
+
+def _soon(seconds):
+    return datetime.now() + timedelta(seconds=seconds)
+
+
+def test_scheduler_runs_jobs_in_due_order():
+    sched = Scheduler(coalesce_seconds=0)
+    sched.schedule(_soon(0.15), "sync")
+    sched.schedule(_soon(0.05), "attempt", key="attempt:A", strict=True)
+    first = sched.next_batch()
+    assert [j.key for j in first] == ["attempt:A"]
+    assert [j.key for j in sched.next_batch()] == ["sync"]
+    assert sched.next_batch() == []
+
+
+def test_scheduler_strict_jobs_never_run_early():
+    sched = Scheduler(coalesce_seconds=1.0)
+    sched.schedule(_soon(0.0), "keepalive")
+    strict = sched.schedule(_soon(0.3), "attempt", key="attempt:A",
+                            strict=True)
+    sched.schedule(_soon(0.8), "sync")
+    sched.schedule(_soon(5), "attempt", key="attempt:B", strict=True)
+    batch = sched.next_batch()
+    # keepalive waits for the strict attempt, sync is pulled forward
+    assert [j.key for j in batch] == ["keepalive", "attempt:A", "sync"]
+    assert datetime.now() >= strict.due
+    assert [j.key for j in sched.pending()] == ["attempt:B"]
+
+
+def test_scheduler_replaces_and_cancels_by_key():
+    sched = Scheduler(coalesce_seconds=0)
+    sched.schedule(_soon(60), "attempt", key="attempt:A", strict=True)
+    sched.schedule(_soon(0.05), "attempt", key="attempt:A", strict=True)
+    sched.schedule(_soon(0.01), "sync")
+    assert sched.cancel("sync") and not sched.cancel("sync")
+    assert [j.key for j in sched.pending()] == ["attempt:A"]
+    batch = sched.next_batch()
+    assert len(batch) == 1 and batch[0].due < _soon(1)
+
+
+def test_scheduler_replans_when_job_added_from_other_thread():
+    sched = Scheduler(coalesce_seconds=0)
+    sched.schedule(_soon(30), "sync")
+    threading.Timer(0.05, lambda: sched.schedule(_soon(0), "attempt",
+                                                 key="attempt:now")).start()
+    started = time.monotonic()
+    assert [j.key for j in sched.next_batch()] == ["attempt:now"]
+    assert time.monotonic() - started < 5
+
+
+def test_scheduler_notices_wall_clock_jump():
+    offset = [0.0]
+    sched = Scheduler(coalesce_seconds=0, max_sleep=0.05,
+                      clock=lambda: time.time() + offset[0])
+    job = sched.schedule(datetime.now() + timedelta(hours=1), "sync")
+    threading.Timer(0.1, lambda: offset.__setitem__(0, 3600.0)).start()
+    buf = io.StringIO()
+    started = time.monotonic()
+    with contextlib.redirect_stdout(buf):
+        assert sched.next_batch() == [job]
+    assert time.monotonic() - started < 5
+    assert "Wall clock jumped +3600s" in buf.getvalue()
+
+
+def test_scheduler_records_drift():
+    sched = Scheduler(coalesce_seconds=0)
+    sched.schedule(_soon(0.2), "attempt", key="attempt:A", strict=True)
+    sched.next_batch()
+    assert 0 <= sched.last_drift < 0.02, sched.last_drift
+
+
+def test_scheduler_stop_event():
+    sched = Scheduler()
+    stop = threading.Event()
+    sched.schedule(_soon(60), "sync")
+    def _stop():
+        stop.set()
+        sched.wake()
+    threading.Timer(0.05, _stop).start()
+    assert sched.next_batch(stop) == []
+
+
+from restock import (
+    RestockLog,
+    choose_slots,
+    expected_hit_rate,
+    exploration_slots,
+    learned_slots,
+    restock_density,
+    restock_intervals,
+)
+
+
+def _restock_records(days: int, last_out: str, seen_in: str) -> list:
+    """A target seen sold out at `last_out` and in stock at `seen_in` on
+    each of `days` days."""
+    log_ = RestockLog(None)
+    for day in range(1, days + 1):
+        base = datetime(2026, 5, day)
+        log_.observe("Pingo Doce", "esgotado",
+                     at=parse_attempt_time(last_out, base))
+        log_.observe("Pingo Doce", "disponivel",
+                     at=parse_attempt_time(seen_in, base))
+    return log_.records
+
+
+def test_restock_log_records_only_transitions():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "restock.jsonl")
+        log_ = RestockLog(path)
+        log_.observe("Pingo Doce", "esgotado", 0, at=datetime(2026, 5, 3, 7, 50))
+        assert log_.observe("Pingo Doce", "esgotado", 0,
+                            at=datetime(2026, 5, 3, 7, 55)) is None
+        assert log_.observe("Pingo Doce", "precisa_login",
+                            at=datetime(2026, 5, 3, 7, 57)) is None
+        rec = log_.observe("Pingo Doce", "disponivel", 40,
+                           at=datetime(2026, 5, 3, 8, 5))
+        assert rec["prev_state"] == "out" and rec["state"] == "in"
+        assert rec["since"] == "2026-05-03T07:55:00"
+        assert log_.observe("Pingo Doce", "disponivel", 38,
+                            at=datetime(2026, 5, 3, 8, 6))["codigos"] == 38
+
+        reloaded = RestockLog(path)
+        assert len(reloaded.load()) == 3
+        # The last known state survives a restart
+        assert reloaded.observe("Pingo Doce", "disponivel", 38,
+                                at=datetime(2026, 5, 3, 8, 10)) is None
+
+
+def test_restock_intervals_and_density():
+    records = _restock_records(2, "07:58", "08:02")
+    intervals = restock_intervals(records, "Pingo Doce")
+    assert intervals == [(datetime(2026, 5, 1, 7, 58), datetime(2026, 5, 1, 8, 2)),
+                         (datetime(2026, 5, 2, 7, 58), datetime(2026, 5, 2, 8, 2))]
+    density = restock_density(intervals)
+    assert abs(sum(density) - 1) < 1e-9
+    assert abs(density[8 * 60] - 0.2) < 1e-9
+    assert density[7 * 60 + 57] == 0 and density[8 * 60 + 3] == 0
+    assert restock_density([]) == [0.0] * 1440
+
+
+def test_restock_density_codigos_increase_counts_as_restock():
+    log_ = RestockLog(None)
+    log_.observe("Pingo Doce", "saldo_insuficiente", 2,
+                 at=datetime(2026, 5, 3, 9, 0))
+    log_.observe("Pingo Doce", "saldo_insuficiente", 30,
+                 at=datetime(2026, 5, 3, 9, 30))
+    assert restock_intervals(log_.records, "Pingo Doce") == [
+        (datetime(2026, 5, 3, 9, 0), datetime(2026, 5, 3, 9, 30))]
+
+
+def test_choose_slots_beats_static_slots():
+    density = restock_density(restock_intervals(
+        _restock_records(6, "07:26", "07:30"), "Pingo Doce"))
+    learned = choose_slots(density, 3, 10)
+    assert learned == ["07:30"]  # one slot covers it; no budget wasted
+    assert expected_hit_rate(density, learned, 10) > 0.99
+    assert expected_hit_rate(density, SLOTS, 10) < 0.5
+    assert choose_slots([0.0] * 1440, 3, 10) == []
+
+
+def test_learned_slots_need_min_events():
+    records = _restock_records(3, "07:56", "08:00")
+    assert learned_slots(records, ["Pingo Doce", "Domino's"], 2, 10, 4) == {}
+    learned = learned_slots(records, ["Pingo Doce", "Domino's"], 2, 10, 3)
+    assert list(learned) == ["Pingo Doce"]
+
+
+def _follow_learned_slots(days: int, static: list, explore: int) -> list:
+    """Attempt at the learned slots (the static ones until there are
+    enough restocks) for `days` days, against a target that restocks at
+    10:40 and sells out at 14:00. Returns the slots learned at the end."""
+    log_, slots = RestockLog(None), static
+    for day in range(days):
+        base = datetime(2026, 5, 1) + timedelta(days=day)
+        for slot in slots:
+            at = parse_attempt_time(slot, base)
+            in_stock = (parse_attempt_time("10:40", base) <= at
+                        < parse_attempt_time("14:00", base))
+            log_.observe("Pingo Doce", "disponivel" if in_stock else "esgotado",
+                         at=at)
+        slots = learned_slots(log_.records, ["Pingo Doce"], 3, 10, 5, static,
+                              explore, base.date()).get("Pingo Doce", static)
+    return slots
+
+
+def test_exploration_moves_learned_slots_to_the_restock():
+    static = ["08:05", "12:00", "18:00"]
+    # Learned slots alone settle early in the first interval seen (08:05 →
+    # 12:00), only ever see the voucher sold out there, and never move
+    stuck = _quietly(_follow_learned_slots, 40, static, 0)
+    assert stuck == ["08:15", "08:26", "08:37"], stuck
+    # One exploration slot keeps narrowing the interval until a learned slot
+    # lands within the 10-minute window after the 10:40 restock
+    found = _quietly(_follow_learned_slots, 40, static, 1)
+    assert any("10:40" <= s <= "10:50" for s in found), found
+    assert len(found) == 3 and set(found) & set(static), found
+
+
+def test_exploration_slots_rotate_daily():
+    static = ["08:05", "08:35", "09:05"]
+    picks = [exploration_slots(static, ["08:35"], 1,
+                               datetime(2026, 5, d).date())
+             for d in range(1, 5)]
+    assert sorted({p[0] for p in picks}) == ["08:05", "09:05"], picks
+    assert picks[0] != picks[1]
+    assert learned_slots(_restock_records(3, "07:56", "08:00"), ["Pingo Doce"],
+                         1, 10, 3, static, 1) == {"Pingo Doce": ["08:00"]}
+
+
+def test_next_attempt_per_target_uses_learned_times():
+    now = datetime(2026, 5, 3, 7, 0)
+    slots = next_attempt_per_target(now, {}, TARGETS_TWO, 1, SLOTS,
+                                    {"Pingo Doce": ["07:30", "12:00"]})
+    assert slots == {"Pingo Doce": datetime(2026, 5, 3, 7, 30),
+                     "Domino's": datetime(2026, 5, 3, 8, 5)}
+
+
+import urllib.error
+import urllib.request
+from control import ControlServer, load_or_create_token
+
+CONTROL_TOKEN = "t0ken"
+
+
+def _control(sched, token=CONTROL_TOKEN):
+    claimed = {"Pingo Doce"}
+    server = ControlServer(
+        sched, [t["name"] for t in TARGETS_TWO],
+        pending=lambda: [t["name"] for t in TARGETS_TWO
+                         if t["name"] not in claimed],
+        state=lambda: {"targets": sorted(claimed)},
+        history=lambda: {"2026-05": {"Pingo Doce": {"code": "X"}}},
+        token=token)
+    port = server.start(host="127.0.0.1", port=0)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def _call(url, method="GET", headers=None):
+    if headers is None:
+        headers = {"Authorization": f"Bearer {CONTROL_TOKEN}"}
+    req = urllib.request.Request(url, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_control_attempt_wakes_the_scheduler():
+    sched = Scheduler()
+    sched.schedule(datetime.now() + timedelta(hours=3), "attempt",
+                   key="attempt:Domino's",
+                   payload={"target": "Domino's", "slot": None}, strict=True)
+    server, base = _control(sched)
+    try:
+        result = {}
+        waiter = threading.Thread(
+            target=lambda: result.update(batch=sched.next_batch()))
+        waiter.start()
+        started = time.monotonic()
+        status, body = _call(f"{base}/attempt", "POST")
+        waiter.join(5)
+        assert status == 202 and body == {"queued": ["Domino's"]}
+        assert time.monotonic() - started < 1
+        assert [(j.key, j.payload["slot"]) for j in result["batch"]] == \
+            [("manual:Domino's", None)]
+        # The 3h slot job is still there
+        assert [j.key for j in sched.pending()] == ["attempt:Domino's"]
+    finally:
+        server.stop()
+
+
+def test_control_routes():
+    sched = Scheduler()
+    server, base = _control(sched)
+    try:
+        assert _call(f"{base}/attempt?target=Galp", "POST")[0] == 404
+        assert _call(f"{base}/attempt?target=Pingo%20Doce", "POST") == \
+            (202, {"queued": []})
+        assert _call(f"{base}/sync", "POST") == (202, {"queued": ["sync"]})
+        assert _call(f"{base}/attempt")[0] == 405
+        assert _call(f"{base}/state") == (200, {"targets": ["Pingo Doce"]})
+        assert _call(f"{base}/history")[1]["2026-05"]["Pingo Doce"]["code"] == "X"
+        status, body = _call(f"{base}/next")
+        assert status == 200 and body["next_attempt"] is None
+        assert [j["key"] for j in body["jobs"]] == ["sync"]
+    finally:
+        server.stop()
+
+
+def test_control_token():
+    server, base = _control(Scheduler(), token="s3cret")
+    try:
+        assert _call(f"{base}/state", headers={})[0] == 401
+        assert _call(f"{base}/state",
+                     headers={"Authorization": "Bearer wrong"})[0] == 401
+        assert _call(f"{base}/state",
+                     headers={"Authorization": "Bearer s3cret"})[0] == 200
+    finally:
+        server.stop()
+    try:
+        ControlServer(Scheduler(), [], list, dict, dict).start(port=0)
+        assert False, "started without a token"
+    except ValueError:
+        pass
+
+
+def test_control_token_generated_once():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "control_token")
+        token, created = load_or_create_token(path)
+        assert created and len(token) >= 24
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert load_or_create_token(path) == (token, False)
+
+
+from helpers import entity_slug
+
+
+def test_entity_slug():
+    assert entity_slug("Pingo Doce") == "pingo_doce"
+    assert entity_slug("Domino's Pizzas") == "dominos_pizzas"
+    assert entity_slug("Continente Bom Dia - Açores") == "continente_bom_dia_acores"
+    assert entity_slug("!!") == "target"
+
+
+def _publisher_or_skip():
+    try:
+        import requests  # noqa: F401
+    except ImportError as e:
+        raise SkipTest(f"requests not installed ({e})")
+    from ha_publisher import StatePublisher
+    return StatePublisher
+
+
+class _CoreApiStandIn(BaseHTTPRequestHandler):
+    """Stand-in for the Supervisor's /core/api/states endpoint."""
+
+    received = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.received.append((self.path, self.headers["Authorization"], body))
+        self.send_response(200 if self.path.startswith("/core/api/") else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def _core_api_stand_in():
+    handler = type("_CoreApi", (_CoreApiStandIn,), {"received": []})
+    server, base = _serve(handler)
+    return server, f"{base}/core/api", handler
+
+
+def test_publisher_posts_only_changed_entities():
+    StatePublisher = _publisher_or_skip()
+    server, base, core = _core_api_stand_in()
+    doc = {"sensor.edp_voucher_monitor": {"state": "running", "attributes": {}},
+           "sensor.edp_voucher_pingo_doce": {"state": "esgotado",
+                                             "attributes": {"code": None}}}
+    publisher = StatePublisher(base, "tok", source=lambda: doc)
+    try:
+        assert publisher.publish_now() == 2
+        assert publisher.publish_now() == 0
+        doc["sensor.edp_voucher_pingo_doce"] = {
+            "state": "reclamado", "attributes": {"code": "ABC123"}}
+        assert publisher.publish_now() == 1
+    finally:
+        server.shutdown()
+    assert [(p, a) for p, a, _ in core.received][:2] == [
+        ("/core/api/states/sensor.edp_voucher_monitor", "Bearer tok"),
+        ("/core/api/states/sensor.edp_voucher_pingo_doce", "Bearer tok")]
+    assert core.received[-1][2] == {"state": "reclamado",
+                                    "attributes": {"code": "ABC123"}}
+
+
+def test_publisher_rate_limits_bursts():
+    StatePublisher = _publisher_or_skip()
+    server, base, core = _core_api_stand_in()
+    state = {"n": 0}
+    publisher = StatePublisher(
+        base, "tok", min_interval=0.3, refresh_seconds=60,
+        source=lambda: {"sensor.x": {"state": str(state["n"]),
+                                     "attributes": {}}})
+    try:
+        publisher.start()
+        deadline = time.monotonic() + 2
+        while not core.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for n in range(1, 6):  # a burst of changes within one interval
+            state["n"] = n
+            publisher.changed()
+            time.sleep(0.01)
+        time.sleep(0.6)
+    finally:
+        publisher.stop()
+        server.shutdown()
+    assert [body["state"] for _, _, body in core.received] == ["0", "5"]
+
+
+def test_publisher_retries_after_failure():
+    StatePublisher = _publisher_or_skip()
+    server, base, core = _core_api_stand_in()
+    doc = {"sensor.x": {"state": "a", "attributes": {}}}
+    publisher = StatePublisher(base.replace("/core/api", "/wrong"), "tok",
+                               source=lambda: doc)
+    buf = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(buf):
+            assert publisher.publish_now() == 0
+            assert publisher.publish_now() == 0
+            publisher.base_url = base
+            assert publisher.publish_now() == 1
+    finally:
+        server.shutdown()
+    assert buf.getvalue().count("state update failed") == 1
+    assert "working again" in buf.getvalue()
+
+
+from supervisor import (
+    BrowserSupervisor,
+    BrowserUnavailable,
+    CircuitBreaker,
+    StepTimeout,
+    is_dead_session,
+    is_navigation_error,
+)
+
+
+class _FakeSession:
+    """Duck-typed BrowserSession: kill() unblocks whatever waits on
+    `killed`, like SIGKILLing chromedriver fails its pending call."""
+
+    def __init__(self, launches_ok=True):
+        self.driver = object()
+        self.launches_ok = launches_ok
+        self.launches = 0
+        self.kills = 0
+        self.killed = threading.Event()
+
+    def launch(self):
+        self.launches += 1
+        self.killed.clear()
+        self.driver = object() if self.launches_ok else None
+        return self.launches_ok
+
+    def kill(self):
+        self.kills += 1
+        self.driver = None
+        self.killed.set()
+
+
+def _quietly(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def test_is_dead_session():
+    InvalidSession = type("InvalidSessionIdException", (Exception,), {})
+    assert is_dead_session(InvalidSession("x"))
+    assert is_dead_session(Exception("Message: chrome not reachable"))
+    assert is_dead_session(RuntimeError("Message: disconnected: not connected "
+                                        "to DevTools"))
+    try:
+        try:
+            raise ConnectionRefusedError(111, "refused")
+        except ConnectionRefusedError as e:
+            raise RuntimeError("urlopen failed") from e
+    except RuntimeError as e:
+        assert is_dead_session(e)
+    assert not is_dead_session(Exception("no such element: .submit-button"))
+    assert not is_dead_session(TimeoutError("render took too long"))
+
+
+def test_is_navigation_error():
+    Stale = type("StaleElementReferenceException", (Exception,), {})
+    assert is_navigation_error(Stale("stale element reference"))
+    assert is_navigation_error(Exception("javascript error: document "
+                                         "unloaded while waiting for result"))
+    assert is_navigation_error(Exception("Runtime.evaluate: Execution "
+                                         "context was destroyed."))
+    assert not is_navigation_error(Exception("javascript error: x is not "
+                                             "defined"))
+    assert not is_navigation_error(Exception("disconnected: document "
+                                              "unloaded"))
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=2, cooldown=60, clock=lambda: now[0])
+    _quietly(breaker.failure)
+    assert breaker.state == "closed"
+    _quietly(breaker.failure)
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] = 61
+    assert breaker.state == "half-open" and breaker.allow()
+    _quietly(breaker.failure)  # the trial failed: open again at once
+    assert breaker.state == "open"
+    now[0] = 122
+    _quietly(breaker.success)
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_supervisor_recovers_dead_session_and_retries():
+    session = _FakeSession()
+    supervisor = BrowserSupervisor(session)
+    calls = []
+
+    def step(x):
+        calls.append(session.driver)
+        if len(calls) == 1:
+            raise RuntimeError("invalid session id")
+        return x * 2
+
+    assert _quietly(supervisor.run, "check", step, 21) == 42
+    assert session.kills == 1 and session.launches == 1
+    assert calls[0] is not calls[1]  # retried on the new browser
+    assert supervisor.breaker.failures == 0
+
+
+def test_supervisor_bounds_a_hung_step():
+    session = _FakeSession()
+    supervisor = BrowserSupervisor(session, {"check": 0.2})
+    calls = []
+
+    def step():
+        calls.append(1)
+        if len(calls) == 1:
+            session.killed.wait(30)  # "hung" until the browser is killed
+            raise ConnectionResetError("killed")
+        return "esgotado"
+
+    started = time.monotonic()
+    assert _quietly(supervisor.run, "check", step) == "esgotado"
+    assert time.monotonic() - started < 2
+    assert session.kills == 1 and session.launches == 1
+
+
+def test_supervisor_does_not_retry_unsafe_or_page_errors():
+    session = _FakeSession()
+    supervisor = BrowserSupervisor(session, {"claim": 0.1})
+    try:
+        _quietly(supervisor.run, "claim", lambda: session.killed.wait(30),
+                 retry=False)
+        assert False, "expected StepTimeout"
+    except StepTimeout:
+        pass
+    assert session.launches == 0  # relaunched lazily by the next step
+
+    def page_error():
+        raise ValueError("no such element")
+    try:
+        _quietly(supervisor.run, "check", page_error)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert session.launches == 1 and session.kills == 1
+
+
+def test_supervisor_fails_fast_once_circuit_opens():
+    session = _FakeSession(launches_ok=False)
+    session.driver = None
+    supervisor = BrowserSupervisor(
+        session, breaker=CircuitBreaker(threshold=2, cooldown=600))
+    for _ in range(2):
+        try:
+            _quietly(supervisor.run, "check", lambda: "x")
+            assert False, "expected BrowserUnavailable"
+        except BrowserUnavailable:
+            pass
+    try:
+        _quietly(supervisor.run, "check", lambda: "x")
+        assert False, "expected BrowserUnavailable"
+    except BrowserUnavailable as e:
+        assert "circuit open" in str(e)
+    assert session.launches == 2
+
+
+def _cdp_or_skip():
+    try:
+        import cdp_backend
+    except ImportError as e:
+        raise SkipTest(f"websocket-client / selenium not installed ({e})")
+    return cdp_backend
+
+
+class _CannedConnection:
+    """Stands in for cdp_backend._Connection: replies by method name."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.sent = []
+        self.seq = 0
+
+    def call(self, method, params=None, session_id=None, timeout=30):
+        self.sent.append((method, params, session_id))
+        reply = self.replies[method]
+        return reply(params) if callable(reply) else reply
+
+
+def _canned_cdp_driver(cdp, replies):
+    replies = {"Target.attachToTarget": {"sessionId": "S1"},
+               "Page.enable": {}, **replies}
+    driver = cdp.CdpDriver(process=None, conn=_CannedConnection(replies))
+    driver._attach("T1")
+    return driver
+
+
+def test_cdp_locators_become_css_selectors():
+    cdp = _cdp_or_skip()
+    from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.common.by import By
+    assert cdp.css_selector(By.CSS_SELECTOR, "button.x") == "button.x"
+    assert cdp.css_selector(By.TAG_NAME, "body") == "body"
+    assert cdp.css_selector(By.ID, "codigo") == "#codigo"
+    try:
+        cdp.css_selector(By.XPATH, "//button")
+        assert False, "expected WebDriverException"
+    except WebDriverException as e:
+        assert "not supported" in str(e)
+
+
+def test_cdp_driver_returns_values_elements_and_js_errors():
+    cdp = _cdp_or_skip()
+    from selenium.common.exceptions import JavascriptException
+    results = iter([
+        {"result": {"type": "object", "value": {"ready": True, "n": 2}}},
+        {"result": {"type": "object", "value": {"__edp_element__": True}}},
+        {"result": {"type": "object", "objectId": "obj-7"}},
+        {"result": {"type": "object"},
+         "exceptionDetails": {"exception": {"description": "TypeError: x"}}},
+    ])
+    driver = _canned_cdp_driver(
+        cdp, {"Runtime.evaluate": lambda params: next(results)})
+    assert driver.execute_script("return {ready: true, n: 2};") == \
+        {"ready": True, "n": 2}
+    element = driver.execute_script("return document.body;")
+    assert isinstance(element, cdp.CdpElement) and element.object_id == "obj-7"
+    try:
+        driver.execute_script("return x.y;")
+        assert False, "expected JavascriptException"
+    except JavascriptException as e:
+        assert "TypeError: x" in str(e)
+    # every page command went to the attached tab's session
+    assert {sid for method, _, sid in driver._conn.sent
+            if method != "Target.attachToTarget"} == {"S1"}
+
+
+def test_cdp_driver_find_element_and_closed_tab():
+    cdp = _cdp_or_skip()
+    from selenium.common.exceptions import (NoSuchElementException,
+                                            NoSuchWindowException)
+    driver = _canned_cdp_driver(cdp, {
+        "Runtime.evaluate": {"result": {"type": "object", "subtype": "null"}},
+        "Target.closeTarget": {"success": True},
+    })
+    try:
+        driver.find_element("css selector", "button.edp-large-button")
+        assert False, "expected NoSuchElementException"
+    except NoSuchElementException:
+        pass
+    driver.close()
+    try:
+        driver.current_url
+        assert False, "expected NoSuchWindowException"
+    except NoSuchWindowException:
+        pass
+
+
+import subprocess
+from browser_host import (BrowserHost, devtools_port, profile_owner,
+                          read_devtools_url)
+
+
+def test_read_devtools_url():
+    with tempfile.TemporaryDirectory() as d:
+        port_file = os.path.join(d, "DevToolsActivePort")
+        assert read_devtools_url(port_file) is None
+        with open(port_file, "w") as f:
+            f.write("41234\n")  # Chromium hasn't written the path yet
+        assert read_devtools_url(port_file) is None
+        with open(port_file, "w") as f:
+            f.write("41234\n/devtools/browser/ab-12\n")
+        ws_url = read_devtools_url(port_file)
+        assert ws_url == "ws://127.0.0.1:41234/devtools/browser/ab-12"
+        assert devtools_port(ws_url) == 41234
+
+
+def test_profile_owner_reads_singleton_lock():
+    with tempfile.TemporaryDirectory() as d:
+        assert profile_owner(d) is None
+        os.symlink(f"ha-addon-{os.getpid()}", os.path.join(d, "SingletonLock"))
+        assert profile_owner(d) == os.getpid()
+        os.remove(os.path.join(d, "SingletonLock"))
+        os.symlink("ha-addon-999999999", os.path.join(d, "SingletonLock"))
+        assert profile_owner(d) is None  # stale lock of a dead Chromium
+
+
+class _DevToolsStandIn(BaseHTTPRequestHandler):
+    """Stand-in for a running Chromium's /json/version."""
+
+    ws_url = ""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"webSocketDebuggerUrl": self.ws_url}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_browser_host_reuses_only_a_healthy_matching_browser():
+    with tempfile.TemporaryDirectory() as d:
+        profile = os.path.join(d, "profile")
+        state = os.path.join(d, "browser.json")
+        host = BrowserHost(state, "/usr/bin/chromium-browser", profile)
+        assert host.find(["--headless=new"]) is None
+        # "Chromium": a process with our profile on its command line
+        fake = subprocess.Popen([sys.executable, "-c",
+                                 "import time; time.sleep(60)",
+                                 f"--user-data-dir={profile}"])
+        server = None
+        try:
+            handler = type("_DevTools", (_DevToolsStandIn,), {})
+            server, base = _serve(handler)
+            port = int(base.rsplit(":", 1)[1])
+            ws_url = f"ws://127.0.0.1:{port}/devtools/browser/ab-12"
+            handler.ws_url = ws_url
+            record = {"pid": fake.pid, "ws_url": ws_url, "port": port,
+                      "arguments": ["--headless=new"],
+                      "started_at": "2026-10-18T08:00:00"}
+            with open(state, "w") as f:
+                json.dump(record, f)
+            assert host.find(["--headless=new"]) == record
+            assert fake.poll() is None
+
+            # other switches (blocklist toggled): stopped and forgotten
+            _quietly(host.find, ["--headless=new", "--mute-audio"])
+            assert fake.wait(5) is not None
+            assert not os.path.exists(state)
+        finally:
+            if server is not None:
+                server.shutdown()
+            if fake.poll() is None:
+                fake.kill()
+                fake.wait()
+
+
+def test_browser_host_forgets_a_dead_browser():
+    with tempfile.TemporaryDirectory() as d:
+        state = os.path.join(d, "browser.json")
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        with open(state, "w") as f:
+            json.dump({"pid": dead.pid, "ws_url": "ws://127.0.0.1:1/devtools/"
+                       "browser/x", "port": 1, "arguments": []}, f)
+        host = BrowserHost(state, "/usr/bin/chromium-browser", d)
+        assert _quietly(host.find, []) is None
+        assert not os.path.exists(state)
+
+
+import signal
+from accounts import (AccountRunner, BrowserPool, account_config,
+                      account_plan)
+
+ACCOUNTS_CONFIG = {
+    "ntfy_topic": "edp-main",
+    "accounts": [{"name": "Casa Porto", "ntfy_topic": "edp-porto"},
+                 {"name": "Escritório"},
+                 {"name": "Praia"}],
+    "targets": [{"name": "Pingo Doce", "partner_id": 1197},
+                {"name": "Pingo Doce", "partner_id": 1197,
+                 "account": "Casa Porto"},
+                {"name": "Domino's", "partner_id": 1199,
+                 "account": "Escritório"},
+                {"name": "Galp", "partner_id": 1300, "account": "Sótão"}],
+}
+
+
+def test_account_plan_keeps_indexes_and_skips_accounts_without_targets():
+    plan = _quietly(account_plan, ACCOUNTS_CONFIG, "/data")
+    assert [(a["name"], a["index"], a["slug"]) for a in plan] == [
+        ("Casa Porto", 1, "casa_porto"), ("Escritório", 2, "escritorio")]
+    assert plan[0]["data_dir"] == "/data/accounts/casa_porto"
+    assert plan[0]["ntfy_topic"] == "edp-porto"
+    assert plan[1]["ntfy_topic"] == "edp-main"  # inherited
+
+
+def test_account_config_narrows_targets_and_topic():
+    plan = _quietly(account_plan, ACCOUNTS_CONFIG, "/data")
+    main = account_config(ACCOUNTS_CONFIG)
+    assert main["ntfy_topic"] == "edp-main"
+    assert [t.get("account") for t in main["targets"]] == [None]
+    porto = account_config(ACCOUNTS_CONFIG, plan[0])
+    assert porto["ntfy_topic"] == "edp-porto"
+    assert [(t["name"], t["account"]) for t in porto["targets"]] == [
+        ("Pingo Doce", "Casa Porto")]
+
+
+def test_browser_pool_bounds_holders_across_pools():
+    with tempfile.TemporaryDirectory() as d:
+        first, second = BrowserPool(d, 1), BrowserPool(d, 1)
+        cancel = threading.Event()
+        cancel.set()
+        with first.slot("check"):
+            with first.slot("claim"):  # nested step: same slot
+                assert first._fd is not None
+            with second.slot("check", cancel=cancel):
+                assert second._fd is None  # all taken, gave up
+        with second.slot("check", cancel=cancel):
+            assert second._fd is not None
+        assert first._fd is None and second._fd is None
+
+
+def test_account_runner_starts_and_stops_account_processes():
+    with tempfile.TemporaryDirectory() as d:
+        account = {"name": "Casa Porto", "slug": "casa_porto", "index": 1,
+                   "data_dir": os.path.join(d, "casa_porto"),
+                   "ntfy_topic": "edp-porto"}
+        script = ("import os, time\n"
+                  "path = os.path.join(os.environ['EDP_DATA_DIR'], 'who')\n"
+                  "with open(path, 'w') as f:\n"
+                  "    f.write(os.environ['EDP_ACCOUNT'] + ' '\n"
+                  "            + os.environ['EDP_ACCOUNT_INDEX'] + ' '\n"
+                  "            + os.environ['DISPLAY'])\n"
+                  "time.sleep(60)\n")
+        runner = AccountRunner([account], [sys.executable, "-c", script],
+                               stop_timeout=5)
+        _quietly(runner.start)
+        try:
+            who = os.path.join(account["data_dir"], "who")
+            deadline = time.monotonic() + 10
+            while not (os.path.exists(who) and os.path.getsize(who)):
+                assert time.monotonic() < deadline, "account never started"
+                time.sleep(0.05)
+            with open(who) as f:
+                assert f.read() == "Casa Porto 1 :100"
+        finally:
+            _quietly(runner.stop)
+        proc, _ = runner.procs["Casa Porto"]
+        assert proc.returncode == -signal.SIGTERM
+
+
+def _edp_monitor_or_skip():
+    try:
+        import edp_monitor
+    except (ImportError, SystemExit) as e:
+        raise SkipTest(f"selenium / requests not installed ({e})")
+    return edp_monitor
+
+
+@contextlib.contextmanager
+def _patched(module, **attrs):
+    """Replace module attributes for the block, restoring them after."""
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+class _LiveSession:
+    """A BrowserSession whose browser is up (run_schedule only looks at
+    `driver`)."""
+    driver = object()
+
+
+def test_run_schedule_runs_attempts_before_coalesced_maintenance():
+    em = _edp_monitor_or_skip()
+    ran = []
+
+    def attempt_jobs(driver, config, history, catalog, checker, jobs):
+        ran.append("attempt")
+        return {job.payload["target"]: "esgotado" for job in jobs}
+
+    def sync(driver, history, config, current):
+        ran.append("sync")
+        em.SHUTDOWN.set()
+
+    config = {**em.DEFAULT_CONFIG, "sync_interval_hours": 0.2 / 3600,
+              "keepalive_minutes": 60}
+    sched = Scheduler(coalesce_seconds=1)
+    # A strict attempt just after a flexible sync: one batch
+    sched.schedule(datetime.now() + timedelta(seconds=0.4), "attempt",
+                   key="attempt:Pingo Doce", strict=True,
+                   payload={"target": "Pingo Doce", "slot": None})
+    handler = signal.getsignal(signal.SIGTERM)
+    try:
+        with _patched(em, _run_attempt_jobs=attempt_jobs,
+                      sync_history_from_portal=sync,
+                      schedule_attempts=lambda *args: None,
+                      record_drift=lambda *args: None,
+                      validate_session=lambda *args: ran.append("validate")):
+            _quietly(em.run_schedule, _LiveSession(), config, {}, {}, None,
+                     sched)
+    finally:
+        em.SHUTDOWN.clear()
+        signal.signal(signal.SIGTERM, handler)
+    assert ran == ["attempt", "sync"], ran
+
+
+def test_hibernate_wake_lead_stays_outside_the_attempt_batch():
+    em = _edp_monitor_or_skip()
+
+    class Hibernating:
+        def hibernate(self):
+            return 0
+
+    sched = Scheduler(coalesce_seconds=em.JOB_COALESCE_SECONDS)
+    due = datetime.now() + timedelta(hours=3)
+    config = {**em.DEFAULT_CONFIG, "hibernate_wake_lead_seconds": 30}
+    _quietly(em.hibernate_until, Hibernating(), config, sched, due)
+    wake = sched.peek({"wake"})
+    assert due - wake.due == timedelta(seconds=em.MIN_WAKE_LEAD_SECONDS)
+    assert em.MIN_WAKE_LEAD_SECONDS > em.JOB_COALESCE_SECONDS
+
+
+class _ScriptedDriver:
+    """Answers execute_async_script from `replies` in turn: a value to
+    return, or an exception to raise."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def execute_async_script(self, script, *args):
+        self.calls += 1
+        reply = self.replies.pop(0) if len(self.replies) > 1 \
+            else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def test_wait_for_js_resolves_and_times_out():
+    em = _edp_monitor_or_skip()
+    driver = _ScriptedDriver("element")
+    assert em.wait_for_js(driver, "return 1;", 5) == "element"
+    assert driver.calls == 1
+    try:
+        em.wait_for_js(_ScriptedDriver(None), "return 0;", 5)
+        assert False, "expected TimeoutException"
+    except em.TimeoutException:
+        pass
+
+
+def test_wait_for_js_retries_only_after_navigation():
+    em = _edp_monitor_or_skip()
+    from selenium.common.exceptions import (InvalidSessionIdException,
+                                            JavascriptException)
+    unloaded = JavascriptException("javascript error: document unloaded "
+                                   "while waiting for result")
+    driver = _ScriptedDriver(unloaded, unloaded, "element")
+    assert em.wait_for_js(driver, "return 1;", 5) == "element"
+    assert driver.calls == 3
+
+    for error in (InvalidSessionIdException("invalid session id"),
+                  JavascriptException("javascript error: foo is not defined")):
+        driver = _ScriptedDriver(error, "element")
+        try:
+            em.wait_for_js(driver, "return foo;", 5)
+            assert False, "expected the driver's error"
+        except type(error) as e:
+            assert e is error and driver.calls == 1
+
+    try:
+        em.wait_for_js(_ScriptedDriver(unloaded), "return 1;", 0.2)
+        assert False, "expected TimeoutException"
+    except em.TimeoutException as e:
+        assert e.__cause__ is unloaded
+
+
+class _TabbedDriver:
+    """Fake WebDriver with tabs. `states` gives, per URL, the replies to
+    the parallel tab-state script in turn (the last one repeats)."""
+
+    def __init__(self, states=None):
+        self.states = {url: list(replies)
+                       for url, replies in (states or {}).items()}
+        self.handles = ["main"]
+        self.current = "main"
+        self.urls = {"main": "about:blank"}
+        self.opened = 0
+        self.log = []
+        self.switch_to = self
+
+    # switch_to
+    def window(self, handle):
+        self.current = handle
+
+    def new_window(self, type_hint="tab"):
+        self.opened += 1
+        handle = f"tab{self.opened}"
+        self.handles.append(handle)
+        self.urls[handle] = "about:blank"
+        self.current = handle
+
+    @property
+    def window_handles(self):
+        return list(self.handles)
+
+    @property
+    def current_window_handle(self):
+        return self.current
+
+    @property
+    def current_url(self):
+        return self.urls[self.current]
+
+    def close(self):
+        self.handles.remove(self.current)
+
+    def execute_cdp_cmd(self, cmd, args):
+        self.log.append(("navigate", self.current, args["url"]))
+        self.urls[self.current] = args["url"]
+
+    def execute_script(self, script, *args):
+        if not args:
+            self.log.append(("script", self.current, script))
+            return None
+        replies = self.states[args[0]]
+        state = replies.pop(0) if len(replies) > 1 else replies[0]
+        if state == "redirected":
+            self.urls[self.current] = "https://portal/login"
+        return state
+
+
+def test_read_tabs_checks_rendered_tabs_and_claims_in_priority_order():
+    em = _edp_monitor_or_skip()
+    driver = _TabbedDriver({
+        "u/a": [None, "rendered"], "u/b": ["rendered"],
+        "u/c": ["redirected"], "u/d": ["rendered"], "u/e": ["rendered"],
+        "u/f": [None]})
+    names = "abcdef"
+    tabs = {n: ({"name": n}, f"h{n}", f"u/{n}") for n in names}
+    stock = {"a": "disponivel", "b": "disponivel", "d": "esgotado",
+             "e": "disponivel"}
+    checked, claimed = [], []
+
+    def check(drv, name):
+        assert drv.current == f"h{name}", (drv.current, name)
+        checked.append(name)
+        return stock[name] == "disponivel", stock[name]
+
+    def claim(drv, config, history, name, current, slot):
+        assert drv.current == f"h{name}", (drv.current, name)
+        claimed.append(name)
+        return "reclamado"
+
+    with _patched(em, check_voucher=check, _claim_and_record=claim,
+                  DETAIL_RENDER_TIMEOUT=0.3, PARALLEL_POLL=0.01):
+        states, retry = _quietly(em._read_tabs, driver, {}, {}, "2026-05",
+                                 None, tabs)
+    assert checked == ["b", "d", "e", "a"], checked
+    assert claimed == ["b", "e", "a"], claimed  # round 1, then round 2
+    assert states == {"b": "reclamado", "d": "esgotado", "e": "reclamado",
+                      "a": "reclamado"}, states
+    assert [t["name"] for t in retry] == ["c", "f"], retry
+
+
+def test_attempt_parallel_marks_old_documents_and_closes_tabs():
+    em = _edp_monitor_or_skip()
+    driver = _TabbedDriver()
+    targets = [{"name": "a", "partner_id": 1}, {"name": "b", "partner_id": 2},
+               {"name": "c", "partner_id": 3}]
+    catalog = {"a|1": {"url": "u/a"}, "c|3": {"url": "u/c"}}
+    seen = {}
+
+    def read_tabs(drv, config, history, current, slot, tabs):
+        seen.update(tabs)
+        return {"a": "esgotado"}, [tabs["c"][0]]
+
+    filled = []
+
+    def fill(drv, cat, missing):
+        filled.append([t["name"] for t in missing])  # b's card has no link
+
+    with _patched(em, _read_tabs=read_tabs, fill_detail_urls=fill,
+                  cached_detail_url=lambda cat, t: cat.get(
+                      f"{t['name']}|{t['partner_id']}", {}).get("url")):
+        states, later = _quietly(em._attempt_parallel, driver, {}, {},
+                                 catalog, targets, "2026-05")
+    assert filled == [["b"]], filled
+    assert seen == {"a": (targets[0], "main", "u/a"),
+                    "c": (targets[2], "tab1", "u/c")}, seen
+    # Each tab's old document is marked before its navigation starts
+    assert [(kind, handle) for kind, handle, _ in driver.log] == [
+        ("script", "main"), ("navigate", "main"),
+        ("script", "tab1"), ("navigate", "tab1")], driver.log
+    assert states == {"a": "esgotado"}
+    assert [t["name"] for t in later] == ["c", "b"], later
+    assert driver.window_handles == ["main"] and driver.current == "main"
+
+
+def test_attempt_parallel_fills_missing_urls_in_one_packs_pass():
+    em = _edp_monitor_or_skip()
+    driver = _TabbedDriver()
+    targets = [{"name": "Pingo Doce", "partner_id": 1},
+               {"name": "Continente", "partner_id": 2},
+               {"name": "Galp", "partner_id": 3}]
+    detail = "https://portal/beneficios/detalhe/"
+    catalog = {"Pingo Doce": {"partner_id": 1, "url": detail + "1"}}
+    cards = [{"text": "Continente 5€", "href": detail + "2"},
+             {"text": "Galp 10€", "href": None}]
+    loads, seen = [], {}
+
+    def load_pack_cards(drv, label="packs"):
+        loads.append(label)
+        return cards
+
+    def read_tabs(drv, config, history, current, slot, tabs):
+        seen.update(tabs)
+        return {}, []
+
+    with tempfile.TemporaryDirectory() as d, \
+            _patched(em, load_pack_cards=load_pack_cards, _read_tabs=read_tabs,
+                     CATALOG_PATH=os.path.join(d, "catalog.json")):
+        states, later = _quietly(em._attempt_parallel, driver, {}, {},
+                                 catalog, targets, "2026-05")
+        saved = load_catalog(em.CATALOG_PATH)
+    assert loads == ["packs"]
+    assert [url for _, _, url in seen.values()] == [detail + "1", detail + "2"]
+    assert catalog["Continente"]["url"] == detail + "2"
+    assert saved["Continente"]["partner_id"] == 2 and "Galp" not in saved
+    assert [t["name"] for t in later] == ["Galp"], later
+    assert driver.window_handles == ["main"] and driver.current == "main"
+
+
+def test_race_slot_preloads_tabs_and_falls_back_for_the_rest():
+    em = _edp_monitor_or_skip()
+    driver = _TabbedDriver()
+    targets = [{"name": n, "partner_id": i} for i, n in enumerate("abcd")]
+    opened, raced, leftovers = [], {}, []
+
+    def open_voucher(drv, target, catalog, card=None):
+        opened.append((target["name"], drv.current))
+        if target["name"] == "c":
+            raise RuntimeError("renderer hiccup")
+        return target["name"] != "a"
+
+    def race_tabs(drv, config, history, slot, current, tabs):
+        raced.update(tabs)
+        return {"b": "reclamado", "d": "esgotado"}
+
+    def attempt(drv, config, history, catalog, checker=None, slot=None):
+        leftovers.extend(t["name"] for t in config["targets"])
+        return {name: "esgotado" for name in leftovers}
+
+    slot = datetime(2026, 5, 1, 8, 5)
+    with _patched(em, open_voucher=open_voucher, _race_tabs=race_tabs,
+                  run_one_attempt=attempt, sleep_until=lambda *a, **k: 0.0,
+                  record_drift=lambda *args: None):
+        states = _quietly(em.race_slot, driver, {"targets": targets}, {}, {},
+                          slot)
+    # A failed pre-load in the main tab keeps it; in a new tab, closes it
+    assert opened == [("a", "main"), ("b", "main"), ("c", "tab1"),
+                      ("d", "tab2")], opened
+    assert raced == {"b": "main", "d": "tab2"}, raced
+    assert leftovers == ["a", "c"], leftovers
+    assert states == {"a": "esgotado", "b": "reclamado", "c": "esgotado",
+                      "d": "esgotado"}, states
+    assert driver.window_handles == ["main"] and driver.current == "main"
+
+
+class _RacingDriver(_TabbedDriver):
+    """Race tabs whose button enables at `enables` ({handle: datetime});
+    records every reload."""
+
+    def __init__(self, enables):
+        super().__init__()
+        self.enables = enables
+        self.reloads = []
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def refresh(self):
+        self.reloads.append((self.current, datetime.now()))
+
+    def execute_async_script(self, script, slice_ms, poll_ms):
+        enable = self.enables.get(self.current)
+        if enable is not None and datetime.now() >= enable:
+            return True
+        time.sleep(slice_ms / 1000)
+        return False
+
+
+def test_race_tabs_reloads_from_the_slot_and_claims_enabled_buttons():
+    em = _edp_monitor_or_skip()
+    slot = datetime.now() + timedelta(seconds=0.3)
+    driver = _RacingDriver({"ha": slot + timedelta(seconds=0.1)})
+    claimed, checked = [], []
+
+    def claim(drv, config, history, name, current, claim_slot):
+        claimed.append((name, drv.current, claim_slot))
+        return "reclamado"
+
+    def check(drv, name):
+        checked.append((name, drv.current))
+        return False, "esgotado"
+
+    config = {"race_poll_ms": 20, "race_window_seconds": 0.8}
+    with _patched(em, RACE_RELOAD_EVERY=0.2, _claim_and_record=claim,
+                  check_voucher=check, RESTOCKS=RestockLog(None)):
+        states = _quietly(em._race_tabs, driver, config, {}, slot, "2026-05",
+                          {"a": "ha", "b": "hb"})
+    assert states == {"a": "reclamado", "b": "esgotado"}, states
+    assert claimed == [("a", "ha", slot)], claimed
+    assert checked == [("b", "hb")], checked  # final check as the window shut
+    assert driver.reloads and all(at >= slot for _, at in driver.reloads)
+    b_reloads = [at for handle, at in driver.reloads if handle == "hb"]
+    assert 2 <= len(b_reloads) <= 5, b_reloads
+    gaps = [(b - a).total_seconds() for a, b in zip(b_reloads, b_reloads[1:])]
+    assert all(gap >= 0.2 for gap in gaps), gaps
+
+
+import types
+
+
+class _CountingPool:
+    """Stands in for BrowserPool: records each slot taken, by step."""
+
+    def __init__(self):
+        self.taken = []
+        self.held = False
+
+    @contextlib.contextmanager
+    def slot(self, label, cancel=None):
+        assert not self.held, f"{label} taken while the slot is held"
+        self.taken.append(label)
+        self.held = True
+        try:
+            yield
+        finally:
+            self.held = False
+
+
+def test_race_takes_the_pool_per_browser_step():
+    em = _edp_monitor_or_skip()
+    slot = datetime.now() + timedelta(seconds=0.2)
+    pool = _CountingPool()
+    driver = _RacingDriver({"ha": slot})
+    driver.supervisor = types.SimpleNamespace(
+        run=lambda step, fn, *args, retry, deadline: fn(*args))
+    config = {"race_poll_ms": 20, "race_window_seconds": 0.4}
+
+    def race(drv, *args):
+        assert not pool.held  # the race as a whole holds no slot
+        return em._race_tabs(drv, config, {}, slot, "2026-05",
+                             {"a": "ha", "b": "hb"})
+
+    def claim(drv, config, history, name, current, claim_slot):
+        assert pool.held  # still in the slice that saw the button
+        return "reclamado"
+
+    with _patched(em, BROWSER_POOL=pool, RACE_RELOAD_EVERY=0.2,
+                  _claim_and_record=claim,
+                  check_voucher=lambda drv, name: (False, "esgotado"),
+                  RESTOCKS=RestockLog(None)):
+        states = _quietly(em.supervised, driver, "race", race, driver,
+                          pooled=False)
+    assert states == {"a": "reclamado", "b": "esgotado"}, states
+    assert "race" not in pool.taken
+    assert pool.taken.count("race poll") >= 3 and pool.taken[-1] == "race check"
+
+
+class _ClaimElement:
+    def __init__(self, text=""):
+        self.text = text
+        self.clicks = 0
+
+    def click(self):
+        self.clicks += 1
+
+    def send_keys(self, *keys):
+        pass
+
+
+class _ClaimDriver:
+    """A detail page whose claim flow goes through at once."""
+
+    def __init__(self):
+        self.elements = {".code-card-body-text-code": _ClaimElement("D1234"),
+                         ".code-card-body-text-date":
+                             _ClaimElement("Até 31 Mai 2026")}
+
+    def find_element(self, by, selector):
+        return self.elements.setdefault(selector, _ClaimElement())
+
+    def execute_script(self, script, *args):
+        return None
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def execute_async_script(self, script, *args):
+        return self.find_element("css", "submit")
+
+
+def test_claim_voucher_logs_slot_to_submit_latency():
+    em = _edp_monitor_or_skip()
+    slot = datetime.now() - timedelta(seconds=1)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = em.claim_voucher(_ClaimDriver(), "Pingo Doce", slot)
+        em.claim_voucher(_ClaimDriver(), "Pingo Doce")
+    assert result == {"code": "D1234", "validity": "31 Mai 2026"}, result
+    lines = [line for line in out.getvalue().splitlines()
+             if "Submit clicked" in line]
+    assert len(lines) == 2, lines
+    latency = int(lines[0].split("slot→submit ")[1].split(" ms")[0])
+    assert 1000 <= latency < 5000, lines[0]
+    assert "slot→submit" not in lines[1]
+
+
+class _ActiveCodesDriver:
+    """/beneficios/ativos with two active codes and a card without a
+    partner line."""
+
+    def __init__(self):
+        self.scripts = 0
+
+    def get(self, url):
+        pass
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def execute_async_script(self, script, *args):
+        return True
+
+    def execute_script(self, script, *args):
+        self.scripts += 1
+        if "link.click()" in script:
+            return True
+        return [{"partner": "Dia-a-dia Pingo Doce",
+                 "text": "10 €\nDia-a-dia Pingo Doce\nAté 31 Mai 2026"},
+                {"partner": None, "text": "Banner"},
+                {"partner": "Lazer Domino's", "text": "Até 31 Mai 2026"}]
+
+
+def test_fetch_active_codes_reads_all_cards_in_one_script():
+    em = _edp_monitor_or_skip()
+    driver = _ActiveCodesDriver()
+    active = _quietly(em.fetch_active_codes, driver)
+    assert [partner for partner, _ in active] == ["Dia-a-dia Pingo Doce",
+                                                  "Lazer Domino's"], active
+    assert active[0][1].endswith("Até 31 Mai 2026")
+    assert driver.scripts == 2  # the navbar click, then every card at once
+
+
+def test_schedule_attempts_keeps_a_slot_that_came_up_meanwhile():
+    em = _edp_monitor_or_skip()
+    sched = Scheduler()
+    missed = datetime.now() - timedelta(seconds=30)
+    sched.schedule(missed, "attempt", key="attempt:Pingo Doce", strict=True,
+                   payload={"target": "Pingo Doce", "slot": missed})
+    config = {**em.DEFAULT_CONFIG, "start_day": 1}
+    em.schedule_attempts(sched, config, {})
+    (job,) = sched.pending({"attempt"})
+    assert job.due == missed, job
+
+
+from helpers import by_priority
+
+
+def test_by_priority_orders_targets():
+    targets = [{"name": "a"}, {"name": "b", "priority": 2},
+               {"name": "c", "priority": 1}, {"name": "d"},
+               {"name": "e", "priority": 1}]
+    assert [t["name"] for t in by_priority(targets)] == ["c", "e", "b", "a",
+                                                         "d"]
+    assert by_priority(targets[:1]) == targets[:1]
+    assert [t["name"] for t in targets] == ["a", "b", "c", "d", "e"]
+
+
+from display import DisplayStack
+
+
+class _FakeDisplayStack(DisplayStack):
+    def __init__(self, *args, commands=None, **kwargs):
+        kwargs.setdefault("tmp_dir", tempfile.mkdtemp())
+        super().__init__(*args, **kwargs)
+        self.commands = commands or [("sleeper", ["sleep", "30"],
+                                      lambda: True)]
+
+    def _commands(self):
+        return self.commands
+
+
+def test_display_stack_idle_teardown():
+    stack = _FakeDisplayStack(display=":99", idle_timeout=0.1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert stack.ensure_started() is True
+        assert stack.running()
+        stack.release()
+        time.sleep(0.5)
+    assert not stack.running() and stack.procs == {}
+
+
+def test_display_stack_reuse_cancels_teardown():
+    stack = _FakeDisplayStack(display=":99", idle_timeout=0.2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stack.ensure_started()
+        pid = stack.procs["sleeper"].pid
+        stack.release()
+        assert stack.ensure_started() is True
+        time.sleep(0.4)
+        assert stack.running() and stack.procs["sleeper"].pid == pid
+        stack.stop()
+    assert not stack.running()
+
+
+def test_display_stack_stops_leftovers_of_a_dead_monitor():
+    with tempfile.TemporaryDirectory() as d:
+        with contextlib.redirect_stdout(io.StringIO()):
+            old = _FakeDisplayStack(display=":99", tmp_dir=d)
+            assert old.ensure_started()
+            orphan = old.procs["sleeper"]
+            with open(os.path.join(d, ".X99-lock"), "w") as f:
+                f.write(f"{orphan.pid:>10}\n")
+            # The monitor died without stop(): a new one takes over
+            new = _FakeDisplayStack(display=":99", tmp_dir=d)
+            assert new.ensure_started()
+            try:
+                assert orphan.wait(5) is not None
+                assert not os.path.exists(os.path.join(d, ".X99-lock"))
+                assert new.procs["sleeper"].poll() is None
+            finally:
+                new.stop()
+
+
+def test_display_stack_fails_when_its_process_exits():
+    stack = _FakeDisplayStack(
+        display=":99",
+        commands=[("quitter", ["sh", "-c", "exit 3"],
+                   lambda: time.sleep(0.2) is None)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert stack.ensure_started() is False
+    assert stack.procs["quitter"].returncode == 3
+
+
+from tracing import Tracer, format_report, load_spans, percentile, summarise_spans
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 100) == 100
+    assert percentile([7], 95) == 7
+
+
+def test_tracer_records_duration_and_attrs():
+    tracer = Tracer(None)
+    tracer.attempt = "2026-05-04T08:05:00"
+    with tracer.span("check_voucher", target="Pingo Doce"):
+        time.sleep(0.01)
+    (span,) = tracer.spans
+    assert span["name"] == "check_voucher" and span["ok"] is True, span
+    assert span["target"] == "Pingo Doce"
+    assert span["attempt"] == "2026-05-04T08:05:00"
+    assert span["end_ns"] - span["start_ns"] == span["dur_ns"]
+    assert span["dur_ns"] >= 10_000_000, span["dur_ns"]
+
+
+def test_tracer_records_exception_and_reraises():
+    tracer = Tracer(None)
+    try:
+        with tracer.span("claim.2_modal"):
+            raise KeyError("x")
+        assert False, "should have raised"
+    except KeyError:
+        pass
+    assert tracer.spans[0]["ok"] is False
+    assert tracer.spans[0]["error"] == "KeyError"
+
+
+def test_tracer_measure_records_external_duration():
+    tracer = Tracer(None)
+    tracer.attempt = "2026-05-01T08:05:00"
+    tracer.measure("timer.drift", -1_500_000, jobs="attempt:A")
+    rec = tracer.spans[0]
+    assert rec["name"] == "timer.drift" and rec["dur_ns"] == -1_500_000
+    assert rec["jobs"] == "attempt:A" and rec["attempt"] == "2026-05-01T08:05:00"
+    assert rec["end_ns"] - rec["start_ns"] == -1_500_000
+    assert summarise_spans(tracer.spans)[0][1:3] == (1, -1.5)
+
+
+def test_tracer_traced_decorator():
+    tracer = Tracer(None)
+
+    @tracer.traced("notify_phone")
+    def f(x):
+        return x * 2
+
+    assert f(21) == 42
+    assert tracer.spans[0]["name"] == "notify_phone"
+
+
+def test_tracer_file_is_bounded():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "trace.jsonl")
+        tracer = Tracer(path, max_spans=10)
+        for i in range(40):
+            with tracer.span(f"s{i}"):
+                pass
+        spans = load_spans(path)
+        assert 10 <= len(spans) <= 15, len(spans)
+        assert spans[-1]["name"] == "s39"
+        # A fresh tracer picks up the existing line count.
+        assert Tracer(path, max_spans=10)._lines == len(spans)
+
+
+def test_summarise_spans_groups_by_name():
+    spans = [{"name": "a", "dur_ns": 1_000_000},
+             {"name": "b", "dur_ns": 5_000_000},
+             {"name": "a", "dur_ns": 3_000_000},
+             {"name": "broken"}]
+    rows = summarise_spans(spans)
+    assert rows == [("a", 2, 1.0, 3.0, 3.0), ("b", 1, 5.0, 5.0, 5.0)], rows
+    report = format_report(rows)
+    assert report.splitlines()[0].split() == ["step", "n", "p50", "ms", "p95",
+                                              "ms", "max", "ms"], report
+    assert len(report.splitlines()) == 3
+
+
+import urllib.error
+import urllib.request
+from mock_portal import MockPortal, end_of_month_validity
+
+
+def _get(url: str) -> tuple:
+    """GET without following redirects → (status, location, body)."""
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+    opener = urllib.request.build_opener(NoRedirect)
+    try:
+        with opener.open(url) as resp:
+            return resp.status, None, resp.read().decode("utf-8")
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get("Location"), e.read().decode("utf-8")
+
+
+def test_end_of_month_validity_parses_back():
+    validity = end_of_month_validity(datetime(2026, 2, 10))
+    assert validity == "28 Fev 2026", validity
+    assert parse_validity_to_month("Até " + validity) == "2026-02"
+
+
+def test_mock_portal_serves_app_shell_on_deep_links():
+    portal = MockPortal()
+    base = portal.start()
+    try:
+        for path in ("/beneficios/pack", "/beneficios/detalhe/1197-pingo-doce",
+                     "/beneficios/ativos"):
+            status, _, body = _get(base + path)
+            assert status == 200, (path, status)
+            assert "benefits-card" in body and "edp-large-button" in body
+            assert "ngb-modal-window" in body and "Códigos ativos" in body
+    finally:
+        portal.stop()
+
+
+def test_mock_portal_login_redirect():
+    portal = MockPortal(login_required=True)
+    base = portal.start()
+    try:
+        status, location, _ = _get(base + "/beneficios/pack")
+        assert status == 302 and location == "/login", (status, location)
+        status, _, body = _get(base + "/login")
+        assert "Iniciar sessão" in body and len(body) < 500
+        _get(base + "/mock/login")
+        assert _get(base + "/beneficios/pack")[0] == 200
+    finally:
+        portal.stop()
+
+
+def test_mock_portal_claim_takes_stock_and_lists_active_code():
+    portal = MockPortal(partners=[{"partner_id": 1197, "name": "Pingo Doce",
+                                   "category": "Dia-a-dia", "value": "10 €",
+                                   "stock": 1}])
+    base = portal.start()
+    try:
+        req = urllib.request.Request(base + "/mock/claim/1197", method="POST")
+        with urllib.request.urlopen(req) as resp:
+            entry = json.loads(resp.read())
+        assert entry["code"].startswith("D"), entry
+        try:
+            urllib.request.urlopen(urllib.request.Request(
+                base + "/mock/claim/1197", method="POST"))
+            assert False, "second claim should be refused"
+        except urllib.error.HTTPError as e:
+            assert e.code == 409
+        state = json.loads(_get(base + "/mock/state")[2])
+        assert state["partners"][0]["stock"] == 0
+        active = [(c["category"] + " " + c["name"], "Até " + c["validity"])
+                  for c in state["claimed"]]
+        got = find_claimed_targets(active, TARGETS_ONE,
+                                   month_key(datetime.now()))
+        assert list(got) == ["Pingo Doce"], got
+    finally:
+        portal.stop()
+
+
+def test_mock_portal_set_endpoint_changes_scenario():
+    portal = MockPortal()
+    base = portal.start()
+    try:
+        _get(base + "/mock/set?stock=1199:5&render_delay_ms=250"
+                    "&sold_out_on_cards=1")
+        assert portal.partner(1199)["stock"] == 5
+        assert portal.render_delay_ms == 250
+        assert portal.sold_out_on_cards is True
+    finally:
+        portal.stop()
+
+
+def test_http_checker_against_mock_portal_api():
+    HttpChecker = _http_checker_or_skip()
+    portal = MockPortal()
+    base = portal.start()
+    try:
+        checker = HttpChecker(base + "/api/vouchers/{partner_id}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert checker.check(TARGETS_TWO[0]) == (True, "disponivel")
+            assert checker.check(TARGETS_TWO[1]) == (False, "esgotado")
+            portal.insufficient_balance = True
+            assert checker.check(TARGETS_TWO[0]) == (False,
+                                                     "saldo_insuficiente")
+            portal.login_required = True
+            assert checker.check(TARGETS_TWO[0]) == (None, "precisa_login")
+    finally:
+        portal.stop()
+
+
 if __name__ == "__main__":
     sys.exit(run_all_tests())
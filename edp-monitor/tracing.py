@@ -0,0 +1,164 @@
+# tracing.py — lightweight span tracer for EDP Voucher Monitor
+"""
+Records how long each step of the check / claim pipeline takes, as spans
+with monotonic-nanosecond start, end and duration, appended to a bounded
+JSONL file. Stdlib only.
+
+Report across attempts with: python3 tracing.py [/data/trace.jsonl]
+"""
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from helpers import log
+
+
+class Tracer:
+    """Append spans to `path`, keeping at most `max_spans` of the newest.
+
+    The file is trimmed back to `max_spans` lines once it grows 50% past
+    that, so steady-state writes stay appends. `path=None` keeps spans in
+    memory only (`self.spans`, same bound).
+    """
+
+    def __init__(self, path: str | None, max_spans: int = 5000):
+        self.path = path
+        self.max_spans = max_spans
+        self.attempt = None
+        self.spans = []
+        self._lock = threading.Lock()
+        self._lines = self._count_lines()
+        self._write_failed = False
+
+    def _count_lines(self) -> int:
+        if self.path is None:
+            return 0
+        try:
+            with open(self.path, "rb") as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """Time the enclosed block as span `name`. Exceptions are recorded
+        (ok=False, error=type name) and re-raised."""
+        record = {"name": name, **attrs}
+        start = time.monotonic_ns()
+        try:
+            yield record
+            record["ok"] = True
+        except BaseException as e:
+            record["ok"] = False
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.monotonic_ns()
+            # Resolved at the end so a span wrapping a whole attempt picks up
+            # the attempt id set inside it.
+            record.update(attempt=self.attempt, start_ns=start, end_ns=end, dur_ns=end - start,
+                          ts=datetime.now().isoformat(timespec="milliseconds"))
+            self._record(record)
+
+    def measure(self, name: str, dur_ns: int, **attrs) -> None:
+        """Record a duration measured elsewhere (e.g. timer drift, which may
+        be negative) as a span ending now, so it shows up in the report."""
+        end = time.monotonic_ns()
+        self._record({"name": name, **attrs, "ok": True,
+                      "attempt": self.attempt, "start_ns": end - dur_ns,
+                      "end_ns": end, "dur_ns": dur_ns,
+                      "ts": datetime.now().isoformat(timespec="milliseconds")})
+
+    def traced(self, name: str):
+        """Decorator form of span() for whole functions."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def _record(self, record: dict) -> None:
+        with self._lock:
+            if self.path is None:
+                self.spans.append(record)
+                del self.spans[:-self.max_spans]
+                return
+            try:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._lines += 1
+                if self._lines > self.max_spans * 3 // 2:
+                    self._trim()
+            except OSError as e:
+                if not self._write_failed:
+                    self._write_failed = True
+                    log(f"Trace file {self.path} not writable: {e}", "WARN")
+
+    def _trim(self) -> None:
+        with open(self.path) as f:
+            keep = f.readlines()[-self.max_spans:]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(keep)
+        os.replace(tmp, self.path)
+        self._lines = len(keep)
+
+
+def load_spans(path: str) -> list:
+    """Read span records from a trace file, skipping unparseable lines."""
+    spans = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return spans
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))  # ceil without math
+    return ordered[int(rank) - 1]
+
+
+def summarise_spans(spans: list) -> list:
+    """Group spans by name → [(name, count, p50_ms, p95_ms, max_ms)], in
+    order of first appearance."""
+    by_name = {}
+    for s in spans:
+        if "name" in s and "dur_ns" in s:
+            by_name.setdefault(s["name"], []).append(s["dur_ns"] / 1e6)
+    return [(name, len(d), percentile(d, 50), percentile(d, 95), max(d))
+            for name, d in by_name.items()]
+
+
+def format_report(rows: list) -> str:
+    width = max([len("step")] + [len(r[0]) for r in rows])
+    lines = [f"{'step':<{width}}  {'n':>5}  {'p50 ms':>9}  {'p95 ms':>9}  "
+             f"{'max ms':>9}"]
+    for name, n, p50, p95, mx in rows:
+        lines.append(f"{name:<{width}}  {n:>5}  {p50:>9.1f}  {p95:>9.1f}  "
+                     f"{mx:>9.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    trace_path = sys.argv[1] if len(sys.argv) > 1 else "/data/trace.jsonl"
+    spans = load_spans(trace_path)
+    attempts = {s.get("attempt") for s in spans if s.get("attempt")}
+    print(f"{len(spans)} spans across {len(attempts)} attempt(s) "
+          f"from {trace_path}\n")
+    print(format_report(summarise_spans(spans)))